@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+"""
+Media file hashing throughput benchmark of the pysd script.
+
+Creates a large set of media files (sparse files which head and tail, the
+parts read for the www.opensubtitles.org hash, are filled with data) and
+reports the files per second hashed by the opensubtitles.org downloader with
+and without direct I/O. The first round of each mode runs with a cold page
+cache when the benchmark may drop it (it runs as root), the rest with a warm
+one.
+
+Usage: bench_hashing.py [FILES [ROUNDS]]
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pysd
+
+FILE_SIZE = 700 * 1024 * 1024
+CHUNK_SIZE = 65536
+
+
+def create_files(directory, count):
+    """Creates the media files and returns their paths."""
+
+    paths = []
+
+    for file_id in range(count):
+        path = os.path.join(directory, "show.s{0:02d}e{1:02d}.avi".format(file_id // 100 + 1, file_id % 100 + 1))
+
+        with open(path, "wb") as media_file:
+            media_file.write(os.urandom(CHUNK_SIZE))
+            media_file.seek(FILE_SIZE - CHUNK_SIZE)
+            media_file.write(os.urandom(CHUNK_SIZE))
+
+        paths.append(path)
+
+    return paths
+
+
+def drop_page_cache():
+    """Drops the page cache if permitted. Returns True on success."""
+
+    if hasattr(os, "sync"):
+        os.sync()
+
+    try:
+        with open("/proc/sys/vm/drop_caches", "w") as drop_caches:
+            drop_caches.write("1\n")
+    except EnvironmentError:
+        return False
+
+    return True
+
+
+def time_hashing(paths, direct_io):
+    """Hashes the files with a new downloader and returns the wall time."""
+
+    downloader = pysd.Opensubtitles_org(direct_io = direct_io)
+
+    start_time = time.time()
+    hashes = downloader._Opensubtitles_org__get_file_hashes(paths)
+    elapsed = time.time() - start_time
+
+    errors = [ value for value in hashes.values() if isinstance(value, Exception) ]
+    if errors:
+        raise errors[0]
+
+    return elapsed
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    temp_dir = tempfile.mkdtemp(prefix = "pysd-bench-")
+
+    try:
+        paths = create_files(temp_dir, count)
+
+        for direct_io in ( False, True ):
+            mode = "direct I/O" if direct_io else "buffered"
+
+            if drop_page_cache():
+                elapsed = time_hashing(paths, direct_io)
+                print("{0:<10} cold: {1:8.0f} files/s".format(mode, count / elapsed))
+
+            elapsed = min( time_hashing(paths, direct_io) for round in range(rounds) )
+            print("{0:<10} warm: {1:8.0f} files/s (best of {2})".format(mode, count / elapsed, rounds))
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+if __name__ == "__main__":
+    main()
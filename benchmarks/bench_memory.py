@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Memory benchmark of the pysd downloaders' caches.
+
+Fills the www.tvsubtitles.net cache with a TV show catalogue and the
+episodes' subtitles, and the www.opensubtitles.org cache with media files'
+lookups, from generated pages (no network requests are made), and reports
+the memory (as traced by tracemalloc) held per cached TV show, episode and
+media file.
+
+Usage: bench_memory.py [SHOWS [EPISODES [FILES]]]
+"""
+
+import gc
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pysd
+
+# Episodes per season of the generated TV shows.
+SEASON_EPISODES = 20
+
+# TV shows which episodes' subtitles are cached.
+EPISODE_SHOWS = 200
+
+SUBTITLES_LIST = (
+    '<a href="/subtitle-1234567.html"><img src="images/flags/en.gif"><p title="downloaded">5000</p></a>'
+    '<a href="/subtitle-1234568.html"><img src="images/flags/ru.gif"><p title="downloaded">50</p></a>' )
+
+SUBTITLES_URL = "http://dl.opensubtitles.org/en/download/src-api/vrf-19c30c60/sid-abcdefabcdef/filead/{0}.gz"
+
+
+def get_url_contents(url, max_data_size = None, stats = None, proxy = None, retry = True):
+    """Returns the generated www.tvsubtitles.net episode and subtitles lists."""
+
+    name = url.rsplit("/", 1)[1]
+
+    if name.startswith("tvshow-"):
+        show_id = int(name.split("-")[1])
+        return ( '<td></td><td><a href="episode-{0}-1.html">All</a>'.format(show_id) + "".join(
+            '<td>1x{0:02d}</td><td><a href="/episode-{1}.html">Episode</a>'.format(episode, show_id * 100 + episode)
+            for episode in range(1, SEASON_EPISODES + 1) ) ).encode()
+
+    return SUBTITLES_LIST.encode()
+
+
+def get_traced_memory():
+    gc.collect()
+    return tracemalloc.get_traced_memory()[0]
+
+
+def main():
+    shows = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    episode_shows = min(shows, int(sys.argv[2]) // SEASON_EPISODES if len(sys.argv) > 2 else EPISODE_SHOWS)
+    files = int(sys.argv[3]) if len(sys.argv) > 3 else 20000
+
+    show_list = "".join(
+        '<a href="/tvshow-{0}-1.html">Show number {1}</a>'.format(show_id + 1000, show_id) for show_id in range(shows) )
+
+    pysd.get_url_contents = get_url_contents
+    pysd.iter_url_contents = lambda url, *args, **kwargs: iter([ show_list.encode() ])
+
+    tracemalloc.start()
+
+    # The TV show names are counted as the cache keys
+    tvsubtitles = pysd.Tvsubtitles_net(use_catalogue_snapshot = False)
+    start_memory = get_traced_memory()
+    tvsubtitles._Tvsubtitles_net__cache.update(tvsubtitles._Tvsubtitles_net__fetch_shows())
+    show_memory = get_traced_memory() - start_memory
+
+    start_memory = get_traced_memory()
+    for show_id in range(episode_shows):
+        for episode in range(1, SEASON_EPISODES + 1):
+            tvsubtitles._Tvsubtitles_net__get_episode_subtitles("show number {0}".format(show_id), 1, episode)
+    episode_memory = get_traced_memory() - start_memory
+
+    # The paths are held by the caller, and the URLs are counted
+    opensubtitles = pysd.Opensubtitles_org()
+    paths = [ "/media/tv/Show {0}/show.s01e{1:02d}.avi".format(file_id // 20, file_id % 20) for file_id in range(files) ]
+
+    start_memory = get_traced_memory()
+    for file_id, path in enumerate(paths):
+        opensubtitles._Opensubtitles_org__set_cached(path, "en", SUBTITLES_URL.format(file_id))
+        opensubtitles._Opensubtitles_org__set_cached(path, "ru", None)
+    file_memory = get_traced_memory() - start_memory
+
+    print("per show:    {0:5d} bytes ({1} shows, including the name)".format(show_memory // shows, shows))
+    print("per episode: {0:5d} bytes ({1} episodes with 2 subtitles)".format(
+        episode_memory // (episode_shows * SEASON_EPISODES), episode_shows * SEASON_EPISODES))
+    print("per file:    {0:5d} bytes ({1} files with 2 languages, including the URL)".format(file_memory // files, files))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+"""
+Startup benchmark of the pysd script.
+
+Reports the pysd module import time (as `python -X importtime` does) and
+the wall time of a no-op run: a run over a directory which media files
+already have subtitles, so no network requests are made. Also checks that
+the no-op run doesn't write anything to the cache directory.
+
+Usage: bench_startup.py [RUNS]
+"""
+
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+PYSD_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PYSD_PATH = os.path.join(PYSD_DIR, "pysd.py")
+
+
+def get_import_times():
+    """Returns (self, cumulative) import time of the pysd module in seconds."""
+
+    output = subprocess.check_output(
+        [ sys.executable, "-X", "importtime", "-c", "import pysd" ],
+        cwd = PYSD_DIR, stderr = subprocess.STDOUT).decode("utf-8")
+
+    for line in output.splitlines():
+        match = re.match(r"import time:\s+(\d+) \|\s+(\d+) \|\s+pysd$", line)
+        if match:
+            return int(match.group(1)) / 1e6, int(match.group(2)) / 1e6
+
+    raise Exception("pysd import time is not found in the output:\n" + output)
+
+
+def time_noop_run(library_dir, cache_dir):
+    """Runs pysd over the library and returns its wall time in seconds."""
+
+    env = dict(os.environ, XDG_CACHE_HOME = cache_dir)
+
+    start_time = time.time()
+    subprocess.check_call([ sys.executable, PYSD_PATH, "-l", "en", library_dir ], env = env)
+    return time.time() - start_time
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    temp_dir = tempfile.mkdtemp(prefix = "pysd-bench-")
+
+    try:
+        library_dir = os.path.join(temp_dir, "library")
+        cache_dir = os.path.join(temp_dir, "cache")
+        os.makedirs(library_dir)
+
+        for episode in range(1, 11):
+            for extension in ( "avi", "en.srt" ):
+                open(os.path.join(library_dir, "show.s01e{0:02d}.{1}".format(episode, extension)), "w").close()
+
+        import_times = [ get_import_times() for run in range(runs) ]
+        run_times = [ time_noop_run(library_dir, cache_dir) for run in range(runs) ]
+
+        print("pysd import (self):       {0:.4f}s (min of {1})".format(min( t[0] for t in import_times ), runs))
+        print("pysd import (cumulative): {0:.4f}s (min of {1})".format(min( t[1] for t in import_times ), runs))
+        print("no-op run:                {0:.4f}s (min of {1})".format(min(run_times), runs))
+
+        written = [ os.path.join(path, name) for path, dirs, files in os.walk(cache_dir) for name in dirs + files ]
+        print("cache files written:      {0}".format(written or "none"))
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -34,33 +34,88 @@ if sys.version_info < (2, 7):
     else:
         raise Exception("pysd needs python >= 2.7")
 
-import getopt
-import gzip
+import array
+import atexit
+import bisect
+import codecs
+import collections
+import errno
+import heapq
+import importlib
+import io
+import itertools
 import locale
+import mmap
 import os
 import re
 import signal
 import stat
 import struct
+import threading
 import time
-import urllib
-import zipfile
+import zlib
 
 PY3 = sys.version_info >= (3,)
 """True if we are running under Python 3."""
 
+
+class Lazy_module:
+    """
+    A module proxy which imports the module on the first attribute access, so
+    the modules which are not needed for the current run are not imported at
+    startup.
+    """
+
+    # Name of the module.
+    __name = None
+
+    # The imported module.
+    __module = None
+
+
+    def __init__(self, name):
+        self.__name = name
+
+
+    def __getattr__(self, name):
+        if self.__module is None:
+            self.__module = importlib.import_module(self.__name)
+
+        return getattr(self.__module, name)
+
+
+base64 = Lazy_module("base64")
+getopt = Lazy_module("getopt")
+gzip = Lazy_module("gzip")
+hashlib = Lazy_module("hashlib")
+json = Lazy_module("json")
+shutil = Lazy_module("shutil")
+socket = Lazy_module("socket")
+tempfile = Lazy_module("tempfile")
+zipfile = Lazy_module("zipfile")
+
 if PY3:
-    from http.client import HTTPConnection
     from io import BytesIO
-    from urllib.request import urlopen
-    from urllib.parse import urlparse
-    import xmlrpc.client as xmlrpclib
+
+    http_client = Lazy_module("http.client")
+    socketserver = Lazy_module("socketserver")
+    url_parse = Lazy_module("urllib.parse")
+    url_request = Lazy_module("urllib.request")
+    xmlrpclib = Lazy_module("xmlrpc.client")
+
+    # For getproxies()
+    urllib = url_request
 else:
-    from httplib import HTTPConnection
     from StringIO import StringIO as BytesIO
-    from urllib2 import urlopen
-    from urlparse import urlparse
-    import xmlrpclib
+
+    http_client = Lazy_module("httplib")
+    socketserver = Lazy_module("SocketServer")
+    url_parse = Lazy_module("urlparse")
+    url_request = Lazy_module("urllib2")
+    xmlrpclib = Lazy_module("xmlrpclib")
+
+    # For getproxies()
+    urllib = Lazy_module("urllib")
 
     str = unicode
     range = xrange
@@ -72,6 +127,7 @@ __all__ = [
     "Tvsubtitles_net",
 
     "LANGUAGES",
+    "LANGUAGE_REGISTRY",
     "MEDIA_EXTENSIONS",
     "SUBTITLE_EXTENSIONS"
 ]
@@ -86,6 +142,35 @@ SUBTITLE_EXTENSIONS = ("*.srt",)
 # Network timeout in seconds.
 NETWORK_TIMEOUT = 30
 
+# Size of data chunks read from the network.
+NETWORK_CHUNK_SIZE = 64 * 1024
+
+# Default maximum size of the data downloaded from a URL.
+MAX_DATA_SIZE = 1024 * 1024
+
+# Directory for the pysd cache files.
+CACHE_DIR = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "pysd")
+
+# Maximum number of recently downloaded subtitles which are kept in memory by
+# each downloader to serve the copies of the same media files.
+DOWNLOADS_CACHE_SIZE = 64
+
+# Maximum number of recently downloaded season subtitles packs which are kept
+# unpacked in memory until their episodes' subtitles are placed.
+SEASON_PACKS_CACHE_SIZE = 8
+
+# TV show catalogue snapshots older than this age (in seconds) are refreshed
+# in background.
+CATALOGUE_SNAPSHOT_MAX_AGE = 24 * 60 * 60
+
+# Default maximum network traffic (in bytes) of a round of the upcoming
+# episodes prefetching.
+PREFETCH_BUDGET = 16 * 1024 * 1024
+
+# Maximum number of concurrent requests to a host (the actual number is
+# adapted to the host, see Concurrency_limiter).
+MAX_CONCURRENCY = 16
+
 
 class Tv_show_tools:
     """Provides a set of tools for working with TV show video files."""
@@ -93,6 +178,22 @@ class Tv_show_tools:
     # Objects that downloads subtitles.
     __downloaders = None
 
+    # Maximum number of files for which subtitles info is cached at once.
+    __prefetch_size = 100
+
+    # Delay (in seconds) between starting the requests to the subtitles
+    # sources in the hedged lookup mode (None if the mode is disabled).
+    __hedge_delay = None
+
+    # Journal of the work done during the run (if used).
+    __journal = None
+
+    # Local store of the downloaded subtitles (if used).
+    __store = None
+
+    # Work leases shared with the concurrent runs (if used).
+    __leases = None
+
     # TV show file name exceptions.
     __file_name_exceptions = {
         "house":     "house m.d.",
@@ -104,12 +205,166 @@ class Tv_show_tools:
         "lostfilm.tv", "novafilm.tv" ))
 
 
-    def __init__(self, use_opensubtitles = False):
+    def __init__(self, use_opensubtitles = False, hedge_delay = None, journal = None, store = None, shared_with = None,
+                 direct_io = False, leases = None, endpoints = None):
+        """
+        hedge_delay - if specified, enables the hedged lookup mode: all
+        subtitles sources are queried concurrently with the specified delay
+        (in seconds) between starting the requests, and the result of the most
+        preferred source which has the subtitles is used.
+
+        journal - a Run_journal object. The work which is recorded in it as
+        finished is skipped, and the work done is recorded to it.
+
+        store - a Subtitles_store object. Subtitles are downloaded only if they
+        are not in the store yet and are placed from it.
+
+        shared_with - a Tv_show_tools object which subtitles sources (with
+        their caches and sessions) are used instead of creating new ones
+        (use_opensubtitles is ignored in this case).
+
+        direct_io - if True, media files are read for hashing bypassing the
+        page cache (see Opensubtitles_org).
+
+        leases - a Work_leases object. Subtitles for a media file are
+        downloaded only under a lease, so the concurrent runs on the same
+        media files split the work.
+
+        endpoints - a dictionary of lists of Endpoint objects (mirrors and
+        proxies) by subtitles source names ("www.opensubtitles.org",
+        "www.tvsubtitles.net").
+        """
+
         self.__downloaders = []
+        self.__hedge_delay = hedge_delay
+        self.__journal = journal
+        self.__store = store
+        self.__leases = leases
+
+        if shared_with is not None:
+            self.__downloaders = shared_with.__downloaders
+        else:
+            endpoints = endpoints or {}
+
+            if use_opensubtitles:
+                self.__downloaders += [( "www.opensubtitles.org",
+                    Opensubtitles_org(journal, direct_io, endpoints.get("www.opensubtitles.org")) )]
+            self.__downloaders += [( "www.tvsubtitles.net", Tvsubtitles_net(endpoints = endpoints.get("www.tvsubtitles.net")) )]
+
+
+    def export_cache(self, path):
+        """
+        Exports the caches of the subtitles sources to a cache bundle (see
+        Cache_bundle) which may be imported by other pysd instances.
+        """
+
+        try:
+            Cache_bundle.save(path, itertools.chain.from_iterable(
+                ( [ downloader_name ] + record for record in downloader.export_cache() )
+                for downloader_name, downloader in self.__downloaders if hasattr(downloader, "export_cache") ))
+        except Exception as e:
+            raise Error("Unable to export cache bundle '{0}': {1}.", path, e)
+
+
+    def import_cache(self, path):
+        """
+        Merges a cache bundle (see Cache_bundle) into the caches of the
+        subtitles sources. The entries are merged by their update time.
+        """
+
+        try:
+            for downloader_name, downloader in self.__downloaders:
+                if hasattr(downloader, "import_cache"):
+                    downloader.import_cache(
+                        record[1:] for record in Cache_bundle.load(path) if record[0] == downloader_name )
+        except Error:
+            raise
+        except Exception as e:
+            raise Error("Unable to import cache bundle '{0}': invalid cache record ({1}).", path, e)
+
+
+    def get_metrics(self):
+        """
+        Returns a dictionary of the metrics: "sources" - the subtitles sources'
+        metrics by their names, "hosts" - the adaptive concurrency limiters'
+        info and traffic by hosts (see Concurrency_limiter).
+        """
+
+        return {
+            "sources": dict(
+                ( downloader_name, downloader.get_metrics() )
+                    for downloader_name, downloader in self.__downloaders if hasattr(downloader, "get_metrics") ),
+            "hosts": CONCURRENCY_LIMITERS.get_metrics(),
+        }
+
+
+    def get_library_episodes(self, tv_show_paths, recursive = False):
+        """
+        Returns a list of (TV show possible names, season, episode) tuples of
+        the last episodes of the TV shows which media files are in the
+        specified directories (or are specified explicitly).
+        """
+
+        last_episodes = {}
+        media_extensions = [ ext[1:] for ext in MEDIA_EXTENSIONS ]
+
+        while tv_show_paths:
+            subdirectories = []
+
+            for tv_show_path in tv_show_paths:
+                if os.path.isdir(tv_show_path):
+                    try:
+                        file_paths = [ os.path.join(tv_show_path, file_name) for file_name in sorted(os.listdir(tv_show_path)) ]
+                    except EnvironmentError as e:
+                        self.log_error("Error while reading directory '{0}': {1}.", tv_show_path, e)
+                        continue
+
+                    if recursive:
+                        subdirectories += [ file_path for file_path in file_paths if os.path.isdir(file_path) ]
+                else:
+                    file_paths = [ tv_show_path ]
+
+                for file_path in file_paths:
+                    if os.path.splitext(file_path)[1].lower() not in media_extensions:
+                        continue
+
+                    try:
+                        names, season, episode = self.get_info_from_filename(os.path.basename(file_path))[:3]
+                    except Not_found:
+                        continue
+
+                    names = tuple(names)
+                    last_episodes[names] = max(( season, episode ), last_episodes.get(names, ( season, episode )))
+
+            tv_show_paths = subdirectories
+
+        return [ ( list(names), season, episode ) for names, (season, episode) in sorted(last_episodes.items()) ]
+
 
-        if use_opensubtitles:
-            self.__downloaders += [( "www.opensubtitles.org", Opensubtitles_org() )]
-        self.__downloaders += [( "www.tvsubtitles.net", Tvsubtitles_net() )]
+    def prefetch_upcoming(self, last_episodes, max_bytes = None):
+        """
+        Prefetches the subtitles info of the episodes which follow the
+        specified ones (see get_library_episodes()), so when they appear,
+        their subtitles are found without waiting for the subtitles sources.
+
+        last_episodes may be any iterable: it's consumed lazily, so it may
+        delay the prefetching (till the idle time, for example). Stops when
+        max_bytes of the network traffic are spent. Returns the number of
+        bytes spent.
+        """
+
+        spent = 0
+
+        for last_episode in last_episodes:
+            for downloader_name, downloader in self.__downloaders:
+                if max_bytes is not None and spent >= max_bytes:
+                    return spent
+
+                if hasattr(downloader, "prefetch_upcoming"):
+                    spent += downloader.prefetch_upcoming(
+                        [ last_episode ], None if max_bytes is None else max_bytes - spent)
+
+        return spent
 
 
     def get_info_from_filename(self, filename):
@@ -194,12 +449,8 @@ class Tv_show_tools:
                 "subtitles" if is_subtitles else "video" )
 
         if is_subtitles:
-            if extra_info and (
-                len(extra_info[-1]) == 2 and extra_info[-1] in LANGUAGES or
-                len(extra_info[-1]) == 3 and extra_info[-1] in LANGUAGES.values()
-            ):
-                language = extra_info[-1]
-            else:
+            language = LANGUAGE_REGISTRY.get(extra_info[-1]) if extra_info else None
+            if language is None:
                 language = "en"
 
             return ( names, season, episode, delimiter, language )
@@ -207,101 +458,244 @@ class Tv_show_tools:
             return ( names, season, episode, delimiter, extra_info )
 
 
-    def get_subtitles(self, tv_show_paths, languages, recursive = False):
+    def get_subtitles(self, tv_show_paths, languages, recursive = False, time_budget = None):
         """
         Gets a list of paths to a TV show video file or to a directories with
         TV show video file(s) and downloads subtitles for this TV shows for the
         specified languages, if they are not downloaded yet.
 
+        The work is done in priority order: the newest media files go first
+        and subtitles for each file are downloaded in the order of the
+        specified languages. If time_budget (in seconds) is specified, the
+        work that has not been started when it expires is skipped and
+        reported.
+
         Returns the number of errors happened.
         """
 
         errors = 0
-        tasks = []
-        subdirectories = []
+        scheduler = Work_scheduler(time_budget)
+        scheduled_items = {}
         files_to_process = []
 
+        unique_languages = []
+        for language in languages:
+            if language not in unique_languages:
+                unique_languages.append(language)
+        languages = unique_languages
+
         media_extensions = [ ext[1:] for ext in MEDIA_EXTENSIONS ]
         subtitles_extensions = [ ext[1:] for ext in SUBTITLE_EXTENSIONS ]
 
         # Gathering file list that we are going to process -->
-        for tv_show_path in tv_show_paths:
-            try:
+        while tv_show_paths:
+            subdirectories = []
+
+            for tv_show_path in tv_show_paths:
                 try:
-                    is_directory = stat.S_ISDIR(os.stat(tv_show_path)[stat.ST_MODE])
-                except Exception as e:
-                    raise Error("Unable to find '{0}': {1}.", tv_show_path, e)
+                    try:
+                        path_stat = os.stat(tv_show_path)
+                        is_directory = stat.S_ISDIR(path_stat.st_mode)
+                    except Exception as e:
+                        raise Error("Unable to find '{0}': {1}.", tv_show_path, e)
 
-                tv_show_path = os.path.abspath(tv_show_path)
-                media_dir = ( tv_show_path if is_directory else os.path.dirname(tv_show_path) )
+                    tv_show_path = os.path.abspath(tv_show_path)
+                    media_dir = ( tv_show_path if is_directory else os.path.dirname(tv_show_path) )
 
-                if not is_directory and os.path.splitext(tv_show_path)[1].lower() not in media_extensions:
-                    raise Error("'{0}' is not a media {1} file.", tv_show_path, MEDIA_EXTENSIONS)
+                    if not is_directory and os.path.splitext(tv_show_path)[1].lower() not in media_extensions:
+                        raise Error("'{0}' is not a media {1} file.", tv_show_path, MEDIA_EXTENSIONS)
 
-                try:
-                    available_subtitles = [
-                        file_name
-                            for file_name in os.listdir(media_dir)
-                                if (
-                                    os.path.splitext(file_name)[1].lower() in subtitles_extensions and
-                                    os.path.isfile(os.path.join(media_dir, file_name))
-                                )
-                    ]
-
-                    if is_directory:
-                        media_files = [
+                    try:
+                        available_subtitles = [
                             file_name
                                 for file_name in os.listdir(media_dir)
                                     if (
-                                        os.path.splitext(file_name)[1].lower() in media_extensions and
+                                        os.path.splitext(file_name)[1].lower() in subtitles_extensions and
                                         os.path.isfile(os.path.join(media_dir, file_name))
                                     )
                         ]
 
-                        if recursive:
-                            subdirectories = [
-                                file_path
-                                    for file_path in ( os.path.join(media_dir, file_name) for file_name in os.listdir(media_dir) )
-                                        if os.path.isdir(file_path)
+                        if is_directory:
+                            media_files = [
+                                file_name
+                                    for file_name in os.listdir(media_dir)
+                                        if (
+                                            os.path.splitext(file_name)[1].lower() in media_extensions and
+                                            os.path.isfile(os.path.join(media_dir, file_name))
+                                        )
                             ]
+
+                            if recursive:
+                                subdirectories += [
+                                    file_path
+                                        for file_path in ( os.path.join(media_dir, file_name) for file_name in os.listdir(media_dir) )
+                                            if os.path.isdir(file_path)
+                                ]
+                            else:
+                                if not media_files:
+                                    raise Error("There are no media {0} files in the directory '{1}'.", MEDIA_EXTENSIONS, media_dir)
                         else:
-                            if not media_files:
-                                raise Error("There are no media {0} files in the directory '{1}'.", MEDIA_EXTENSIONS, media_dir)
-                    else:
-                        media_files = [ os.path.basename(tv_show_path) ]
-                except Error:
-                    raise
+                            media_files = [ os.path.basename(tv_show_path) ]
+                    except Error:
+                        raise
+                    except Exception as e:
+                        raise Error("Error while reading directory '{0}': {1}.", media_dir, e)
+
+                    # The directory is skipped only if no files have been added
+                    # to it since it has been finished
+                    if is_directory and self.__journal is not None and (
+                        self.__journal.get("directory", ( media_dir, )) == path_stat.st_mtime
+                    ):
+                        continue
+
+                    media_files.sort(key = self.__cmp_media_files)
+                    files_to_process += self.__schedule_directory(
+                        scheduler, scheduled_items, media_dir, media_files, available_subtitles, languages, is_directory,
+                        path_stat.st_mtime)
                 except Exception as e:
-                    raise Error("Error while reading directory '{0}': {1}.", media_dir, e)
+                    self.log_error(e)
+                    errors += 1
+
+            subdirectories.sort(key = lambda directory: directory.lower())
+            tv_show_paths = subdirectories
+        # Gathering file list that we are going to process <--
 
-                media_files.sort(key = self.__cmp_media_files)
-                files_to_process += [ os.path.join(media_dir, file_name) for file_name in media_files ]
+        files_to_process = [ file_path for priority, file_path in sorted(files_to_process) ]
+        file_positions = dict( (file_path, file_id) for file_id, file_path in enumerate(files_to_process) )
+        prefetched_files = set()
 
-                tasks.append( (media_dir, media_files, available_subtitles, languages) )
-            except Exception as e:
-                self.log_error(e)
+        # Getting the subtitles -->
+        while scheduler:
+            if scheduler.expired():
+                self.log_error("The time budget is exhausted. Skipping {0} subtitles download(s) for {1} media file(s).",
+                    len(scheduler), len(set( file_info["path"] for file_info, language, copies in scheduler.items() )) )
                 errors += 1
-        # Gathering file list that we are going to process <--
+                break
 
-        # Caching subtitles info if it is possible
-        if files_to_process:
-            for downloader_name, downloader in self.__downloaders:
-                if hasattr(downloader, "will_be_requested"):
-                    for e in downloader.will_be_requested(files_to_process, languages):
-                        self.log_error(e)
+            file_info, language, copies = scheduler.pop()
+            file_path = file_info["path"]
+
+            if self.__leases is not None and not self.__acquire_lease(file_info, language, copies):
+                self.log_info("Skipping '{0}' subtitles for {1}: they are being downloaded by another pysd run.",
+                    language, file_path)
+                continue
 
-        # Getting the subtitles
-        for task in tasks:
-            errors += self.__get_subtitles(*task)
+            # Caching subtitles info for this and the following files if it
+            # is possible.
+            if file_path not in prefetched_files:
+                prefetch_files = []
 
-        # Processing the subdirectories if needed
-        if recursive and subdirectories:
-            subdirectories.sort(key = lambda directory: directory.lower())
-            errors += self.get_subtitles(subdirectories, languages, True)
+                for path in files_to_process[file_positions[file_path]:]:
+                    if len(prefetch_files) >= self.__prefetch_size:
+                        break
+
+                    if path not in prefetched_files:
+                        prefetch_files.append(path)
+
+                for downloader_name, downloader in self.__downloaders:
+                    if hasattr(downloader, "will_be_requested"):
+                        for e in downloader.will_be_requested(prefetch_files, languages):
+                            self.log_error(e)
+
+                prefetched_files.update(prefetch_files)
+
+            if not file_info["processed"]:
+                self.log_info("Processing {0}...", file_path)
+                file_info["processed"] = True
+
+            try:
+                item_errors, failed_files = self.__get_subtitles(file_info, language, copies)
+                errors += item_errors
+            except:
+                failed_files = [ file_info ] + copies
+                raise
+            finally:
+                if self.__leases is not None:
+                    self.__leases.release(( file_path, language ))
+
+                # Only the succeeded items are journaled, so the failed ones
+                # are retried by the resumed run
+                if self.__journal is not None:
+                    for info in [ file_info ] + copies:
+                        directory = info["directory"]
+                        directory["remaining"] -= 1
+
+                        if any( info is failed_info for failed_info in failed_files ):
+                            directory["failed"] = True
+                        else:
+                            self.__journal.add("item", ( info["path"], language ))
+
+                        if directory["journaled"] and not directory["remaining"] and not directory["failed"]:
+                            self.__journal.add("directory", ( directory["path"], ), directory["mtime"])
+        # Getting the subtitles <--
 
         return errors
 
 
+    def lookup(self, records):
+        """
+        Looks up subtitles for a list of episodes without walking the media
+        directories and without downloading anything.
+
+        Each record is a dictionary with "languages" key and "name" (or
+        "names" - a list of TV show possible names), "season" and "episode"
+        keys. If they are not specified, they are gotten from the "path" key
+        (only the file name is used). Optional "hash" and "size" keys
+        (www.opensubtitles.org movie hash and file size) or "path" key are used
+        to look up the subtitles by hash.
+
+        Returns a list of dictionaries (one per record) with "subtitles" key -
+        a dictionary of subtitles candidates lists (in preference order) by
+        language and "errors" key - a list of errors happened. A candidate is a
+        dictionary with "source", "id" and "url" keys.
+        """
+
+        requests = []
+        results = []
+
+        for record in records:
+            request = dict(record)
+            result = { "subtitles": {}, "errors": [] }
+
+            try:
+                if "names" not in request:
+                    if "name" in request:
+                        request["names"] = [ request["name"].lower() ]
+                    else:
+                        request["names"], request["season"], request["episode"] = \
+                            self.get_info_from_filename(os.path.basename(request["path"]))[:3]
+
+                request["season"], request["episode"] = int(request["season"]), int(request["episode"])
+
+                for language in request["languages"]:
+                    if not LANGUAGE_REGISTRY.is_valid(language):
+                        raise Error("invalid language ({0})", language)
+            except Exception as e:
+                request["languages"] = []
+                result["errors"].append(str(e))
+
+            requests.append(request)
+            results.append(result)
+
+        for downloader_name, downloader in self.__downloaders:
+            if not hasattr(downloader, "lookup"):
+                continue
+
+            downloader_requests = [ request for request in requests if request["languages"] ]
+
+            for (subtitles, errors), request_id in zip(
+                downloader.lookup(downloader_requests),
+                [ request_id for request_id, request in enumerate(requests) if request["languages"] ]
+            ):
+                for language, candidate in subtitles.items():
+                    candidate = dict(candidate, source = downloader_name)
+                    results[request_id]["subtitles"].setdefault(language, []).append(candidate)
+
+                results[request_id]["errors"] += errors
+
+        return results
+
+
     def log_error(self, message, *args):
         """Logs an error message (may be overriden in the derived classes)."""
 
@@ -314,6 +708,41 @@ class Tv_show_tools:
         I(message, *args)
 
 
+    def log_event(self, event):
+        """
+        Logs a structured event (see Event_sink.emit()) (may be overriden in
+        the derived classes).
+        """
+
+        EVENT_SINK.emit(event)
+
+
+    def __acquire_lease(self, file_info, language, copies):
+        """
+        Acquires the lease on downloading the subtitles for the media file.
+        Returns False if the lease is held by another run.
+
+        The subtitles which have been written by other runs since the media
+        directory has been read are taken into account after acquiring.
+        """
+
+        try:
+            if not self.__leases.acquire(( file_info["path"], language )):
+                return False
+        except Error as e:
+            # The leases are advisory, so the work is done anyway
+            self.log_error(e)
+            return True
+
+        for info in [ file_info ] + copies:
+            names, season, episode, delimiter, extra_info = info["info"]
+
+            if os.path.exists(self.__get_subtitles_path(info, language)):
+                info["directory"]["subtitles"].add(( names[0], season, episode, language ))
+
+        return True
+
+
     def __cmp_media_files(self, file_name):
         """
         When we process media files, we have to process original media files
@@ -342,568 +771,4308 @@ class Tv_show_tools:
             return ( file_name.lower(), 0, 0, False )
 
 
-    def __get_subtitles(self, media_dir, media_files, available_subtitles, languages):
-        """Downloads subtitles that we have not yet.
-        Returns the number of errors happened.
+    def __get_from_downloader(self, downloader, file_path, name, season, episode, language, cancelled = None):
         """
+        Gets the subtitles from the downloader using the subtitles store if
+        possible.
 
-        errors = 0
+        cancelled - a threading.Event object which is set if the subtitles are
+        not needed anymore (they are not downloaded then).
 
-        # Getting available subtitles info -->
-        subtitles = set()
+        Returns the subtitles ID in the subtitles store (or None if the store
+        is not used) and the subtitles file contents.
+        """
 
-        for file_name in available_subtitles:
-            try:
-                names, season, episode, delimiter, language = self.get_info_from_filename(file_name)
-            except Not_found as e:
-                self.log_error("{0}: {1}", os.path.join(media_dir, file_name), e)
-            else:
-                for name in names:
-                    subtitles.add( (name, season, episode, language) )
-        # Getting available subtitles info <--
+        if self.__store is None or not hasattr(downloader, "find"):
+            return ( None, downloader.get(file_path, name, season, episode, language) )
 
-        # Downloading the subtitles that is not downloaded yet -->
-        for file_name in media_files:
-            file_path = os.path.join(media_dir, file_name)
+        subtitles_id = downloader.find(file_path, name, season, episode, language)
+        subtitles_data = self.__store.get(subtitles_id)
 
-            try:
-                names, season, episode, delimiter, language = self.get_info_from_filename(file_name)
-            except Not_found as e:
-                self.log_error("{0}: {1}", file_path, e)
-                continue
+        if subtitles_data is None:
+            if cancelled is not None and cancelled.is_set():
+                raise Not_found()
 
-            self.log_info("Processing {0}...", file_path)
+            subtitles_data = downloader.download(subtitles_id)
 
-            for language in languages:
-                for name in names:
-                    if (name, season, episode, language) in subtitles:
-                        break
-                else:
-                    for name, (downloader_name, downloader) in ( (n, d) for d in self.__downloaders for n in names ):
-                        try:
-                            subtitles_data = downloader.get(file_path, name, season, episode, language)
-                        except Not_found:
-                            pass
-                        else:
-                            subtitles.add( (name, season, episode, language) )
+            try:
+                self.__store.put(subtitles_id, subtitles_data)
+            except Exception as e:
+                self.log_error(e)
+                return ( None, subtitles_data )
 
-                            subtitles_file_path = os.path.join(media_dir, "{0}{1}{2}.srt".format(
-                                os.path.splitext(file_name)[0], delimiter, language ))
+        return ( subtitles_id, subtitles_data )
 
-                            try:
-                                subtitles_file = open(subtitles_file_path, "wb")
 
-                                try:
-                                    subtitles_file.write(subtitles_data)
-                                except:
-                                    os.unlink(subtitles_file_path)
-                                    raise
-                            except Exception as e:
-                                self.log_error("Error while writting subtitles file '{0}': {1}.", subtitles_file_path, e)
-                                errors += 1
+    def __get_from_downloaders(self, file_path, names, season, episode, language):
+        """
+        Gets the subtitles from the first downloader (in preference order) that
+        has them for any of the TV show names.
 
-                            break
-                    else:
-                        self.log_error("Subtitles for '{0}' TV show for '{1}' language is not found.", file_path, language)
-                        errors += 1
-        # Downloading the subtitles that is not downloaded yet <--
+        Returns the TV show name, the downloader name, the subtitles ID in the
+        subtitles store (or None if the store is not used) and the subtitles
+        file contents.
+        """
 
-        return errors
+        candidates = [
+            ( name, downloader_name, downloader ) for downloader_name, downloader in self.__downloaders for name in names ]
 
+        if self.__hedge_delay is not None:
+            return self.__get_hedged(candidates, file_path, season, episode, language)
 
+        for name, downloader_name, downloader in candidates:
+            try:
+                return ( name, downloader_name ) + self.__get_from_downloader(
+                    downloader, file_path, name, season, episode, language)
+            except Not_found:
+                pass
 
-class Opensubtitles_org:
-    """
-    Gives a facility to download subtitles from www.opensubtitles.org.
-    """
+        raise Not_found()
 
-    # www.opensubtitles.org domain name.
-    __domain_name = "www.opensubtitles.org"
 
-    # www.opensubtitles.org XML-RPC server has limits for maximum number of
-    # items retuned per query.
-    __max_reply_items = 500
+    def __get_hedged(self, candidates, file_path, season, episode, language):
+        """
+        Gets the subtitles from a list of (TV show name, downloader name,
+        downloader) candidates concurrently.
+
+        The request to a candidate is started after the hedge delay multiplied
+        by the candidate's position or as soon as we start waiting for its
+        result. Results are considered in preference order, so the result of a
+        candidate is used only if all preceding candidates haven't found the
+        subtitles or have failed (the first error is raised only if no
+        candidate has found them). The requests which are not needed anymore
+        are not started or are cancelled before downloading the subtitles,
+        and their results are ignored.
+
+        Returns the TV show name, the downloader name, the subtitles ID in the
+        subtitles store and the subtitles file contents.
+        """
 
-    # Connection with the www.opensubtitles.org XML-RPC server
-    __connection = None
+        condition = threading.Condition()
+        results = [ None ] * len(candidates)
+        cancelled = threading.Event()
+        error = None
 
-    # The www.opensubtitles.org XML-RPC server token.
-    __token = None
+        def request(candidate_id):
+            name, downloader_name, downloader = candidates[candidate_id]
 
-    # Request cache.
-    __cache = None
+            try:
+                if cancelled.is_set():
+                    raise Not_found()
 
+                result = ( True, self.__get_from_downloader(
+                    downloader, file_path, name, season, episode, language, cancelled) )
+            except Not_found:
+                result = ( False, None )
+            except Exception as e:
+                result = ( None, e )
 
-    def __init__(self):
-        self.__cache = {}
+            with condition:
+                results[candidate_id] = result
+                condition.notify_all()
 
+        start_time = time.time()
+        started = 0
 
-    def __del__(self):
         try:
-            if self.__token:
-                self.__call("LogOut", self.__token)
-        except:
-            pass
-
+            with condition:
+                for candidate_id, (name, downloader_name, downloader) in enumerate(candidates):
+                    while results[candidate_id] is None:
+                        while started < len(candidates) and (
+                            started <= candidate_id or time.time() >= start_time + started * self.__hedge_delay
+                        ):
+                            requester = threading.Thread(target = request, args = ( started, ))
+                            requester.daemon = True
+                            requester.start()
+                            started += 1
+
+                        if started < len(candidates):
+                            condition.wait(max(0, start_time + started * self.__hedge_delay - time.time()))
+                        else:
+                            condition.wait()
 
-    def get(self, file_path, show_name, season, episode, language):
-        """Gets a TV show subtitles and returns the subtitles file contents."""
+                    found, data = results[candidate_id]
 
-        if file_path not in self.__cache or language not in self.__cache[file_path]:
-            self.will_be_requested([file_path], [language])
+                    if found:
+                        return ( name, downloader_name ) + data
+                    elif found is None and error is None:
+                        error = data
+        finally:
+            # The requests which are still running are not needed anymore
+            cancelled.set()
 
-        url = self.__cache[file_path][language]
-        if url:
-            try:
-                url_file = BytesIO(get_url_contents(url))
-            except Exception as e:
-                raise Fatal_error("Unable to download the subtitles: {0}.", e)
+        if error is not None:
+            raise error
 
-            try:
-                return gzip.GzipFile(fileobj = url_file).read()
-            except Exception as e:
-                raise Error("Unable to gunzip the subtitles file: {0}.", e)
-        else:
-            raise Not_found()
+        raise Not_found()
 
 
-    def will_be_requested(self, requested_paths, languages):
+    def __get_subtitles(self, file_info, language, copies):
         """
-        Gets a list of files that will likely requested in the nearest time, so
-        we can send one request for all of them and cache gotten data to save the
-        time in the future.
+        Downloads subtitles that we have not yet for the media file and its
+        copies (the same media file available by other paths).
 
-        Returns a list with errors per file if happened.
+        Returns the number of errors happened and a list of the media files
+        info for which the subtitles haven't been gotten.
         """
 
-        # Checking the gotten data
-        for language in languages:
-            if language not in LANGUAGES:
-                raise Error("invalid language ({0})", language)
+        errors = 0
+        failed_files = []
+        names, season, episode, delimiter, extra_info = file_info["info"]
 
-        errors = []
-        movies_per_request = self.__max_reply_items // (len(languages) * 5) or 1
+        # Downloading the subtitles that is not downloaded yet -->
+        files_info = [
+            info for info in [ file_info ] + copies
+                if not self.__has_subtitles(info, language) ]
 
-        while requested_paths:
-            movies = []
-            hashes = {}
+        if files_info:
+            start_time = time.time()
 
-            # Hashing the files -->
-            for movie_path in requested_paths[0 : movies_per_request]:
-                try:
-                    movie_size, movie_hash = self.__get_file_hash(movie_path)
-                    movies.append({
-                        "moviebytesize": movie_size,
-                        "moviehash": movie_hash,
-                        "sublanguageid": ",".join(self.__get_language(language) for language in languages),
-                    })
+            try:
+                name, source, subtitles_id, subtitles_data = self.__get_from_downloaders(
+                    files_info[0]["path"], names, season, episode, language)
+            except Not_found:
+                for info in files_info:
+                    self.log_error("Subtitles for '{0}' TV show for '{1}' language is not found.", info["path"], language)
+                    self.__log_outcome(info, language, "not_found", None, start_time)
+                    errors += 1
+
+                failed_files += files_info
+            except:
+                for info in files_info:
+                    self.__log_outcome(info, language, "failed", None, start_time)
+                raise
+            else:
+                for info in files_info:
+                    file_errors = self.__write_subtitles(info, name, language, subtitles_id, subtitles_data)
+                    self.__log_outcome(info, language, "failed" if file_errors else "downloaded", source, start_time)
+                    errors += file_errors
 
-                    if movie_hash not in hashes:
-                        hashes[movie_hash] = []
-                    hashes[movie_hash].append(movie_path)
-                except Exception as e:
-                    if movie_path not in self.__cache:
-                        self.__cache[movie_path] = {}
+                    if file_errors:
+                        failed_files.append(info)
+        # Downloading the subtitles that is not downloaded yet <--
 
-                    for language in languages:
-                        self.__cache[movie_path][language] = None
+        return errors, failed_files
 
-                    errors.append(str(e))
-            # Hashing the files <--
 
-            # Getting available subtitles -->
-            if movies:
-                self.__connect()
+    def __log_outcome(self, file_info, language, outcome, source, start_time):
+        """Logs a "subtitles" event (see Event_sink.emit())."""
 
-                try:
-                    subtitles_list = self.__call("SearchSubtitles", self.__token, movies)["data"]
-                except Exception as e:
-                    raise Fatal_error("Unable to get a list of subtitles from {0}: {1}.", self.__domain_name, e)
+        self.log_event({
+            "time":     time.time(),
+            "event":    "subtitles",
+            "path":     file_info["path"],
+            "language": language,
+            "outcome":  outcome,
+            "source":   source,
+            "duration": time.time() - start_time,
+        })
 
-                subtitles_dict = {}
 
-                # Filtering the subtitles with the most downloads count -->
-                if subtitles_list:
-                    subtitles_list.sort(key = lambda subtitle: (
-                        subtitle["MovieHash"],
-                        subtitle["ISO639"],
-                        subtitle["SubDownloadsCnt"],
-                    ), reverse = True)
+    def __get_subtitles_path(self, file_info, language):
+        """Returns path to the subtitles file for the media file."""
 
-                    for subtitles in subtitles_list:
-                        subtitles_dict.setdefault(subtitles["MovieHash"], {}).setdefault(
-                            subtitles["ISO639"], subtitles["SubDownloadLink"])
-                # Filtering the subtitles with the most downloads count <--
-            # Getting available subtitles <--
+        names, season, episode, delimiter, extra_info = file_info["info"]
 
-            # Mapping movie names to subtitles -->
-            for movie_hash, movie_paths in hashes.iteritems():
-                for movie_path in movie_paths:
-                    if movie_path not in self.__cache:
-                        self.__cache[movie_path] = {}
+        return os.path.join(file_info["directory"]["path"], "{0}{1}{2}.srt".format(
+            os.path.splitext(os.path.basename(file_info["path"]))[0], delimiter, language ))
 
-                    for language in languages:
-                        self.__cache[movie_path][language] = subtitles_dict.get(movie_hash, {}).get(language, self.__cache[movie_path].get(language))
-            # Mapping movie names to subtitles <--
 
-            requested_paths = requested_paths[movies_per_request:]
+    def __has_subtitles(self, file_info, language):
+        """
+        Returns True if we already have subtitles for the media file for the
+        specified language.
+        """
 
-        return errors
+        names, season, episode, delimiter, extra_info = file_info["info"]
 
+        for name in names:
+            if (name, season, episode, language) in file_info["directory"]["subtitles"]:
+                return True
 
-    def __call(self, method, *args):
-        """Calls XML-RPC method and checks its return code."""
+        return False
 
-        reply = getattr(self.__connection, method)(*args)
 
-        if "status" not in reply:
-            raise Error("server returned an invalid response")
+    def __schedule_directory(self, scheduler, scheduled_items, media_dir, media_files, available_subtitles, languages, is_directory,
+                             mtime):
+        """
+        Schedules downloading of the subtitles that we have not yet for the
+        media files from the specified directory. is_directory is False if the
+        media files are specified explicitly instead of the whole directory.
+        mtime is the directory modification time it has been listed at.
+
+        scheduled_items is a dictionary of lists of the media file copies by
+        (media file device and inode, language) of the items that have been
+        scheduled. Media files which are already scheduled by another path
+        (hardlinks, bind mounts) are added to this lists instead of being
+        scheduled again.
+
+        Returns a list of (priority, file path) tuples for the media files that
+        have been scheduled.
+        """
 
-        if reply["status"].split(" ")[0] != "200":
-            raise Error("server returned error '{0}'", reply["status"])
+        scheduled_files = []
 
-        return reply
+        # Getting available subtitles info -->
+        subtitles = set()
+
+        for file_name in available_subtitles:
+            try:
+                names, season, episode, delimiter, language = self.get_info_from_filename(file_name)
+            except Not_found as e:
+                self.log_error("{0}: {1}", os.path.join(media_dir, file_name), e)
+            else:
+                for name in names:
+                    subtitles.add( (name, season, episode, language) )
+        # Getting available subtitles info <--
 
+        directory = {
+            "path":      media_dir,
+            "subtitles": subtitles,
+            "remaining": 0,
+            "failed":    False,
+            "journaled": is_directory,
+            "mtime":     mtime
+        }
 
-    def __connect(self):
-        """Ensures that we are connected to the XML-RPC server."""
+        # Getting media files info -->
+        media_files_info = []
+        episode_mtimes = {}
+
+        for file_name in media_files:
+            file_path = os.path.join(media_dir, file_name)
+
+            try:
+                names, season, episode, delimiter, extra_info = self.get_info_from_filename(file_name)
+            except Not_found as e:
+                self.log_error("{0}: {1}", file_path, e)
+                continue
+
+            try:
+                file_stat = os.stat(file_path)
+            except OSError:
+                file_mtime, file_inode = 0, file_path
+            else:
+                file_mtime, file_inode = file_stat.st_mtime, ( file_stat.st_dev, file_stat.st_ino )
+
+            # Translated media files must be processed right after the
+            # original ones, so all files of an episode get the priority of
+            # the newest of them.
+            episode_id = ( names[0], season, episode )
+            episode_mtimes[episode_id] = max(file_mtime, episode_mtimes.get(episode_id, file_mtime))
+
+            media_files_info.append(( episode_id, {
+                "directory": directory,
+                "path":      file_path,
+                "info":      ( names, season, episode, delimiter, extra_info ),
+                "inode":     file_inode,
+                "processed": False
+            } ))
+        # Getting media files info <--
+
+        season_episodes = {}
+
+        for file_id, (episode_id, file_info) in enumerate(media_files_info):
+            names, season, episode, delimiter, extra_info = file_info["info"]
+            priority = ( -episode_mtimes[episode_id], media_dir, file_id )
+            scheduled = False
+
+            for language_id, language in enumerate(languages):
+                for name in names:
+                    if (name, season, episode, language) in subtitles:
+                        break
+                else:
+                    if self.__journal is not None and self.__journal.get("item", ( file_info["path"], language )):
+                        continue
+
+                    directory["remaining"] += 1
+                    item_id = ( file_info["inode"], language )
+
+                    for name in names:
+                        season_episodes.setdefault(( name, season, language ), set()).add(episode)
+
+                    if item_id in scheduled_items:
+                        scheduled_items[item_id].append(file_info)
+                    else:
+                        scheduled_items[item_id] = []
+                        scheduler.add(priority + ( language_id, ), ( file_info, language, scheduled_items[item_id] ))
+                        scheduled = True
+
+            if scheduled:
+                scheduled_files.append(( priority, file_info["path"] ))
+
+        # Letting the downloaders get the whole seasons at once if it's possible
+        for downloader_name, downloader in self.__downloaders:
+            if hasattr(downloader, "will_be_requested_for_season"):
+                for (name, season, language), episodes in season_episodes.items():
+                    downloader.will_be_requested_for_season(name, season, episodes, language)
+
+        if not directory["remaining"] and is_directory and self.__journal is not None:
+            self.__journal.add("directory", ( media_dir, ), mtime)
+
+        return scheduled_files
+
+
+    def __write_subtitles(self, file_info, name, language, subtitles_id, subtitles_data):
+        """
+        Writes the subtitles file for the media file (places it from the
+        subtitles store if subtitles_id is not None).
+
+        Returns the number of errors happened.
+        """
+
+        names, season, episode, delimiter, extra_info = file_info["info"]
+        file_info["directory"]["subtitles"].add( (name if name in names else names[0], season, episode, language) )
+
+        subtitles_file_path = self.__get_subtitles_path(file_info, language)
 
         try:
-            if self.__connection == None or not self.__token:
-                self.__connection = xmlrpclib.ServerProxy(
-                    "http://api.opensubtitles.org/xml-rpc", transport = Xml_rpc_proxy(), allow_none = True )
-                self.__token = self.__call("LogIn", "", "", "en", "pysd 0.1")["token"]
+            if subtitles_id is not None:
+                try:
+                    self.__store.place(subtitles_id, subtitles_file_path)
+                except Exception:
+                    pass
+                else:
+                    return 0
+
+            subtitles_file = open(subtitles_file_path, "wb")
+
+            try:
+                subtitles_file.write(subtitles_data)
+            except:
+                os.unlink(subtitles_file_path)
+                raise
         except Exception as e:
-            raise Fatal_error("Unable to connect to {0} XML-RPC server: {1}.", self.__domain_name, e)
+            self.log_error("Error while writting subtitles file '{0}': {1}.", subtitles_file_path, e)
+            return 1
+
+        return 0
+
+
+
+class Work_scheduler:
+    """
+    Orders the work by its priority and tracks the time budget of the current
+    run.
+    """
+
+    # Work items heap.
+    __queue = None
+
+    # Number of items that have been added. Keeps the order of items with
+    # equal priority.
+    __counter = 0
+
+    # Time after which the remaining work is skipped.
+    __deadline = None
+
+
+    def __init__(self, time_budget = None):
+        self.__queue = []
+
+        if time_budget is not None:
+            self.__deadline = time.time() + time_budget
+
+
+    def __len__(self):
+        return len(self.__queue)
+
+
+    def add(self, priority, item):
+        """Adds a work item (lower priority values go first)."""
+
+        heapq.heappush(self.__queue, ( priority, self.__counter, item ))
+        self.__counter += 1
+
+
+    def expired(self):
+        """Returns True if the time budget is exhausted."""
+
+        return self.__deadline is not None and time.time() >= self.__deadline
+
+
+    def items(self):
+        """Returns a list of the remaining work items."""
+
+        return [ item for priority, counter, item in sorted(self.__queue) ]
+
+
+    def pop(self):
+        """Returns the work item with the highest priority."""
+
+        return heapq.heappop(self.__queue)[2]
+
+
+
+class Opensubtitles_org:
+    """
+    Gives a facility to download subtitles from www.opensubtitles.org.
+    """
+
+    # www.opensubtitles.org domain name.
+    __domain_name = "www.opensubtitles.org"
+
+    # www.opensubtitles.org XML-RPC server has limits for maximum number of
+    # items retuned per query.
+    __max_reply_items = 500
+
+    # Maximum number of subtitles per DownloadSubtitles call.
+    __max_download_items = 20
+
+    # URL of the www.opensubtitles.org XML-RPC server.
+    __api_url = "http://api.opensubtitles.org/xml-rpc"
+
+    # Mirrors (of the XML-RPC server) and proxies the requests are sent
+    # through.
+    __endpoints = None
+
+    # Endpoint of the current connection.
+    __endpoint = None
+
+    # Connection with the www.opensubtitles.org XML-RPC server
+    __connection = None
+
+    # The www.opensubtitles.org XML-RPC server token.
+    __token = None
+
+    # Request cache: flat tuples of language and subtitles URL (or None)
+    # pairs by media file paths.
+    __cache = None
+
+    # Coalesces concurrent SearchSubtitles requests.
+    __single_flight = None
+
+    # Serializes the XML-RPC calls (the connection is not thread-safe).
+    __connection_lock = None
+
+    # Journal of the work done during the run (if used).
+    __journal = None
+
+    # Media file hashes by device, inode, size and modification time.
+    __hashes = None
+
+    # Media file size, modification time and hash tuples by paths (exported to
+    # and imported from the cache bundles).
+    __path_hashes = None
 
+    # Found subtitles: subtitles URL, subtitles file ID and the time when they
+    # have been found tuples by movie hash and language.
+    __hash_subtitles = None
 
-    def __get_file_hash(self, path):
+    # Recently downloaded subtitles by their URLs.
+    __downloads = None
+
+    # Subtitles which have been found but not downloaded yet: subtitles file
+    # IDs by URLs (in the order they have been found).
+    __pending_downloads = None
+
+    # Serializes the pending subtitles downloading.
+    __pending_downloads_lock = None
+
+    # Size of the file parts (at the start and at the end) which are hashed.
+    __hash_chunk_size = 65536
+
+    # Number of the files which data is read ahead while hashing.
+    __hash_readahead = 4
+
+    # Whether to read the media files bypassing the page cache.
+    __direct_io = False
+
+
+    def __init__(self, journal = None, direct_io = False, endpoints = None):
         """
-        Calculates file hash sutable for www.opensubtitles.org XML-RPC query
-        calls. Returns file size and hash.
+        journal - a Run_journal object to record the computed hashes and the
+        resolved lookups to and to get them from.
+
+        direct_io - if True, the media files are read for hashing with O_DIRECT
+        flag (where supported), so hashing doesn't evict the page cache.
+
+        endpoints - a list of Endpoint objects to send the requests through
+        (see Endpoint_pool). Mirrors are used only for the XML-RPC server.
+        """
+
+        self.__endpoints = Endpoint_pool(endpoints)
+        self.__direct_io = direct_io
+        self.__cache = {}
+        self.__hashes = {}
+        self.__path_hashes = {}
+        self.__hash_subtitles = {}
+        self.__downloads = Lru_cache(DOWNLOADS_CACHE_SIZE)
+        self.__pending_downloads = collections.OrderedDict()
+        self.__pending_downloads_lock = threading.Lock()
+        self.__journal = journal
+        self.__single_flight = Single_flight()
+        self.__connection_lock = threading.RLock()
+
+
+    def __del__(self):
+        try:
+            if self.__token:
+                self.__call("LogOut", self.__token)
+        except:
+            pass
+
+
+    def download(self, subtitles_id):
+        """
+        Downloads the subtitles by the ID returned by find() and returns the
+        subtitles file contents.
+        """
+
+        url = subtitles_id
+
+        # Copies of the same media file share the subtitles
+        subtitles_data = self.__downloads.get(url)
+
+        if subtitles_data is None:
+            try:
+                self.__download_pending(url)
+            except Exception:
+                # Falling back to downloading by the URL
+                pass
+            else:
+                subtitles_data = self.__downloads.get(url)
+
+        if subtitles_data is None:
+            try:
+                gzip_data = self.__endpoints.call(lambda endpoint: get_url_contents(
+                    url, proxy = endpoint.proxy, retry = len(self.__endpoints) == 1 ))
+            except Exception as e:
+                raise Fatal_error("Unable to download the subtitles: {0}.", e)
+
+            try:
+                subtitles_data = gunzip_chunks([ gzip_data ])
+            except Exception as e:
+                raise Error("Unable to gunzip the subtitles file: {0}.", e)
+
+            self.__downloads.set(url, subtitles_data)
+
+        return subtitles_data
+
+
+    def export_cache(self):
+        """
+        Yields the cache records for a cache bundle (see Cache_bundle):
+        "subtitles" (movie hash, language, subtitles URL, subtitles file ID)
+        and "hash" (path, size and hash of a media file which modification time
+        is used as the update time) ones.
+        """
+
+        for (movie_hash, language), (url, subtitles_file_id, updated) in list(self.__hash_subtitles.items()):
+            yield [ "subtitles", updated, movie_hash, language, url, subtitles_file_id ]
+
+        for path, (file_size, mtime, file_hash) in list(self.__path_hashes.items()):
+            yield [ "hash", mtime, path, file_size, file_hash ]
+
+
+    def import_cache(self, records):
+        """
+        Merges the cache records of a cache bundle (see export_cache()) into
+        the cache: the newer found subtitles and media file hashes win.
+        """
+
+        for record in records:
+            kind, updated = record[0], record[1]
+
+            if kind == "subtitles":
+                movie_hash, language, url, subtitles_file_id = record[2:]
+
+                cached = self.__hash_subtitles.get(( movie_hash, language ))
+                if cached is None or cached[2] < updated:
+                    self.__hash_subtitles[( movie_hash, language )] = ( url, subtitles_file_id, updated )
+            elif kind == "hash":
+                path, file_size, file_hash = record[2:]
+
+                cached = self.__path_hashes.get(path)
+                if cached is None or cached[1] < updated:
+                    self.__path_hashes[path] = ( file_size, updated, file_hash )
+
+
+    def find(self, file_path, show_name, season, episode, language):
+        """
+        Finds a TV show subtitles and returns their ID (the download URL) which
+        is unique across all downloaders.
+        """
+
+        url = self.__get_cached(file_path, language, False)
+
+        if url is False:
+            self.will_be_requested([file_path], [language])
+            url = self.__get_cached(file_path, language)
+
+        if not url:
+            raise Not_found()
+
+        return url
+
+
+    def get(self, file_path, show_name, season, episode, language):
+        """Gets a TV show subtitles and returns the subtitles file contents."""
+
+        return self.download(self.find(file_path, show_name, season, episode, language))
+
+
+    def get_metrics(self):
+        """Returns a dictionary of the metrics: "endpoints" - the endpoints' health info."""
+
+        return { "endpoints": self.__endpoints.get_metrics() }
+
+
+    def lookup(self, requests):
+        """
+        Looks up subtitles for a list of requests without downloading them.
+        Each request is a dictionary with "languages" and either "hash" and
+        "size" (www.opensubtitles.org movie hash and file size) or "path" (path
+        to the media file to calculate the hash for) keys.
+
+        Returns a list of (subtitles, errors) tuples (one per request) where
+        subtitles is a dictionary of subtitles info ("id" and "url") by
+        language.
+        """
+
+        results = [ ( {}, [] ) for request in requests ]
+        movies = []
+        movie_requests = []
+
+        # Getting the movie hashes -->
+        for request_id, request in enumerate(requests):
+            try:
+                if request.get("hash") and request.get("size"):
+                    movie_size, movie_hash = request["size"], request["hash"]
+                elif request.get("path"):
+                    movie_size, movie_hash = self.__get_file_hash(request["path"])
+                else:
+                    continue
+
+                cached = [ self.__hash_subtitles.get(( movie_hash, language )) for language in request["languages"] ]
+                if None not in cached:
+                    for language, (url, subtitles_file_id, updated) in zip(request["languages"], cached):
+                        results[request_id][0][language] = { "id": subtitles_file_id, "url": url }
+                    continue
+
+                movies.append({
+                    "moviebytesize": movie_size,
+                    "moviehash":     movie_hash,
+                    "sublanguageid": ",".join(
+                        LANGUAGE_REGISTRY.to_site(self.__domain_name, language) for language in request["languages"]),
+                })
+                movie_requests.append(request_id)
+            except Exception as e:
+                results[request_id][1].append(str(e))
+        # Getting the movie hashes <--
+
+        # Getting available subtitles -->
+
+        # A reply is limited, so the batches are sized as in
+        # will_be_requested() by the largest language count in the batch
+        batches = []
+        max_languages = 0
+
+        for movie, request_id in zip(movies, movie_requests):
+            languages_count = max(len(requests[request_id]["languages"]), 1)
+            max_languages = max(max_languages, languages_count)
+
+            if not batches or ( len(batches[-1][0]) + 1 ) * max_languages * 5 > self.__max_reply_items:
+                batches.append(( [], [] ))
+                max_languages = languages_count
+
+            batches[-1][0].append(movie)
+            batches[-1][1].append(request_id)
+
+        for batch, batch_requests in batches:
+            try:
+                subtitles_dict = self.__search(batch)
+            except Exception as e:
+                for request_id in batch_requests:
+                    results[request_id][1].append(str(e))
+                continue
+
+            for movie, request_id in zip(batch, batch_requests):
+                movie_subtitles = subtitles_dict.get(movie["moviehash"], {})
+
+                for language in requests[request_id]["languages"]:
+                    if language in movie_subtitles:
+                        results[request_id][0][language] = {
+                            "id":  movie_subtitles[language]["IDSubtitleFile"],
+                            "url": movie_subtitles[language]["SubDownloadLink"],
+                        }
+        # Getting available subtitles <--
+
+        return results
+
+
+    def will_be_requested(self, requested_paths, languages):
+        """
+        Gets a list of files that will likely requested in the nearest time, so
+        we can send one request for all of them and cache gotten data to save the
+        time in the future.
+
+        Returns a list with errors per file if happened.
         """
 
-        try:
-            hashing_file = open(path, "rb")
-            buf_size = struct.calcsize(b"=q")
+        # Checking the gotten data
+        for language in languages:
+            if not LANGUAGE_REGISTRY.is_valid(language):
+                raise Error("invalid language ({0})", language)
+
+        errors = []
+        movies_per_request = self.__max_reply_items // (len(languages) * 5) or 1
+        site_languages = ",".join(
+            LANGUAGE_REGISTRY.to_site(self.__domain_name, language) for language in languages)
+
+        while requested_paths:
+            movies = []
+            hashes = {}
+            hashed_paths = []
+            journal_keys = {}
+
+            # Hashing the files -->
+            for movie_path in requested_paths[0 : movies_per_request]:
+                if self.__journal is not None:
+                    # The lookups are journaled by the file size and
+                    # modification time, so a replaced file is looked up again
+                    try:
+                        file_stat = os.stat(movie_path)
+                    except OSError:
+                        lookups = [ False ]
+                    else:
+                        journal_keys[movie_path] = ( movie_path, file_stat.st_size, file_stat.st_mtime )
+                        lookups = [ self.__journal.get("lookup", journal_keys[movie_path] + ( language, ), False)
+                            for language in languages ]
+
+                    if False not in lookups:
+                        for language, url in zip(languages, lookups):
+                            self.__set_cached(movie_path, language, url)
+                        continue
+
+                hashed_paths.append(movie_path)
+
+            file_hashes = self.__get_file_hashes(hashed_paths)
+
+            for movie_path in hashed_paths:
+                try:
+                    if isinstance(file_hashes[movie_path], Exception):
+                        raise file_hashes[movie_path]
+
+                    movie_size, movie_hash = file_hashes[movie_path]
+
+                    # The same content may be available by several paths and
+                    # the subtitles may be already found for it
+                    if movie_hash not in hashes:
+                        hashes[movie_hash] = []
+
+                        if not all( ( movie_hash, language ) in self.__hash_subtitles for language in languages ):
+                            movies.append({
+                                "moviebytesize": movie_size,
+                                "moviehash": movie_hash,
+                                "sublanguageid": site_languages,
+                            })
+
+                    hashes[movie_hash].append(movie_path)
+                except Exception as e:
+                    for language in languages:
+                        self.__set_cached(movie_path, language, None)
+
+                    errors.append(str(e))
+            # Hashing the files <--
+
+            # Getting available subtitles (they are cached by __search())
+            if movies:
+                self.__search(movies)
+
+            # Mapping movie names to subtitles -->
+            for movie_hash, movie_paths in hashes.items():
+                for movie_path in movie_paths:
+                    for language in languages:
+                        subtitles = self.__hash_subtitles.get(( movie_hash, language ))
+                        if subtitles:
+                            url = subtitles[0]
+
+                            with self.__pending_downloads_lock:
+                                self.__pending_downloads[url] = subtitles[1]
+                        else:
+                            url = self.__get_cached(movie_path, language)
+
+                        self.__set_cached(movie_path, language, url)
+
+                        if movie_path in journal_keys:
+                            self.__journal.add("lookup", journal_keys[movie_path] + ( language, ), url)
+            # Mapping movie names to subtitles <--
+
+            requested_paths = requested_paths[movies_per_request:]
+
+        return errors
+
+
+    def __call(self, method, *args):
+        """
+        Calls XML-RPC method and checks its return code. If the endpoint
+        fails, the connection is dropped and the call is retried once via the
+        next best endpoint (the session token argument is replaced with the
+        new session's one).
+        """
+
+        with self.__connection_lock:
+            # Logging in falls back to the next endpoints by itself, and there
+            # is no point to open a new session to close it
+            for tries_available in range(0 if method in ( "LogIn", "LogOut" ) else 1, -1, -1):
+                endpoint = self.__endpoint
+                token = self.__token
+                start_time = time.time()
+
+                try:
+                    reply = getattr(self.__connection, method)(*args)
+                except Exception as e:
+                    failed = not isinstance(e, xmlrpclib.Fault) and self.__endpoints.is_failure(e)
+                    self.__endpoints.report(endpoint, time.time() - start_time, not failed)
+
+                    if not failed:
+                        raise
+
+                    self.__connection = None
+                    self.__token = None
+
+                    if not tries_available:
+                        raise
+
+                    self.__connect()
+                    args = tuple( self.__token if token and arg == token else arg for arg in args )
+                else:
+                    break
+
+            self.__endpoints.report(endpoint, time.time() - start_time, True)
+
+        if "status" not in reply:
+            raise Error("server returned an invalid response")
+
+        if reply["status"].split(" ")[0] != "200":
+            raise Error("server returned error '{0}'", reply["status"])
+
+        return reply
+
+
+    def __connect(self):
+        """Ensures that we are connected to the XML-RPC server."""
+
+        try:
+            with self.__connection_lock:
+                if self.__connection is None or not self.__token:
+                    error = None
+
+                    # Falling back to the next endpoints on failure
+                    for endpoint in self.__endpoints.get_ranked():
+                        self.__endpoint = endpoint
+                        self.__connection = xmlrpclib.ServerProxy(endpoint.get_url(self.__api_url),
+                            transport = Xml_rpc_proxy.create(endpoint.proxy), allow_none = True )
+
+                        try:
+                            self.__token = self.__call("LogIn", "", "", "en", "pysd 0.1")["token"]
+                        except Exception as e:
+                            # The server has responded with an error
+                            if self.__connection is not None:
+                                raise
+
+                            error = e
+                        else:
+                            break
+                    else:
+                        raise error
+        except Exception as e:
+            raise Fatal_error("Unable to connect to {0} XML-RPC server: {1}.", self.__domain_name, e)
+
+
+    def __download_pending(self, url):
+        """
+        Downloads the subtitles together with other pending ones (if
+        the subtitles are pending) in one DownloadSubtitles call and caches
+        them.
+        """
+
+        with self.__pending_downloads_lock:
+            if url not in self.__pending_downloads:
+                return
+
+            urls = [ url ] + [
+                pending_url for pending_url in itertools.islice(self.__pending_downloads, self.__max_download_items)
+                    if pending_url != url ][: self.__max_download_items - 1]
+
+            urls_by_id = dict( ( self.__pending_downloads.pop(pending_url), pending_url ) for pending_url in urls )
+
+            self.__connect()
+            subtitles_list = self.__call("DownloadSubtitles", self.__token, list(urls_by_id))["data"] or []
+
+            for subtitles in subtitles_list:
+                pending_url = urls_by_id.get(subtitles["idsubtitlefile"])
+
+                if pending_url is not None:
+                    # The data is a base64 encoded gzip file which is decoded by
+                    # chunks, so the decompressed size is checked on the way
+                    encoded_data = "".join(subtitles["data"].split())
+
+                    self.__downloads.set(pending_url, gunzip_chunks(
+                        base64.b64decode(encoded_data[offset : offset + NETWORK_CHUNK_SIZE])
+                        for offset in range(0, len(encoded_data), NETWORK_CHUNK_SIZE) ))
+
+
+    def __get_cached(self, path, language, default = None):
+        """
+        Returns the cached subtitles URL (None if there are no subtitles) for
+        the media file or the default value if it is not cached.
+        """
+
+        cached = self.__cache.get(path, ())
+
+        for item_id in range(0, len(cached), 2):
+            if cached[item_id] == language:
+                return cached[item_id + 1]
+
+        return default
+
+
+    def __set_cached(self, path, language, url):
+        """Caches the subtitles URL for the media file."""
+
+        cached = self.__cache.get(path, ())
+
+        self.__cache[path] = tuple(itertools.chain.from_iterable(
+            cached[item_id : item_id + 2] for item_id in range(0, len(cached), 2) if cached[item_id] != language
+        )) + ( intern_string(language), url )
+
+
+    def __get_file_hash(self, path, file_stat = None):
+        """
+        Calculates file hash sutable for www.opensubtitles.org XML-RPC query
+        calls. Returns file size and hash.
+        """
+
+        try:
+            if file_stat is None:
+                file_stat = os.stat(path)
+
+            file_size = file_stat.st_size
+
+            # Hardlinks and bind mounts of the same file are hashed only once
+            inode = ( file_stat.st_dev, file_stat.st_ino, file_size, file_stat.st_mtime )
+            if inode in self.__hashes:
+                return (file_size, self.__hashes[inode])
+
+            path_hash = self.__path_hashes.get(path)
+            if path_hash is not None and path_hash[:2] == ( file_size, file_stat.st_mtime ):
+                self.__hashes[inode] = path_hash[2]
+                return (file_size, path_hash[2])
+
+            if self.__journal is not None:
+                journal_key = ( path, file_size, file_stat.st_mtime )
+
+                movie_hash = self.__journal.get("hash", journal_key)
+                if movie_hash is not None:
+                    self.__hashes[inode] = movie_hash
+                    self.__path_hashes[path] = ( file_size, file_stat.st_mtime, movie_hash )
+                    return (file_size, movie_hash)
+
+            file_hash = "{0:016x}".format(self.__hash_file(path, file_size))
+            self.__hashes[inode] = file_hash
+            self.__path_hashes[path] = ( file_size, file_stat.st_mtime, file_hash )
+
+            if self.__journal is not None:
+                self.__journal.add("hash", journal_key, file_hash)
+
+            return (file_size, file_hash)
+        except EnvironmentError as e:
+            raise Error("Unable to hash file '{0}': {1}.", path, e)
+        except Error:
+            raise
+        except Exception as e:
+            raise Fatal_error("Error while hashing file '{0}': {1}.", path, e)
+
+
+    def __get_file_hashes(self, paths):
+        """
+        Hashes the files in order of their location on the disks (device and
+        inode number) hinting the kernel to read ahead the data of the next
+        files while the current one is hashed. Returns a dictionary of file
+        size and hash tuples or errors by paths.
+        """
+
+        files = []
+        hashes = {}
+
+        for path in paths:
+            try:
+                files.append(( os.stat(path), path ))
+            except EnvironmentError as e:
+                hashes[path] = Error("Unable to hash file '{0}': {1}.", path, e)
+
+        files.sort(key = lambda file_info: ( file_info[0].st_dev, file_info[0].st_ino ))
+
+        for file_id, (file_stat, path) in enumerate(files):
+            if not self.__direct_io:
+                # The first files are advised at once and then one file ahead
+                # per hashed file
+                for next_stat, next_path in files[
+                    file_id + self.__hash_readahead if file_id else 0 : file_id + self.__hash_readahead + 1
+                ]:
+                    self.__advise(next_path, next_stat.st_size, "POSIX_FADV_WILLNEED")
+
+            try:
+                hashes[path] = self.__get_file_hash(path, file_stat)
+            except Error as e:
+                hashes[path] = e
+
+        return hashes
+
+
+    def __advise(self, path, file_size, advice):
+        """
+        Gives the kernel a posix_fadvise() hint for the file parts which are
+        read for hashing.
+        """
+
+        if not hasattr(os, "posix_fadvise"):
+            return
+
+        try:
+            fd = os.open(path, os.O_RDONLY)
+
+            try:
+                for offset in (0, max(file_size - self.__hash_chunk_size, 0)):
+                    os.posix_fadvise(fd, offset, self.__hash_chunk_size, getattr(os, advice))
+            finally:
+                os.close(fd)
+        except EnvironmentError:
+            pass
+
+
+    def __hash_file(self, path, file_size):
+        """Calculates the file hash (without the conversion to string)."""
+
+        if file_size < self.__hash_chunk_size * 2:
+            raise Error("File '{0}' is too small to be hashed.", path)
+
+        fd = None
+        direct = self.__direct_io and PY3 and hasattr(os, "O_DIRECT")
+
+        if direct:
+            try:
+                fd = os.open(path, os.O_RDONLY | os.O_DIRECT)
+            except EnvironmentError as e:
+                # The file system doesn't support direct I/O
+                if e.errno != errno.EINVAL:
+                    raise
+
+                direct = False
+
+        if fd is None:
+            fd = os.open(path, os.O_RDONLY)
+
+        try:
+            file_hash = file_size
+            chunk_format = "={0}q".format(self.__hash_chunk_size // 8).encode()
+
+            for offset in (0, file_size - self.__hash_chunk_size):
+                if direct:
+                    data = self.__read_direct(fd, offset, self.__hash_chunk_size)
+                else:
+                    os.lseek(fd, offset, os.SEEK_SET)
+                    data = b""
+
+                    while len(data) < self.__hash_chunk_size:
+                        chunk = os.read(fd, self.__hash_chunk_size - len(data))
+                        if not chunk:
+                            break
+                        data += chunk
+
+                if len(data) != self.__hash_chunk_size:
+                    raise Error("Unable to hash file '{0}': unexpected end of file.", path)
+
+                file_hash += sum(struct.unpack(chunk_format, data))
+                file_hash &= 0xFFFFFFFFFFFFFFFF
+        finally:
+            os.close(fd)
+
+        return file_hash
+
+
+    def __read_direct(self, fd, offset, size):
+        """
+        Reads the file data opened with O_DIRECT flag: the reads must be done
+        to an aligned buffer from an aligned offset.
+        """
+
+        alignment = mmap.PAGESIZE
+        start = offset - offset % alignment
+        length = -(-(offset + size - start) // alignment) * alignment
+
+        # Anonymous maps are page aligned
+        buf = mmap.mmap(-1, length)
+
+        try:
+            os.lseek(fd, start, os.SEEK_SET)
+
+            with io.FileIO(fd, "rb", closefd = False) as direct_file:
+                read_size = 0
+
+                while read_size < length:
+                    chunk_size = direct_file.readinto(memoryview(buf)[read_size:])
+                    if not chunk_size:
+                        break
+                    read_size += chunk_size
+
+            return buf[offset - start : min(offset - start + size, read_size)]
+        finally:
+            buf.close()
+
+
+    def __search(self, movies):
+        """
+        Searches for subtitles for the specified movies. Returns the info of
+        subtitles with the most downloads count by movie hash and language.
+        """
+
+        self.__connect()
+
+        request_key = tuple(sorted(
+            ( movie["moviehash"], movie["moviebytesize"], movie["sublanguageid"] ) for movie in movies ))
+
+        try:
+            subtitles_list = self.__single_flight.call(request_key, self.__search_subtitles, movies)
+        except Exception as e:
+            raise Fatal_error("Unable to get a list of subtitles from {0}: {1}.", self.__domain_name, e)
+
+        subtitles_dict = {}
+
+        # Filtering the subtitles with the most downloads count -->
+        if subtitles_list:
+            subtitles_list.sort(key = lambda subtitle: (
+                subtitle["MovieHash"],
+                subtitle["ISO639"],
+                subtitle["SubDownloadsCnt"],
+            ), reverse = True)
+
+            for subtitles in subtitles_list:
+                subtitles_dict.setdefault(subtitles["MovieHash"], {}).setdefault(subtitles["ISO639"], subtitles)
+        # Filtering the subtitles with the most downloads count <--
+
+        found_time = time.time()
+
+        for movie_hash, movie_subtitles in subtitles_dict.items():
+            for language, subtitles in movie_subtitles.items():
+                self.__hash_subtitles[( movie_hash, intern_string(language) )] = (
+                    subtitles["SubDownloadLink"], subtitles["IDSubtitleFile"], found_time )
+
+        return subtitles_dict
+
+
+    def __search_subtitles(self, movies):
+        """Calls SearchSubtitles XML-RPC method for the specified movies."""
+
+        return self.__call("SearchSubtitles", self.__token, movies)["data"]
+
+
+class Tvsubtitles_net:
+    """
+    Gives a facility to download subtitles from www.tvsubtitles.net.
+    """
+
+    # www.tvsubtitles.net domain name.
+    __domain_name = "www.tvsubtitles.net"
+
+    # URL prefix for all www.tvsubtitles.net URLs.
+    __url_prefix = "http://" + __domain_name + "/"
+
+    # The regular expressions below are applied to untrusted HTML, so all
+    # their repetitions which may fail to match after consuming the input are
+    # bounded: HTML tag attributes by 1024 characters and by the next tag,
+    # link contents by 1024 or 4096 characters and by the next link. So the
+    # time of a match attempt doesn't depend on the page size and a malformed
+    # page can't make them backtrack catastrophically.
+
+    # Regular expression that matches a HTML tag.
+    __tag_re = re.compile("<[^>]+>")
+
+    # Regular expression that matches a TV show record in the TV show list.
+    __tv_show_re = re.compile(r"""
+        <a\s(?:[^<>]{0,1024}?\s)?
+            href\s*=\s*["']?
+                /?tvshow-(\d+)-\d+\.html
+            ["']?
+        [^<>]{0,1024}>
+            ((?:(?!<a[\s>]).){1,1024}?)
+        </a>
+    """, re.IGNORECASE | re.VERBOSE)
+
+    # Regular expression that matches a subtitles record in the episode's
+    # subtitles list.
+    __subtitles_re = re.compile(r"""
+        <a\s(?:[^<>]{0,1024}?\s)?
+            href\s*=\s*["']?
+                /?subtitle-(\d+)\.html
+            ["']?
+        [^<>]{0,1024}>
+            ((?:(?!<a[\s>]).){1,4096}?)
+        </a>
+    """, re.IGNORECASE | re.DOTALL | re.VERBOSE)
+
+    # Regular expression that matches the language flag in a subtitles record.
+    __subtitles_flag_re = re.compile(r"""
+        <img\s(?:[^<>]{0,1024}?\s)?
+            src\s*=\s*["']?
+                [^'"<>]{0,1024}?flags/([a-z]{2})\.[a-z]{1,16}
+            ["']?
+        [^<>]{0,1024}>
+    """, re.IGNORECASE | re.VERBOSE)
+
+    # Regular expression that matches the number of downloads in a subtitles
+    # record.
+    __subtitles_downloads_re = re.compile(r"""
+        <p\s(?:[^<>]{0,1024}?\s)?
+            (?:
+                title\s*=\s*["']?
+                    downloaded
+                ["']?
+            |
+                alt\s*=\s*["']?
+                    downloaded
+                ["']?
+            )
+        (?:\s[^<>]{0,1024})?>
+            (.{0,1024}?)
+        </p>
+    """, re.IGNORECASE | re.DOTALL | re.VERBOSE)
+
+    # Maximum size of a TV show record in the TV show list. Used to limit the
+    # amount of data that is kept between the chunks of the stream.
+    __max_tv_show_record_size = 4096
+
+    # Regular expression that matches season and episode numbers in a name
+    # of a season pack member.
+    __season_pack_member_re = re.compile(r"(?:^|[^0-9a-z])(?:s0*(\d+)[\s._-]*e|0*(\d+)x)0*(\d+)(?![0-9])", re.IGNORECASE)
+
+    # Minimum number of the requested episodes of a season to download a
+    # season pack instead of the episodes' subtitles.
+    __season_pack_min_episodes = 3
+
+    # Maximum data size per endpoint (None - unlimited).
+    __max_data_sizes = {
+        "tvshows":  64 * 1024 * 1024,
+        "tvshow":   MAX_DATA_SIZE,
+        "episode":  MAX_DATA_SIZE,
+        "download": MAX_DATA_SIZE,
+        "season":   32 * MAX_DATA_SIZE,
+    }
+
+    # Downloaded data cache.
+    __cache = None
+
+    # Coalesces concurrent page requests.
+    __single_flight = None
+
+    # Path to the TV show catalogue snapshot (if it is used).
+    __catalogue_snapshot_path = None
+
+    # Loaded TV show catalogue snapshot.
+    __catalogue_snapshot = None
+
+    # True if the TV show catalogue snapshot has been loaded.
+    __catalogue_snapshot_loaded = False
+
+    # True if the full TV show list has been downloaded during this run (or
+    # imported from a fresh cache bundle).
+    __catalogue_downloaded = False
+
+    # Time when the full TV show list has been downloaded.
+    __catalogue_updated = None
+
+    # Names of the TV shows which are known to be absent from a fresh TV show
+    # catalogue snapshot.
+    __missing_shows = None
+
+    # Guards the TV show cache and the catalogue state which are updated by
+    # the background catalogue refresh.
+    __catalogue_lock = None
+
+    # Recently downloaded subtitles by their IDs.
+    __downloads = None
+
+    # Recently downloaded season subtitles packs' contents (the episodes'
+    # subtitles by episode numbers) by the pack URLs.
+    __season_packs = None
+
+    # Episodes which subtitles will be requested by TV show name, season and
+    # language.
+    __season_requests = None
+
+    # Mirrors and proxies the requests are sent through.
+    __endpoints = None
+
+
+    def __init__(self, max_data_sizes = None, use_catalogue_snapshot = True, endpoints = None):
+        """
+        max_data_sizes - a dictionary which overrides the maximum data size per
+        endpoint ("tvshows", "tvshow", "episode", "download", "season").
+
+        use_catalogue_snapshot - whether to use a local TV show catalogue
+        snapshot instead of downloading the TV show list on every run.
+
+        endpoints - a list of Endpoint objects (mirrors and proxies) to send the
+        requests through (see Endpoint_pool).
+        """
+
+        self.__cache = {}
+        self.__missing_shows = set()
+        self.__catalogue_lock = threading.Lock()
+        self.__endpoints = Endpoint_pool(endpoints)
+        self.__single_flight = Single_flight()
+        self.__downloads = Lru_cache(DOWNLOADS_CACHE_SIZE)
+        self.__season_packs = Lru_cache(SEASON_PACKS_CACHE_SIZE)
+        self.__season_requests = {}
+
+        if use_catalogue_snapshot:
+            self.__catalogue_snapshot_path = os.path.join(CACHE_DIR, "tvsubtitles.net.catalogue")
+
+        self.__max_data_sizes = dict(self.__max_data_sizes)
+        if max_data_sizes:
+            for endpoint, max_data_size in max_data_sizes.items():
+                if endpoint not in self.__max_data_sizes:
+                    raise Error("invalid endpoint '{0}'", endpoint)
+                self.__max_data_sizes[endpoint] = max_data_size
+
+
+    def download(self, subtitles_id):
+        """
+        Downloads the subtitles by the ID returned by find() and returns the
+        subtitles file contents.
+        """
+
+        url = subtitles_id
+
+        if "#" in url:
+            # A season pack member
+            pack_url, episode = url.split("#", 1)
+            pack = self.__season_packs.get(pack_url)
+
+            if pack is None:
+                # The season pack has been evicted from the cache
+                try:
+                    pack = self.__single_flight.call(
+                        ( "season", pack_url ), self.__fetch_season_pack, pack_url, int(pack_url.split("-")[-2]) )
+                except Exception as e:
+                    raise Fatal_error("Unable to download the season subtitles pack: {0}.", e)
+
+            subtitles_data = pack.get(int(episode))
+            if subtitles_data is None:
+                raise Error("Unable to find episode {0} subtitles in the season subtitles pack.", episode)
+
+            return subtitles_data
+
+        # Copies of the same episode share the subtitles
+        subtitles_data = self.__downloads.get(url)
+
+        if subtitles_data is None:
+            try:
+                zipfile_data = self.__get_url_contents(url, self.__max_data_sizes["download"])
+            except Exception as e:
+                raise Fatal_error("Unable to download the subtitles: {0}.", e)
+
+            try:
+                subtitles_zip = zipfile.ZipFile(BytesIO(zipfile_data))
+                if len(subtitles_zip.namelist()) != 1:
+                    raise Error("zip file contains {0} files instead of 1", len(subtitles_zip.namelist()))
+
+                subtitles_data = subtitles_zip.open(subtitles_zip.namelist()[0]).read()
+            except Exception as e:
+                raise Error("Unable to unzip the subtitles file: {0}.", e)
+
+            self.__downloads.set(url, subtitles_data)
+
+        return subtitles_data
+
+
+    def export_cache(self):
+        """
+        Yields the cache records for a cache bundle (see Cache_bundle): "show"
+        (name, ID), "season" (TV show name and ID, season, a list of episode
+        number, episode ID and subtitles dictionary or null lists) and
+        "catalogue" (if the full TV show list has been downloaded) ones.
+        """
+
+        for show_name, show in list(self.__cache.items()):
+            yield [ "show", show.updated, show_name, show.id ]
+
+            for season, episodes in list(show.seasons.items()):
+                yield [ "season", episodes.updated, show_name, show.id, season, [ list(item) for item in episodes.items() ] ]
+
+        if self.__catalogue_downloaded:
+            yield [ "catalogue", self.__catalogue_updated ]
+
+
+    def import_cache(self, records):
+        """
+        Merges the cache records of a cache bundle (see export_cache()) into
+        the cache: the newer TV show records and episode lists win.
+        """
+
+        for record in records:
+            with self.__catalogue_lock:
+                self.__import_cache_record(record)
+
+
+    def __import_cache_record(self, record):
+        """Merges a cache record into the cache (see import_cache())."""
+
+        kind, updated = record[0], record[1]
+
+        if kind == "show":
+            show_name, show_id = record[2:]
+            show = self.__cache.get(show_name)
+
+            if show is None or show.id != show_id and show.updated < updated:
+                self.__cache[show_name] = Tv_show_record(show_id, updated)
+            elif show.id == show_id:
+                show.updated = max(show.updated, updated)
+        elif kind == "season":
+            show_name, show_id, season, items = record[2:]
+            show = self.__cache.get(show_name)
+            if show is None or show.id != show_id:
+                return
+
+            episodes = show.seasons.get(season)
+            if episodes is not None and episodes.updated >= updated:
+                return
+
+            episodes = Episode_map(dict( ( number, episode_id ) for number, episode_id, subtitles in items ), updated)
+            for number, episode_id, subtitles in items:
+                if subtitles is not None:
+                    episodes.set_subtitles(number, subtitles)
+
+            show.seasons[season] = episodes
+        elif kind == "catalogue":
+            if time.time() - updated <= CATALOGUE_SNAPSHOT_MAX_AGE and (
+                self.__catalogue_updated is None or self.__catalogue_updated < updated
+            ):
+                self.__catalogue_downloaded = True
+                self.__catalogue_updated = updated
+
+
+    def find(self, file_path, show_name, season, episode, language):
+        """
+        Finds a TV show subtitles and returns their ID (the download URL) which
+        is unique across all downloaders.
+        """
+
+        subtitles_id = self.__find_in_season_pack(show_name, season, episode, language)
+        if subtitles_id is not None:
+            return subtitles_id
+
+        subtitles = self.__get_episode_subtitles(show_name, season, episode)
+
+        if language not in subtitles:
+            raise Not_found()
+
+        return self.__url_prefix + "download-{0}.html".format(subtitles[language])
+
+
+    def get(self, file_path, show_name, season, episode, language):
+        """Gets a TV show subtitles and returns the subtitles file contents."""
+
+        return self.download(self.find(file_path, show_name, season, episode, language))
+
+
+    def lookup(self, requests):
+        """
+        Looks up subtitles for a list of requests without downloading them.
+        Each request is a dictionary with "names" (TV show possible names),
+        "season", "episode" and "languages" keys.
+
+        Returns a list of (subtitles, errors) tuples (one per request) where
+        subtitles is a dictionary of subtitles info ("id" and "url") by
+        language.
+        """
+
+        requests = list(requests)
+        self.prefetch( ( name, request["season"], request["episode"] ) for request in requests for name in request["names"] )
+
+        results = []
+
+        for request in requests:
+            subtitles = {}
+            errors = []
+
+            for name in request["names"]:
+                try:
+                    episode_subtitles = self.__get_episode_subtitles(name, request["season"], request["episode"])
+                except Not_found:
+                    continue
+                except Exception as e:
+                    errors.append(str(e))
+                    continue
+
+                for language in request["languages"]:
+                    if language not in subtitles and language in episode_subtitles:
+                        subtitles[language] = {
+                            "id":  str(episode_subtitles[language]),
+                            "url": self.__url_prefix + "download-{0}.html".format(episode_subtitles[language]),
+                        }
+
+            results.append(( subtitles, errors ))
+
+        return results
+
+
+    def prefetch(self, episodes, workers = MAX_CONCURRENCY):
+        """
+        Concurrently downloads season and episode pages for a list of
+        (TV show name, season, episode) tuples, so the following requests for
+        this episodes are served from the cache. Errors are ignored.
+
+        The actual number of the concurrent requests is adapted to the site
+        (see Concurrency_limiter).
+        """
+
+        episodes = set(episodes)
+
+        run_concurrently(self.__get_episodes, set( ( name, season ) for name, season, episode in episodes ), workers)
+        run_concurrently(self.__get_episode_subtitles, episodes, workers)
+
+
+    def prefetch_upcoming(self, last_episodes, max_bytes = None):
+        """
+        Prefetches the subtitles lists of the episodes which follow the
+        specified ones, so when they appear, their lookups are served from the
+        cache. last_episodes is a list of (TV show possible names, season, last
+        episode number) tuples.
+
+        The season episode list is refreshed and the next episode's (or the
+        next season's first episode's) subtitles list is downloaded if it's
+        available. Only the TV shows which are in the cache or in the
+        catalogue snapshot are prefetched.
+
+        Stops when max_bytes of the network traffic are spent (the last page
+        may exceed the budget). Errors are ignored. Returns the number of bytes
+        spent.
+        """
+
+        spent = 0
+
+        for names, season, last_episode in last_episodes:
+            show = self.__get_known_show(names)
+            if show is None:
+                continue
+
+            for next_season, next_episode in ( ( season, last_episode + 1 ), ( season + 1, 1 ) ):
+                if max_bytes is not None and spent >= max_bytes:
+                    return spent
+
+                episodes_stats, subtitles_stats = {}, {}
+
+                try:
+                    episodes = self.__refresh_episodes(show, next_season, episodes_stats)
+
+                    if next_episode in episodes:
+                        if episodes.get_subtitles(next_episode) is None:
+                            subtitles = self.__fetch_episode_subtitles(episodes.get_id(next_episode), subtitles_stats)
+
+                            # The subtitles may be not uploaded yet, so an
+                            # empty list is not cached
+                            if subtitles:
+                                episodes.set_subtitles(next_episode, subtitles)
+                        break
+                except Exception:
+                    pass
+                finally:
+                    spent += episodes_stats.get("wire_bytes", 0) + subtitles_stats.get("wire_bytes", 0)
+
+        return spent
+
+
+    def get_metrics(self):
+        """Returns a dictionary of the metrics: "endpoints" - the endpoints' health info."""
+
+        return { "endpoints": self.__endpoints.get_metrics() }
+
+
+    def will_be_requested_for_season(self, show_name, season, episodes, language):
+        """
+        Hints that subtitles for the episodes of the TV show season will be
+        requested. If most of the season episodes are requested, the subtitles
+        are downloaded as a single season pack (with a fallback to downloading
+        per episode for the episodes which are missing in it).
+        """
+
+        self.__season_requests.setdefault(( show_name, season, language ), set()).update(episodes)
+
+
+    def __fetch_episodes(self, show_id, season, stats = None):
+        """
+        Downloads and parses a list of episodes of a TV show season. Returns an
+        Episode_map.
+
+        See iter_url_contents() for the stats argument.
+        """
+
+        episodes = {}
+
+        episode_list_url = self.__url_prefix + "tvshow-{0}-{1}.html".format(show_id, season)
+        episode_list_html = self.__get_url_contents(
+            episode_list_url, self.__max_data_sizes["tvshow"], stats).decode("utf-8", errors = "replace")
+
+        all_episodes_regex = re.compile(r"""
+            <td(?:\s[^<>]{0,1024})?>\s*</td>\s*
+            <td(?:\s[^<>]{0,1024})?>\s*
+            <a\s(?:[^<>]{0,1024}?\s)?
+                href\s*=\s*["']?
+                    /?episode-""" + str(show_id) + "-" + str(season) + r"""\.html
+                ["']?
+            [^<>]{0,1024}>
+        """, re.IGNORECASE | re.VERBOSE)
+
+        if len( [ x for x in all_episodes_regex.finditer(episode_list_html) ] ) != 1:
+            raise Error("failed to parse a server response")
+
+        episode_regex = re.compile(r"""
+            <td(?:\s[^<>]{0,1024})?>\s*""" +
+                str(season) + r"""x0{0,16}(\d{1,16})\s*
+            </td>\s*
+            <td(?:\s[^<>]{0,1024})?>\s*
+            <a\s(?:[^<>]{0,1024}?\s)?
+                href\s*=\s*["']?
+                    /?episode-(\d+)\.html
+                ["']?
+            [^<>]{0,1024}>
+        """, re.IGNORECASE | re.VERBOSE)
+
+        for match in episode_regex.finditer(episode_list_html):
+            episodes[int(match.group(1))] = int(match.group(2))
+
+        return Episode_map(episodes)
+
+
+    def __fetch_episode_subtitles(self, episode_id, stats = None):
+        """
+        Downloads and parses a list of subtitles which we have for an episode.
+        Returns the ID of the subtitles with the most downloads per language.
+
+        See iter_url_contents() for the stats argument.
+        """
+
+        subtitles_dict = {}
+        subtitles_list = []
+
+        subtitles_list_url = self.__url_prefix + "episode-{0}.html".format(episode_id)
+        subtitles_list_html = self.__get_url_contents(
+            subtitles_list_url, self.__max_data_sizes["episode"], stats).decode("utf-8", errors = "replace")
+
+        for match in self.__subtitles_re.finditer(subtitles_list_html):
+            subtitles = { "id": int(match.group(1)) }
+            subtitles_info_html = match.group(2)
+
+            # The number of downloads follows the language flag
+            flag_match = self.__subtitles_flag_re.search(subtitles_info_html)
+            downloads_matches = [] if flag_match is None else list(
+                self.__subtitles_downloads_re.finditer(subtitles_info_html, flag_match.end()) )
+
+            if not downloads_matches:
+                raise Exception("failed to parse a server response")
+
+            downloads = self.__tag_re.sub("", downloads_matches[-1].group(1)).replace("&nbsp;", " ").strip()
+            try:
+                downloads = int(downloads)
+            except ValueError:
+                raise Exception("failed to parse a server response")
+
+            subtitles["language"] = LANGUAGE_REGISTRY.from_site(self.__domain_name, flag_match.group(1))
+            subtitles["downloads"] = downloads
+
+            subtitles_list.append(subtitles)
+
+        # Getting only one subtitle with the most downloads per
+        # language.
+        # -->
+        subtitles_list.sort(
+            key = lambda subtitle: ( subtitle["language"], subtitle["downloads"] ), reverse = True)
+
+        for subtitles in subtitles_list:
+            if subtitles["language"] not in subtitles_dict:
+                subtitles_dict[subtitles["language"]] = subtitles["id"]
+        # <--
+
+        return subtitles_dict
+
+
+    def __fetch_season_pack(self, url, season):
+        """
+        Downloads a season subtitles pack, splits it into the episodes'
+        subtitles and caches them by the pack URL. Returns a dictionary of the
+        episodes' subtitles by episode numbers.
+        """
+
+        pack = {}
+        pack_data = self.__get_url_contents(url, self.__max_data_sizes["season"])
+
+        try:
+            pack_zip = zipfile.ZipFile(BytesIO(pack_data))
+        except Exception as e:
+            raise Error("Unable to unzip the season subtitles pack: {0}.", e)
+
+        for member_name in sorted(pack_zip.namelist()):
+            if os.path.splitext(member_name)[1].lower() not in [ ext[1:] for ext in SUBTITLE_EXTENSIONS ]:
+                continue
+
+            match = self.__season_pack_member_re.search(os.path.basename(member_name))
+            if not match or int(match.group(1) or match.group(2)) != season:
+                continue
+
+            episode = int(match.group(3))
+
+            # The first release of an episode is used
+            if episode not in pack:
+                pack[episode] = pack_zip.open(member_name).read()
+
+        self.__season_packs.set(url, pack)
+
+        return pack
+
+
+    def __fetch_shows(self):
+        """Downloads and parses a list of all www.tvsubtitles.net shows."""
+
+        def fetch_shows(endpoint):
+            shows = {}
+
+            tv_show_list_html = iter_url_contents(
+                endpoint.get_url(self.__url_prefix + "tvshows.html"), self.__max_data_sizes["tvshows"],
+                proxy = endpoint.proxy, retry = len(self.__endpoints) == 1 )
+
+            for match in self.__parse_stream(tv_show_list_html, self.__tv_show_re, self.__max_tv_show_record_size):
+                show_name = self.__tag_re.sub("", match.group(2)).replace("&nbsp;", " ").strip().lower()
+                shows[show_name] = Tv_show_record(int(match.group(1)))
+
+            return shows
+
+        shows = self.__endpoints.call(fetch_shows)
+
+        if not shows:
+            raise Exception("failed to parse a server response")
+
+        return shows
+
+
+    def __find_in_season_pack(self, show_name, season, episode_number, language):
+        """
+        Returns ID of the episode subtitles from the season subtitles pack or
+        None if the season pack is not used for the episode or it's not in the
+        pack.
+        """
+
+        requested_episodes = self.__season_requests.get(( show_name, season, language ))
+        if not requested_episodes or episode_number not in requested_episodes:
+            return None
+
+        episodes = self.__get_episodes(show_name, season)
+
+        requested_episodes = requested_episodes.intersection(episodes)
+        if len(requested_episodes) < max(self.__season_pack_min_episodes, len(episodes) / 2.0):
+            return None
+
+        show = self.__get_show(show_name)
+
+        if show.packs is None:
+            show.packs = {}
+        packs = show.packs
+
+        if ( season, language ) not in packs:
+            url = self.__url_prefix + "download-{0}-{1}-{2}.html".format(
+                show.id, season, LANGUAGE_REGISTRY.to_site(self.__domain_name, language))
+
+            try:
+                packs[( season, language )] = dict(
+                    ( episode, "{0}#{1}".format(url, episode) ) for episode in self.__single_flight.call(
+                        ( "season", url ), self.__fetch_season_pack, url, season ) )
+            except Exception:
+                # Falling back to downloading per episode
+                packs[( season, language )] = {}
+
+        return packs[( season, language )].get(episode_number)
+
+
+    def __get_episodes(self, show_name, season):
+        """Returns a list of episodes for which we have subtitles."""
+
+        show = self.__get_show(show_name)
+
+        try:
+            if season not in show.seasons:
+                show.seasons[season] = self.__single_flight.call(
+                    ( "tvshow", show.id, season ), self.__fetch_episodes, show.id, season )
+
+            return show.seasons[season]
+        except Exception as e:
+            raise Fatal_error("Unable to get episode list for the TV show from {0}: {1}.", self.__domain_name, e)
+
+
+    def __get_episode_subtitles(self, show_name, season, episode_number):
+        """
+        Returns a list of subtitles which we have for the episode specified by
+        the arguments.
+        """
+
+        episodes = self.__get_episodes(show_name, season)
+
+        if episode_number not in episodes:
+            raise Not_found()
+
+        try:
+            subtitles = episodes.get_subtitles(episode_number)
+
+            if subtitles is None:
+                episode_id = episodes.get_id(episode_number)
+                subtitles = self.__single_flight.call(
+                    ( "episode", episode_id ), self.__fetch_episode_subtitles, episode_id )
+                episodes.set_subtitles(episode_number, subtitles)
+
+            return subtitles
+        except Exception as e:
+            raise Fatal_error("Unable to get subtitles list from {0}: {1}.", self.__domain_name, e)
+
+
+    def __download_catalogue(self):
+        """
+        Downloads the full TV show list, merges it into the cache and saves
+        the TV show catalogue snapshot.
+        """
+
+        shows = self.__single_flight.call("tvshows", self.__fetch_shows)
+        cache = dict(shows)
+
+        # The known TV show records are kept with their episode lists
+        with self.__catalogue_lock:
+            cache.update(self.__cache)
+            self.__cache = cache
+            self.__missing_shows = set()
+            self.__catalogue_downloaded = True
+            self.__catalogue_updated = time.time()
+
+        if self.__catalogue_snapshot_path is not None:
+            try:
+                Catalogue_snapshot.save(self.__catalogue_snapshot_path,
+                    ( (show_name, show.id) for show_name, show in shows.items() ))
+            except Exception as e:
+                E("Unable to save TV show catalogue snapshot: {0}", e)
+
+
+    def __get_catalogue_snapshot(self):
+        """
+        Returns the TV show catalogue snapshot or None if it is not available.
+        Starts its refreshing in background if it is outdated.
+        """
+
+        with self.__catalogue_lock:
+            if self.__catalogue_snapshot_loaded:
+                return self.__catalogue_snapshot
+
+            self.__catalogue_snapshot_loaded = True
+
+            if self.__catalogue_snapshot_path is not None and os.path.exists(self.__catalogue_snapshot_path):
+                try:
+                    self.__catalogue_snapshot = Catalogue_snapshot(self.__catalogue_snapshot_path)
+                except Exception as e:
+                    E("Unable to load TV show catalogue snapshot: {0}", e)
+                else:
+                    if time.time() - self.__catalogue_snapshot.created > CATALOGUE_SNAPSHOT_MAX_AGE:
+                        refresher = threading.Thread(target = self.__refresh_catalogue)
+                        refresher.daemon = True
+                        refresher.start()
+
+        return self.__catalogue_snapshot
+
+
+    def __get_known_show(self, names):
+        """
+        Returns info of the TV show with one of the possible names if it is in
+        the cache or in the catalogue snapshot (the full TV show list is never
+        downloaded) or None.
+        """
+
+        for show_name in names:
+            with self.__catalogue_lock:
+                show = self.__cache.get(show_name)
+                catalogue_downloaded = self.__catalogue_downloaded
+
+            if show is None and not catalogue_downloaded:
+                catalogue_snapshot = self.__get_catalogue_snapshot()
+                show_id = None if catalogue_snapshot is None else catalogue_snapshot.get(show_name)
+
+                if show_id is not None:
+                    with self.__catalogue_lock:
+                        show = self.__cache.setdefault(show_name, Tv_show_record(show_id))
+
+            if show is not None:
+                return show
+
+        return None
+
+
+    def __get_show(self, show_name):
+        """
+        Returns a TV show info. A TV show which is absent from a fresh TV show
+        catalogue snapshot is considered as missing without downloading the
+        full TV show list.
+        """
+
+        try:
+            with self.__catalogue_lock:
+                show = self.__cache.get(show_name)
+                unknown = show is None and not self.__catalogue_downloaded and show_name not in self.__missing_shows
+
+            if unknown:
+                catalogue_snapshot = self.__get_catalogue_snapshot()
+                show_id = None if catalogue_snapshot is None else catalogue_snapshot.get(show_name)
+
+                if show_id is not None:
+                    with self.__catalogue_lock:
+                        show = self.__cache.setdefault(show_name, Tv_show_record(show_id))
+                elif catalogue_snapshot is not None and (
+                    time.time() - catalogue_snapshot.created <= CATALOGUE_SNAPSHOT_MAX_AGE
+                ):
+                    with self.__catalogue_lock:
+                        self.__missing_shows.add(show_name)
+                else:
+                    # The snapshot is outdated
+                    self.__download_catalogue()
+
+                    with self.__catalogue_lock:
+                        show = self.__cache.get(show_name)
+        except Exception as e:
+            raise Fatal_error("Unable to get TV show list from {0}: {1}.", self.__domain_name, e)
+
+        if show is None:
+            raise Not_found()
+
+        return show
+
+
+    def __get_url_contents(self, url, max_data_size, stats = None):
+        """
+        Downloads a www.tvsubtitles.net URL via the best endpoint (see
+        Endpoint_pool). The requests are not retried if there are other
+        endpoints to fall back to.
+        """
+
+        return self.__endpoints.call(lambda endpoint: get_url_contents(
+            endpoint.get_url(url), max_data_size, stats, endpoint.proxy, retry = len(self.__endpoints) == 1 ))
+
+
+    def __parse_stream(self, chunks, regex, max_record_size):
+        """
+        Decodes a stream of UTF-8 data chunks and yields the regex matches
+        found in it.
+
+        Matches never cross a chunk boundary incorrectly: the text after the
+        last match is kept and prepended to the next chunk, but not more than
+        max_record_size characters of it, so the memory usage doesn't depend
+        on the stream size.
+        """
+
+        decoder = codecs.getincrementaldecoder("utf-8")(errors = "replace")
+        text = ""
+
+        for chunk in itertools.chain(chunks, [ None ]):
+            if chunk is None:
+                text += decoder.decode(b"", True)
+            else:
+                text += decoder.decode(chunk)
+
+            end = 0
+            for match in regex.finditer(text):
+                end = match.end()
+                yield match
+
+            text = text[max(end, len(text) - max_record_size):]
+
+
+    def __refresh_episodes(self, show, season, stats = None):
+        """
+        Downloads the TV show season episode list again keeping the known
+        episodes' subtitles lists. Returns the new Episode_map.
+        """
+
+        episodes = self.__fetch_episodes(show.id, season, stats)
+
+        cached_episodes = show.seasons.get(season)
+        if cached_episodes is not None:
+            for number, episode_id, subtitles in cached_episodes.items():
+                if subtitles is not None and number in episodes and episodes.get_id(number) == episode_id:
+                    episodes.set_subtitles(number, subtitles)
+
+        show.seasons[season] = episodes
+
+        return episodes
+
+
+    def __refresh_catalogue(self):
+        """Refreshes the TV show catalogue snapshot (in background)."""
+
+        try:
+            self.__download_catalogue()
+        except Exception:
+            pass
+
+
+
+class Tv_show_record:
+    """
+    A compact www.tvsubtitles.net TV show cache record: the TV show ID, time
+    when it has been gotten, a dictionary of Episode_map objects by season
+    and a dictionary of the season subtitles packs' subtitles IDs by season
+    and language (None until a season pack is requested).
+    """
+
+    __slots__ = ( "id", "updated", "seasons", "packs" )
+
+
+    def __init__(self, show_id, updated = None):
+        self.id = show_id
+        self.updated = time.time() if updated is None else updated
+        self.seasons = {}
+        self.packs = None
+
+
+
+class Episode_map:
+    """
+    A compact map of a TV show season episodes. Episode numbers and IDs are
+    kept in arrays sorted by episode number, and subtitles lists - as tuples
+    of (language, subtitles ID) pairs.
+    """
+
+    __slots__ = ( "updated", "__numbers", "__ids", "__subtitles" )
+
+    # Type code of the arrays.
+    __array_type = "I" if PY3 else b"I"
+
+
+    def __init__(self, episodes, updated = None):
+        """
+        episodes - a dictionary of episode IDs by episode numbers.
+
+        updated - time when the episode list has been gotten (now by default).
+        """
+
+        self.updated = time.time() if updated is None else updated
+        numbers = sorted(episodes)
+
+        self.__numbers = array.array(self.__array_type, numbers)
+        self.__ids = array.array(self.__array_type, [ episodes[number] for number in numbers ])
+        self.__subtitles = [ None ] * len(numbers)
+
+
+    def __contains__(self, number):
+        return self.__get_index(number) is not None
+
+
+    def __iter__(self):
+        return iter(self.__numbers)
+
+
+    def __len__(self):
+        return len(self.__numbers)
+
+
+    def get_id(self, number):
+        """Returns the episode ID."""
+
+        return self.__ids[self.__get_index(number)]
+
+
+    def items(self):
+        """
+        Yields (episode number, episode ID, subtitles dictionary or None)
+        tuples in order of episode numbers.
+        """
+
+        for index, number in enumerate(self.__numbers):
+            subtitles = self.__subtitles[index]
+            yield number, self.__ids[index], None if subtitles is None else dict(subtitles)
+
+
+    def get_subtitles(self, number):
+        """
+        Returns a dictionary of subtitles IDs by language for the episode or
+        None if the subtitles list has not been set.
+        """
+
+        subtitles = self.__subtitles[self.__get_index(number)]
+        return None if subtitles is None else dict(subtitles)
+
+
+    def set_subtitles(self, number, subtitles):
+        """Sets the episode subtitles list (a dictionary of subtitles IDs by language)."""
+
+        self.__subtitles[self.__get_index(number)] = tuple(
+            ( intern_string(language), subtitles_id ) for language, subtitles_id in sorted(subtitles.items()) )
+
+
+    def __get_index(self, number):
+        """Returns the episode index in the arrays or None if it is not found."""
+
+        index = bisect.bisect_left(self.__numbers, number)
+
+        if index < len(self.__numbers) and self.__numbers[index] == number:
+            return index
+        else:
+            return None
+
+
+
+class Run_journal:
+    """
+    An append-only journal of the work done during a run which allows to
+    resume an interrupted run skipping the finished work.
+
+    Each record is a JSON list (kind, key values..., value) on a separate
+    line. Records are written in batches, so a crash loses at most one batch.
+    The journal file is created when the first batch is written.
+    """
+
+    # Maximum number of records which are written at once.
+    __batch_size = 100
+
+    # Maximum time (in seconds) for which records are kept unwritten.
+    __flush_interval = 5
+
+    # Path to the journal file.
+    path = None
+
+    # Journal file (None until the first batch is written).
+    __file = None
+
+    # Whether the journal file should be appended to (or truncated).
+    __append = False
+
+    # Whether the journal file's last record is not terminated.
+    __unterminated = False
+
+    # Whether the journal file is known to be unwritable.
+    __failed = False
+
+    # Records by their kinds and keys.
+    __records = None
+
+    # Records which have not been written yet.
+    __batch = None
+
+    # Time of the last batch writing.
+    __flush_time = None
+
+    # Guards the journal state.
+    __lock = None
+
+
+    def __init__(self, path, resume = False):
+        """
+        Opens the journal. If resume is True, the existing records are loaded
+        and new ones are appended to them, otherwise the journal is truncated.
+        """
+
+        self.path = path
+        self.__records = {}
+        self.__batch = []
+        self.__flush_time = time.time()
+        self.__lock = threading.Lock()
+
+        try:
+            if resume and os.path.exists(path):
+                self.__append = True
+                self.__unterminated = not self.__load()
+            elif os.path.exists(path):
+                # Truncating the previous journal right away
+                self.__open()
+        except Exception as e:
+            raise Error("Unable to open run journal '{0}': {1}.", path, e)
+
+
+    def add(self, kind, key, value = True):
+        """Adds a record to the journal."""
+
+        record = json.dumps([ kind ] + list(key) + [ value ])
+
+        with self.__lock:
+            self.__records.setdefault(kind, {})[key] = value
+            self.__batch.append(record)
+
+            if len(self.__batch) >= self.__batch_size or time.time() - self.__flush_time >= self.__flush_interval:
+                self.__flush()
+
+
+    def close(self):
+        """Writes all pending records and closes the journal."""
+
+        with self.__lock:
+            try:
+                self.__flush()
+            finally:
+                if self.__file is not None:
+                    self.__file.close()
+                    self.__file = None
+
+
+    def get(self, kind, key, default = None):
+        """Returns value of the record or the default value if it is not found."""
+
+        return self.__records.get(kind, {}).get(key, default)
+
+
+    def __flush(self):
+        """
+        Writes the pending records. If the journal can't be written, the error
+        is logged once, and the records are kept only in memory.
+        """
+
+        if self.__batch and not self.__failed:
+            try:
+                if self.__file is None:
+                    self.__open()
+
+                self.__file.write("".join( record + "\n" for record in self.__batch ).encode("utf-8"))
+                self.__file.flush()
+            except EnvironmentError as e:
+                self.__failed = True
+                E("Unable to write run journal '{0}': {1}.", self.path, e)
+
+        self.__batch = []
+        self.__flush_time = time.time()
+
+
+    def __open(self):
+        """Opens the journal file for writing (creating its directory if needed)."""
+
+        directory = os.path.dirname(self.path)
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+        if self.__append:
+            self.__file = open(self.path, "ab")
+
+            # The last record may be truncated by a crash
+            if self.__unterminated:
+                self.__file.write(b"\n")
+        else:
+            self.__file = open(self.path, "wb")
+
+
+    def __load(self):
+        """
+        Loads the journal records. Returns False if the journal's last record
+        is not terminated.
+        """
+
+        line = b"\n"
+
+        with open(self.path, "rb") as journal_file:
+            for line in journal_file:
+                try:
+                    record = json.loads(line.decode("utf-8"))
+                    kind, key, value = record[0], tuple(record[1:-1]), record[-1]
+                except (ValueError, IndexError, TypeError):
+                    continue
+
+                self.__records.setdefault(kind, {})[key] = value
+
+        return line.endswith(b"\n")
+
+
+
+class Work_leases:
+    """
+    Advisory leases on work items which let concurrent pysd runs (overlapping
+    cron jobs, manual runs, services) split the work instead of duplicating
+    it and racing on the same subtitles files.
+
+    A lease is a file in the leases directory locked with flock(), so the
+    lease of a crashed process is released by the kernel and is reclaimed by
+    the next run automatically. If flock() is not available, all leases are
+    granted.
+    """
+
+    # Path to the leases directory.
+    path = None
+
+    # Locked lease files by keys of the leases held.
+    __leases = None
+
+    # Guards the leases held.
+    __lock = None
+
+    # Whether the leases directory exists (it's created on the first lease).
+    __directory_created = False
+
+    # Whether the leases are granted without locking, because the leases
+    # directory can't be created.
+    __disabled = False
+
+
+    def __init__(self, path = None):
+        self.path = os.path.join(CACHE_DIR, "leases") if path is None else path
+        self.__leases = {}
+        self.__lock = threading.Lock()
+
+
+    def acquire(self, key):
+        """
+        Acquires the lease on a work item specified by a tuple of JSON
+        serializable values. Returns False if the lease is held by another run
+        (or by another thread of this one).
+        """
+
+        try:
+            import fcntl
+        except ImportError:
+            return True
+
+        key = json.dumps(list(key))
+
+        with self.__lock:
+            if not self.__create_directory():
+                return True
+
+            if key in self.__leases:
+                return False
+
+            self.__leases[key] = None
+
+        lease_file = None
+        lease_path = os.path.join(self.path, hashlib.sha1(key.encode("utf-8")).hexdigest())
+
+        try:
+            lease_file = self.__lock_file(fcntl, lease_path)
+        except EnvironmentError as e:
+            raise Error("Unable to acquire work lease '{0}': {1}.", lease_path, e)
+        finally:
+            with self.__lock:
+                if lease_file is None:
+                    del self.__leases[key]
+                else:
+                    self.__leases[key] = lease_file
+
+        return lease_file is not None
+
+
+    def release(self, key):
+        """Releases the lease (if it is held)."""
+
+        with self.__lock:
+            lease_file = self.__leases.pop(json.dumps(list(key)), None)
+
+        if lease_file is not None:
+            # The file is removed while it's locked, so the runs which have
+            # opened it will find out that it has been removed after locking
+            try:
+                os.unlink(lease_file.name)
+            except EnvironmentError:
+                pass
+
+            lease_file.close()
+
+
+    def __create_directory(self):
+        """
+        Creates the leases directory if it hasn't been created yet. Returns
+        False if the leases are disabled. If the directory can't be created,
+        Error is raised once, and the leases are disabled.
+        """
+
+        if self.__directory_created:
+            return True
+
+        if self.__disabled:
+            return False
+
+        try:
+            if not os.path.exists(self.path):
+                os.makedirs(self.path)
+        except EnvironmentError as e:
+            self.__disabled = True
+            raise Error("Unable to create work leases directory '{0}' (the work is not leased): {1}.", self.path, e)
+
+        self.__directory_created = True
+        return True
+
+
+    def __lock_file(self, fcntl, lease_path):
+        """
+        Locks the lease file. Returns the locked file or None if it is locked
+        by another run.
+        """
+
+        while True:
+            lease_file = open(lease_path, "ab")
+            locked = False
+
+            try:
+                try:
+                    fcntl.flock(lease_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except EnvironmentError as e:
+                    if e.errno in ( errno.EACCES, errno.EAGAIN ):
+                        return None
+                    raise
+
+                # The lease may have been released (and its file removed) by
+                # the previous holder after we opened the file
+                try:
+                    locked = os.path.samestat(os.fstat(lease_file.fileno()), os.stat(lease_path))
+                except EnvironmentError as e:
+                    if e.errno != errno.ENOENT:
+                        raise
+
+                if locked:
+                    return lease_file
+            finally:
+                if not locked:
+                    lease_file.close()
+
+
+
+class Subtitles_store:
+    """
+    A content-addressed local store of the downloaded subtitles which may be
+    shared between runs and machines (via a shared mount).
+
+    Subtitles files are stored as objects named by SHA-1 of their contents
+    (optionally gzipped), and subtitles IDs are mapped to the objects by small
+    key files, so the same subtitles are stored once. The total size of the
+    objects is limited: the least recently used ones are evicted. The
+    objects' use is tracked by their access time, so the modification time of
+    the subtitles files hardlinked to them is kept.
+
+    Subtitles are placed to the media directories by copying, hardlinking or
+    reflinking (with a fallback to copying). Note that a hardlinked subtitles
+    file shares its contents with the store object, so it must not be
+    modified in place.
+    """
+
+    # Subtitles placing modes.
+    PLACE_COPY = "copy"
+    PLACE_HARDLINK = "hardlink"
+    PLACE_REFLINK = "reflink"
+
+    # FICLONE ioctl request code (Linux).
+    __ficlone = 0x40049409
+
+    # Path to the store directory.
+    path = None
+
+    # Maximum total size of the objects.
+    __max_size = 256 * 1024 * 1024
+
+    # Whether to compress the objects.
+    __compress = False
+
+    # Subtitles placing mode.
+    __place_mode = None
+
+    # Current total size of the objects (calculated on demand).
+    __size = None
+
+    # Guards the objects total size.
+    __lock = None
+
+    # Permissions of the store files.
+    __file_mode = None
+
+    # Whether a subtitles placing failure has been logged.
+    __place_failure_logged = False
+
+
+    def __init__(self, path, max_size = None, compress = False, place_mode = PLACE_REFLINK):
+        """max_size - maximum total size of the objects (None - the default one)."""
+
+        if place_mode not in (self.PLACE_COPY, self.PLACE_HARDLINK, self.PLACE_REFLINK):
+            raise Error("invalid subtitles placing mode '{0}'", place_mode)
+
+        self.path = path
+        if max_size is not None:
+            self.__max_size = max_size
+        self.__compress = compress
+        self.__place_mode = place_mode
+        self.__lock = threading.Lock()
+
+        # Objects may be hardlinked to the media directories, so they should
+        # have the permissions of a regular file.
+        umask = os.umask(0)
+        os.umask(umask)
+        self.__file_mode = 0o666 & ~umask
+
+        try:
+            for directory in ( self.__get_path("objects"), self.__get_path("keys") ):
+                if not os.path.exists(directory):
+                    os.makedirs(directory)
+        except Exception as e:
+            raise Error("Unable to create subtitles store '{0}': {1}.", path, e)
+
+
+    def get(self, subtitles_id):
+        """Returns the subtitles file contents or None if it is not stored."""
+
+        object_path = self.__get_object_path(subtitles_id)
+        if object_path is None:
+            return None
+
+        try:
+            with open(object_path, "rb") as object_file:
+                data = object_file.read()
+
+            self.__touch(object_path)
+        except EnvironmentError:
+            return None
+
+        if object_path.endswith(".gz"):
+            data = gzip.GzipFile(fileobj = BytesIO(data)).read()
+
+        return data
+
+
+    def place(self, subtitles_id, path):
+        """
+        Places the stored subtitles file to the specified path (replacing the
+        existing file if it exists).
+        """
+
+        object_path = self.__get_object_path(subtitles_id)
+        if object_path is None:
+            raise Not_found("the subtitles are not stored")
+
+        temp_path = "{0}.{1}.tmp".format(path, os.getpid())
+
+        try:
+            if object_path.endswith(".gz"):
+                with open(temp_path, "wb") as temp_file:
+                    temp_file.write(self.get(subtitles_id))
+            elif self.__place_mode == self.PLACE_COPY:
+                shutil.copyfile(object_path, temp_path)
+            else:
+                try:
+                    if self.__place_mode == self.PLACE_HARDLINK:
+                        os.link(object_path, temp_path)
+                    else:
+                        self.__reflink(object_path, temp_path)
+                except EnvironmentError as e:
+                    # Logging only the first failure: the others are likely
+                    # caused by the same file system limitation
+                    if not self.__place_failure_logged:
+                        self.__place_failure_logged = True
+                        E("Unable to {0} subtitles from the store '{1}' to '{2}' (the subtitles are copied instead): {3}.",
+                            self.__place_mode, self.path, path, e)
+
+                    shutil.copyfile(object_path, temp_path)
+
+            os.rename(temp_path, path)
+        except:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            raise
+
+        self.__touch(object_path)
+
+
+    def put(self, subtitles_id, data):
+        """Stores the subtitles file contents."""
+
+        object_name = hashlib.sha1(data).hexdigest()
+
+        if self.__compress:
+            object_name += ".gz"
+            object_data = BytesIO()
+
+            with gzip.GzipFile(fileobj = object_data, mode = "wb") as object_file:
+                object_file.write(data)
+
+            data = object_data.getvalue()
+
+        try:
+            object_path = self.__get_path("objects", object_name)
+
+            if os.path.exists(object_path):
+                self.__touch(object_path)
+            else:
+                self.__write(object_path, data)
+
+                with self.__lock:
+                    if self.__size is not None:
+                        self.__size += len(data)
+
+            self.__write(self.__get_key_path(subtitles_id), object_name.encode("utf-8"))
+        except Exception as e:
+            raise Error("Unable to save subtitles to the store '{0}': {1}.", self.path, e)
+
+        self.__evict()
+
+
+    def __evict(self):
+        """Evicts the least recently used objects if the store is too big."""
+
+        objects_path = self.__get_path("objects")
+
+        with self.__lock:
+            if self.__size is None:
+                self.__size = sum(
+                    os.path.getsize(os.path.join(objects_path, name)) for name in os.listdir(objects_path) )
+
+            if self.__size <= self.__max_size:
+                return
+
+            objects = []
+
+            for name in os.listdir(objects_path):
+                try:
+                    object_stat = os.stat(os.path.join(objects_path, name))
+                except OSError:
+                    continue
+
+                objects.append(( object_stat.st_atime, object_stat.st_size, name ))
+
+            objects.sort()
+            self.__size = sum( size for atime, size, name in objects )
+
+            # Evicting with a reserve to not scan the store on every put
+            for atime, size, name in objects:
+                if self.__size <= self.__max_size * 0.9:
+                    break
+
+                try:
+                    os.unlink(os.path.join(objects_path, name))
+                except OSError:
+                    pass
+
+                self.__size -= size
+
+
+    def __get_key_path(self, subtitles_id):
+        """Returns path to the key file of the subtitles ID."""
+
+        return self.__get_path("keys", hashlib.sha1(subtitles_id.encode("utf-8")).hexdigest())
+
+
+    def __get_object_path(self, subtitles_id):
+        """Returns path to the object with the subtitles or None if it is not stored."""
+
+        try:
+            with open(self.__get_key_path(subtitles_id), "rb") as key_file:
+                object_path = self.__get_path("objects", key_file.read().decode("utf-8").strip())
+        except EnvironmentError:
+            return None
+
+        return object_path if os.path.exists(object_path) else None
+
+
+    def __get_path(self, *names):
+        """Returns path to a file in the store."""
+
+        return os.path.join(self.path, *names)
+
+
+    def __reflink(self, source_path, destination_path):
+        """
+        Creates a reflink (a copy-on-write copy) of the file. Raises
+        EnvironmentError if the file system doesn't support reflinks.
+        """
+
+        try:
+            import fcntl
+        except ImportError:
+            raise EnvironmentError(errno.EOPNOTSUPP, "reflinks are not supported")
+
+        try:
+            with open(source_path, "rb") as source_file:
+                with open(destination_path, "wb") as destination_file:
+                    fcntl.ioctl(destination_file.fileno(), self.__ficlone, source_file.fileno())
+        except EnvironmentError:
+            if os.path.exists(destination_path):
+                os.unlink(destination_path)
+            raise
+
+
+    def __touch(self, object_path):
+        """
+        Marks the object as recently used by setting its access time (its
+        modification time is kept, since it's shared with the hardlinked
+        subtitles files).
+        """
+
+        os.utime(object_path, ( time.time(), os.stat(object_path).st_mtime ))
+
+
+    def __write(self, path, data):
+        """Writes the file atomically."""
+
+        fd, temp_path = tempfile.mkstemp(dir = os.path.dirname(path), prefix = ".tmp-")
+
+        try:
+            with os.fdopen(fd, "wb") as temp_file:
+                temp_file.write(data)
+
+            os.chmod(temp_path, self.__file_mode)
+            os.rename(temp_path, path)
+        except:
+            os.unlink(temp_path)
+            raise
+
+
+
+class Subtitles_service:
+    """
+    A local service which keeps Tv_show_tools with its subtitles sources
+    (and their caches and sessions) resident and serves get_subtitles() and
+    lookup() requests of Subtitles_service_client concurrently over a UNIX
+    socket.
+
+    The service's caches may be exported and imported with "export_cache" and
+    "import_cache" requests, and the subtitles sources' metrics (endpoints'
+    health and hosts' concurrency limits) are gotten with "metrics" request.
+
+    Since the requests are served with the service's permissions (the
+    subtitles are written and the cache bundles are read and written by the
+    service), the socket is created accessible only by the service's user,
+    and the requests of the clients of other users (except root) are
+    rejected.
+
+    A client sends a request as a JSON object on a single line and gets a
+    JSON object per line in response: {"info": message} and {"error":
+    message} for the log messages and the last one - {"result": result,
+    "metrics": metrics} or {"failure": message, "metrics": metrics}.
+    """
+
+    # Path to the UNIX socket.
+    __path = None
+
+    # Tv_show_tools which subtitles sources are shared between the requests.
+    __tools = None
+
+    # Delay between the hedged requests (None if the mode is disabled).
+    __hedge_delay = None
+
+    # Local store of the downloaded subtitles (if used).
+    __store = None
+
+    # Work leases shared with the concurrent runs (if used).
+    __leases = None
+
+    # Upcoming episodes prefetching schedule: media paths, whether to process
+    # subdirectories recursively, interval (in seconds) between the rounds and
+    # maximum network traffic of a round (None if the prefetching is
+    # disabled).
+    __prefetch_schedule = None
+
+    # Interval (in seconds) between the checks whether the service is idle.
+    __idle_check_interval = 1
+
+    # Number of the requests received.
+    __requests = 0
+
+    # Number of the requests being processed.
+    __active_requests = 0
+
+    # Guards the requests counters.
+    __lock = None
+
+
+    def __init__(self, path, use_opensubtitles = False, hedge_delay = None, store = None, direct_io = False, leases = None,
+                 endpoints = None):
+        self.__path = path
+        self.__tools = Tv_show_tools(use_opensubtitles, hedge_delay, store = store, direct_io = direct_io, endpoints = endpoints)
+        self.__hedge_delay = hedge_delay
+        self.__store = store
+        self.__leases = leases
+        self.__lock = threading.Lock()
+
+
+    def import_cache(self, path):
+        """Merges a cache bundle into the service's caches (see Tv_show_tools.import_cache())."""
+
+        self.__tools.import_cache(path)
+
+
+    def schedule_prefetch(self, tv_show_paths, recursive = False, interval = 60 * 60, max_bytes = PREFETCH_BUDGET):
+        """
+        Schedules prefetching of the subtitles info for the upcoming episodes
+        of the TV shows in the specified media directories (see
+        Tv_show_tools.prefetch_upcoming()) every interval seconds. A round
+        spends not more than max_bytes of the network traffic and pauses while
+        the service processes requests.
+        """
+
+        self.__prefetch_schedule = ( [ os.path.abspath(path) for path in tv_show_paths ], recursive, interval, max_bytes )
+
+
+    def serve(self):
+        """Serves the requests until the program is interrupted."""
+
+        if os.path.exists(self.__path):
+            connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+            try:
+                connection.connect(self.__path)
+            except socket.error:
+                os.unlink(self.__path)
+            else:
+                raise Error("pysd service is already running at '{0}'", self.__path)
+            finally:
+                connection.close()
+
+        handle_request = self.__handle_request
+
+        class Request_handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                handle_request(self.rfile, self.wfile, self.request)
+
+        # Creating the socket accessible only by the service's user
+        umask = os.umask(0o177)
+
+        try:
+            server = socketserver.ThreadingUnixStreamServer(self.__path, Request_handler)
+        except socket.error as e:
+            raise Error("Unable to listen on '{0}': {1}.", self.__path, e)
+        finally:
+            os.umask(umask)
+
+        server.daemon_threads = True
+        self.log_info("Serving requests at '{0}'...", self.__path)
+
+        if self.__prefetch_schedule is not None:
+            prefetcher = threading.Thread(target = self.__prefetch_upcoming)
+            prefetcher.daemon = True
+            prefetcher.start()
+
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+            os.unlink(self.__path)
+
+
+    def log_error(self, message, *args):
+        """Logs an error message (may be overriden in the derived classes)."""
+
+        E(message, *args)
+
+
+    def log_info(self, message, *args):
+        """Logs an info message (may be overriden in the derived classes)."""
+
+        I(message, *args)
+
+
+    def __wait_idle(self, items):
+        """Yields the items waiting while the service processes requests."""
+
+        for item in items:
+            while self.__active_requests:
+                time.sleep(self.__idle_check_interval)
+
+            yield item
+
+
+    def __prefetch_upcoming(self):
+        """Prefetches the upcoming episodes according to the schedule (in background)."""
+
+        tv_show_paths, recursive, interval, max_bytes = self.__prefetch_schedule
+
+        while True:
+            time.sleep(interval)
+
+            try:
+                spent = self.__tools.prefetch_upcoming(
+                    self.__wait_idle(self.__tools.get_library_episodes(tv_show_paths, recursive)), max_bytes)
+            except Exception as e:
+                self.log_error("Upcoming episodes prefetching failed: {0}.", e)
+            else:
+                self.log_info("Upcoming episodes have been prefetched ({0} bytes downloaded).", spent)
+
+
+    def __check_client(self, connection):
+        """
+        Raises Error if the client (connected by the UNIX socket connection) is
+        not allowed to send requests: only the service's user and root are.
+        """
+
+        peer_credentials = getattr(socket, "SO_PEERCRED", 17 if sys.platform.startswith("linux") else None)
+
+        try:
+            if peer_credentials is None:
+                raise Error("peer credentials are not supported by the platform")
+
+            pid, uid, gid = struct.unpack("3i",
+                connection.getsockopt(socket.SOL_SOCKET, peer_credentials, struct.calcsize("3i")))
+        except Exception as e:
+            raise Error("unable to get the client's credentials: {0}", e)
+
+        if uid not in ( os.getuid(), 0 ):
+            raise Error("requests are served only for the service's user")
+
+
+    def __handle_request(self, input, output, connection):
+        """Handles a client request."""
+
+        start_time = time.time()
+        method = None
+        response = {}
+
+        line = input.readline()
+        if not line:
+            # A connection check
+            return
+
+        with self.__lock:
+            self.__requests += 1
+            self.__active_requests += 1
+            request_id = self.__requests
+            concurrency = self.__active_requests
+
+        session = Subtitles_service_session(self.__tools, output, self.__hedge_delay, self.__store, self.__leases)
+
+        try:
+            self.__check_client(connection)
+
+            request = json.loads(line.decode("utf-8"))
+            method = request["method"]
+
+            if method == "get_subtitles":
+                for language in request["languages"]:
+                    if not LANGUAGE_REGISTRY.is_valid(language):
+                        raise Error("invalid language '{0}'", language)
+
+                response["result"] = session.get_subtitles(
+                    request["paths"], request["languages"], request.get("recursive", False), request.get("time_budget") )
+            elif method == "lookup":
+                response["result"] = session.lookup(request["records"])
+            elif method == "metrics":
+                response["result"] = self.__tools.get_metrics()
+            elif method in ( "export_cache", "import_cache" ):
+                if not os.path.isabs(request["path"]):
+                    raise Error("cache bundle path must be absolute")
+
+                response["result"] = getattr(self.__tools, method)(request["path"])
+            else:
+                raise Error("invalid method '{0}'", method)
+        except KeyError as e:
+            response["failure"] = "missing request parameter {0}".format(e)
+        except Exception as e:
+            response["failure"] = str(e)
+        finally:
+            with self.__lock:
+                self.__active_requests -= 1
+
+        response["metrics"] = metrics = {
+            "request":        request_id,
+            "method":         method,
+            "time":           time.time() - start_time,
+            "concurrency":    concurrency,
+            "info_messages":  session.info_messages,
+            "error_messages": session.error_messages,
+        }
+        session.send(response)
+
+        if "failure" in response:
+            self.log_error("Request #{0} ({1}) failed: {2}.", request_id, method, response["failure"])
+
+        self.log_info("Request #{0} ({1}): {2:.3f}s, {3} concurrent request(s), {4} error message(s).",
+            request_id, method, metrics["time"], concurrency, metrics["error_messages"])
+
+
+
+class Subtitles_service_session(Tv_show_tools):
+    """
+    Tv_show_tools which serve a single Subtitles_service request: share the
+    subtitles sources with the service's Tv_show_tools and send the log
+    messages to the client.
+    """
+
+    # Number of the info messages sent.
+    info_messages = 0
+
+    # Number of the error messages sent.
+    error_messages = 0
+
+    # File object of the client connection (None if the client has gone).
+    __output = None
+
+    # Guards the output.
+    __lock = None
+
+
+    def __init__(self, tools, output, hedge_delay = None, store = None, leases = None):
+        Tv_show_tools.__init__(self, hedge_delay = hedge_delay, store = store, shared_with = tools, leases = leases)
+
+        self.__output = output
+        self.__lock = threading.Lock()
+
+
+    def log_error(self, message, *args):
+        self.error_messages += 1
+        self.send({ "error": message.format(*args) if len(args) else str(message) })
+
+
+    def log_info(self, message, *args):
+        self.info_messages += 1
+        self.send({ "info": message.format(*args) if len(args) else str(message) })
+
+
+    def send(self, response):
+        """Sends a response to the client."""
+
+        data = (json.dumps(response) + "\n").encode("utf-8")
+
+        with self.__lock:
+            if self.__output is None:
+                return
+
+            try:
+                self.__output.write(data)
+                self.__output.flush()
+            except (EnvironmentError, ValueError):
+                # The client has gone - finish the work silently
+                self.__output = None
+
+
+
+class Subtitles_service_client:
+    """A thin client of Subtitles_service."""
+
+    # Path to the service UNIX socket.
+    __path = None
+
+    # Metrics of the last request.
+    metrics = None
+
+
+    def __init__(self, path):
+        self.__path = path
+
+
+    def get_subtitles(self, tv_show_paths, languages, recursive = False, time_budget = None):
+        """
+        Same as Tv_show_tools.get_subtitles(), but the work is done by the
+        service. The paths are resolved relative to the current directory.
+        """
+
+        return self.__call({
+            "method":      "get_subtitles",
+            "paths":       [ os.path.abspath(path) for path in tv_show_paths ],
+            "languages":   languages,
+            "recursive":   recursive,
+            "time_budget": time_budget,
+        })
+
+
+    def lookup(self, records):
+        """Same as Tv_show_tools.lookup(), but the work is done by the service."""
+
+        return self.__call({ "method": "lookup", "records": records })
+
+
+    def get_metrics(self):
+        """Same as Tv_show_tools.get_metrics(), but the service's metrics are returned."""
+
+        return self.__call({ "method": "metrics" })
+
+
+    def export_cache(self, path):
+        """
+        Same as Tv_show_tools.export_cache(), but the service's caches are
+        exported. The path is resolved relative to the current directory.
+        """
+
+        self.__call({ "method": "export_cache", "path": os.path.abspath(path) })
+
+
+    def import_cache(self, path):
+        """
+        Same as Tv_show_tools.import_cache(), but the bundle is merged into the
+        service's caches. The path is resolved relative to the current
+        directory.
+        """
+
+        self.__call({ "method": "import_cache", "path": os.path.abspath(path) })
+
+
+    def log_error(self, message, *args):
+        """Logs an error message (may be overriden in the derived classes)."""
+
+        E(message, *args)
+
+
+    def log_info(self, message, *args):
+        """Logs an info message (may be overriden in the derived classes)."""
+
+        I(message, *args)
+
+
+    def __call(self, request):
+        """Sends the request to the service and returns its result."""
+
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+        try:
+            connection.connect(self.__path)
+            connection.sendall((json.dumps(request) + "\n").encode("utf-8"))
+
+            for line in connection.makefile("rb"):
+                response = json.loads(line.decode("utf-8"))
+
+                if "info" in response:
+                    self.log_info(response["info"])
+                elif "error" in response:
+                    self.log_error(response["error"])
+                else:
+                    self.metrics = response["metrics"]
+
+                    if "failure" in response:
+                        raise Error("pysd service failed to process the request: {0}.", response["failure"])
+
+                    return response["result"]
+        except (socket.error, ValueError) as e:
+            raise Error("pysd service at '{0}' is unavailable: {1}.", self.__path, e)
+        finally:
+            connection.close()
+
+        raise Error("pysd service at '{0}' has closed the connection unexpectedly.", self.__path)
+
+
+
+class Cache_bundle:
+    """
+    A versioned compressed bundle of the downloaders' caches which allows to
+    warm the caches of other pysd instances.
+
+    The bundle is a gzipped stream of lines: a JSON header object and JSON
+    lists (source, kind, update time, values...) - one per cache entry, so
+    it's written and read without holding it in memory entirely.
+    """
+
+    # Format name.
+    __format = "pysd-cache-bundle"
+
+    # Format version.
+    __version = 1
+
+
+    @staticmethod
+    def load(path):
+        """Yields the bundle records."""
+
+        try:
+            with gzip.open(path, "rb") as bundle_file:
+                header = json.loads(bundle_file.readline().decode("utf-8"))
+
+                if not isinstance(header, dict) or header.get("format") != Cache_bundle.__format:
+                    raise Error("it's not a pysd cache bundle")
+
+                if header.get("version") != Cache_bundle.__version:
+                    raise Error("unsupported cache bundle version: {0}", header.get("version"))
+
+                for line in bundle_file:
+                    yield json.loads(line.decode("utf-8"))
+        except Exception as e:
+            raise Error("Unable to import cache bundle '{0}': {1}.", path, e)
+
+
+    @staticmethod
+    def save(path, records):
+        """Saves the records as a cache bundle. The bundle is replaced atomically."""
+
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, temp_path = tempfile.mkstemp(dir = directory, prefix = ".cache-bundle-")
+
+        try:
+            with os.fdopen(fd, "wb") as raw_file:
+                with gzip.GzipFile(fileobj = raw_file, mode = "wb") as bundle_file:
+                    bundle_file.write((json.dumps({
+                        "format":  Cache_bundle.__format,
+                        "version": Cache_bundle.__version,
+                        "created": time.time(),
+                    }) + "\n").encode("utf-8"))
+
+                    for record in records:
+                        bundle_file.write((json.dumps(record) + "\n").encode("utf-8"))
+
+            os.rename(temp_path, path)
+        except:
+            os.unlink(temp_path)
+            raise
+
+
+
+class Catalogue_snapshot:
+    """
+    A compact binary TV show catalogue snapshot which is memory-mapped and
+    binary-searched on demand instead of being loaded into memory.
+
+    File format (all numbers are little-endian): a header (magic, format
+    version, number of TV shows, creation time), fixed-size records (name
+    offset, name size, TV show ID) sorted by TV show name and the UTF-8
+    encoded normalized TV show names.
+    """
+
+    # Snapshot file magic.
+    __magic = b"PYSDCTLG"
+
+    # Snapshot file format version.
+    __version = 1
+
+    # Snapshot file header.
+    __header = struct.Struct(b"<8sIId")
+
+    # TV show record.
+    __record = struct.Struct(b"<IHI")
+
+    # Time when the snapshot has been created.
+    created = None
+
+    # Number of TV shows in the snapshot.
+    __size = 0
+
+    # Offset of TV show names.
+    __names_offset = 0
+
+    # Memory-mapped snapshot file.
+    __map = None
+
+
+    def __init__(self, path):
+        with open(path, "rb") as snapshot_file:
+            self.__map = mmap.mmap(snapshot_file.fileno(), 0, access = mmap.ACCESS_READ)
+
+        try:
+            if len(self.__map) < self.__header.size:
+                raise Error("invalid file size")
+
+            magic, version, self.__size, self.created = self.__header.unpack_from(self.__map, 0)
+            if magic != self.__magic or version != self.__version:
+                raise Error("unsupported file format")
+
+            self.__names_offset = self.__header.size + self.__size * self.__record.size
+            if len(self.__map) < self.__names_offset:
+                raise Error("invalid file size")
+        except:
+            self.__map.close()
+            raise
+
+
+    def get(self, show_name):
+        """Returns ID of the specified TV show or None if it is not found."""
+
+        show_name = show_name.encode("utf-8")
+        low, high = 0, self.__size
+
+        while low < high:
+            middle = (low + high) // 2
+            name_offset, name_size, show_id = self.__record.unpack_from(
+                self.__map, self.__header.size + middle * self.__record.size)
+
+            name_offset += self.__names_offset
+            name = self.__map[name_offset : name_offset + name_size]
+
+            if name < show_name:
+                low = middle + 1
+            elif name > show_name:
+                high = middle
+            else:
+                return show_id
+
+        return None
+
+
+    @staticmethod
+    def save(path, shows):
+        """
+        Saves a list of (TV show name, TV show ID) pairs as a TV show
+        catalogue snapshot. The snapshot is replaced atomically.
+        """
+
+        shows = sorted( (show_name.encode("utf-8"), int(show_id)) for show_name, show_id in shows )
+
+        records = []
+        names_size = 0
+
+        for name, show_id in shows:
+            records.append(Catalogue_snapshot.__record.pack(names_size, len(name), show_id))
+            names_size += len(name)
+
+        directory = os.path.dirname(path)
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+        fd, temp_path = tempfile.mkstemp(dir = directory, prefix = ".catalogue-")
+
+        try:
+            with os.fdopen(fd, "wb") as snapshot_file:
+                snapshot_file.write(Catalogue_snapshot.__header.pack(
+                    Catalogue_snapshot.__magic, Catalogue_snapshot.__version, len(shows), time.time() ))
+                snapshot_file.write(b"".join(records))
+                snapshot_file.write(b"".join( name for name, show_id in shows ))
+
+            os.rename(temp_path, path)
+        except:
+            os.unlink(temp_path)
+            raise
+
+
+
+class Language_registry:
+    """
+    A precomputed bidirectional registry of ISO 639-1, ISO 639-2/B and site
+    specific language codes. All lookups are O(1).
+    """
+
+    # ISO 639-1 codes by language ID.
+    __iso639_1 = None
+
+    # ISO 639-2/B codes by language ID.
+    __iso639_2 = None
+
+    # Language IDs by ISO 639-1 and ISO 639-2/B codes.
+    __ids = None
+
+    # Site specific codes by site name: a tuple of site codes by language ID
+    # and a dictionary of language IDs by site codes.
+    __sites = None
+
+
+    # Arguments the registry is built from.
+    __languages = None
+    __site_languages = None
+
+
+    def __init__(self, languages, site_languages):
+        """
+        languages - ISO 639-1 -> 639-2/B language codes dictionary.
+
+        site_languages - a dictionary of site specific codes:
+        { site: ( 1 or 2 - the ISO 639 part the site's codes are based on,
+                  { ISO 639-1 code: site specific code } ) }.
+
+        The registry is built on the first lookup.
+        """
+
+        self.__languages = languages
+        self.__site_languages = site_languages
+
+
+    def get(self, code):
+        """
+        Returns ISO 639-1 language code for the ISO 639-1 or ISO 639-2/B
+        language code or None if the language is unknown.
+        """
+
+        if self.__ids is None:
+            self.__build()
+
+        language_id = self.__ids.get(code)
+        return None if language_id is None else self.__iso639_1[language_id]
+
+
+    def is_valid(self, language):
+        """Returns True if the language is a known ISO 639-1 language code."""
+
+        if self.__ids is None:
+            self.__build()
+
+        return len(language) == 2 and language in self.__ids
+
+
+    def from_site(self, site, code):
+        """
+        Converts a site specific language code to the ISO 639-1 language code.
+        Unknown codes are returned as is.
+        """
+
+        if self.__ids is None:
+            self.__build()
+
+        site_codes, language_ids = self.__sites[site]
+
+        language_id = language_ids.get(code)
+        return code if language_id is None else self.__iso639_1[language_id]
+
+
+    def to_iso639_2(self, language):
+        """Converts ISO 639-1 language code to the ISO 639-2/B language code."""
+
+        if self.__ids is None:
+            self.__build()
+
+        return self.__iso639_2[self.__ids[language]]
+
+
+    def to_site(self, site, language):
+        """Converts ISO 639-1 language code to the site specific language code."""
+
+        if self.__ids is None:
+            self.__build()
+
+        return self.__sites[site][0][self.__ids[language]]
+
+
+    def __build(self):
+        """Builds the registry."""
+
+        codes = sorted(self.__languages.items())
+
+        iso639_1 = tuple( intern_string(code) for code, iso639_2_code in codes )
+        iso639_2 = tuple( intern_string(code) for iso639_1_code, code in codes )
+
+        ids = {}
+        for iso639_codes in (iso639_1, iso639_2):
+            ids.update( (code, language_id) for language_id, code in enumerate(iso639_codes) )
+
+        sites = {}
+        for site, (iso639_part, exceptions) in self.__site_languages.items():
+            site_codes = list(iso639_1 if iso639_part == 1 else iso639_2)
+
+            for code, site_code in exceptions.items():
+                site_codes[ids[code]] = intern_string(site_code)
+
+            sites[site] = (
+                tuple(site_codes),
+                dict( (code, language_id) for language_id, code in enumerate(site_codes) ) )
+
+        self.__iso639_1 = iso639_1
+        self.__iso639_2 = iso639_2
+        self.__sites = sites
+        self.__ids = ids
+
+
+
+class Lru_cache:
+    """A thread-safe dictionary of a limited size which evicts the least recently used items."""
+
+    # Maximum number of items.
+    __max_size = None
+
+    # Cached items.
+    __items = None
+
+    # Guards the items.
+    __lock = None
+
+
+    def __init__(self, max_size):
+        self.__max_size = max_size
+        self.__items = collections.OrderedDict()
+        self.__lock = threading.Lock()
+
+
+    def get(self, key, default = None):
+        """Returns the item or the default value if it is not cached."""
+
+        with self.__lock:
+            if key not in self.__items:
+                return default
+
+            value = self.__items[key] = self.__items.pop(key)
+            return value
+
+
+    def set(self, key, value):
+        """Caches the item evicting the least recently used ones if needed."""
+
+        with self.__lock:
+            self.__items.pop(key, None)
+            self.__items[key] = value
+
+            while len(self.__items) > self.__max_size:
+                self.__items.popitem(last = False)
+
+
+
+class Single_flight:
+    """
+    Coalesces concurrent calls with the same key: only one of them does the
+    actual work, and the others wait for it and share its result or error.
+    """
+
+    # Guards the in-flight calls dictionary.
+    __lock = None
+
+    # In-flight calls by their keys.
+    __calls = None
+
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__calls = {}
+
+
+    def call(self, key, function, *args):
+        """
+        Calls function(*args) if there is no in-flight call with the same key
+        or waits for the in-flight call otherwise. Returns the call result or
+        raises its error.
+        """
+
+        with self.__lock:
+            call = self.__calls.get(key)
+
+            leader = call is None
+            if leader:
+                call = self.__calls[key] = { "done": threading.Event() }
+
+        if leader:
+            try:
+                call["result"] = function(*args)
+            except Exception as e:
+                call["error"] = e
+            finally:
+                with self.__lock:
+                    del self.__calls[key]
+
+                call["done"].set()
+        else:
+            call["done"].wait()
+
+        if "error" in call:
+            raise call["error"]
+
+        if "result" not in call:
+            raise Error("the request has been interrupted")
+
+        return call["result"]
+
+
+
+class Endpoint:
+    """
+    An endpoint of a subtitles source: a mirror and/or a proxy which the
+    requests are sent through, with its health statistics (which are
+    maintained by Endpoint_pool).
+    """
+
+    # Base URL of the mirror ("http://host[:port]") which replaces scheme
+    # and host of the source URLs (None - the source itself is used).
+    mirror = None
+
+    # URL of the HTTP proxy (None - the proxy from the environment is used).
+    proxy = None
+
+    # Moving average of the request latency in seconds (None until the first
+    # request).
+    latency = None
+
+    # Moving average of the failed requests rate.
+    error_rate = 0.0
+
+    # Number of the requests sent.
+    requests = 0
+
+    # Number of the failed requests.
+    failures = 0
+
+    # Serial number of the last request sent.
+    last_used = 0
+
+
+    def __init__(self, mirror = None, proxy = None):
+        for url in ( mirror, proxy ):
+            if url is not None and ( not url.startswith("http://") or not url_parse.urlparse(url).netloc ):
+                raise Error("invalid endpoint URL '{0}'", url)
+
+        self.mirror = mirror
+        self.proxy = proxy
+
+
+    def __str__(self):
+        return ( self.mirror or "default" ) + ( "" if self.proxy is None else " via " + self.proxy )
+
+
+    def get_url(self, url):
+        """Returns the source URL rewritten for the mirror."""
+
+        if self.mirror is None:
+            return url
+
+        mirror = url_parse.urlsplit(self.mirror)
+        return url_parse.urlunsplit(( mirror.scheme, mirror.netloc ) + tuple(url_parse.urlsplit(url)[2:]))
+
+
+
+class Endpoint_pool:
+    """
+    A pool of a subtitles source endpoints (see Endpoint) which are ranked
+    by the observed latency and error rate: the requests are sent to the
+    best endpoint and fall back to the next ones on failure.
+
+    Endpoints which haven't been used yet go first (in the configured
+    order), and every few requests the least recently used endpoint is
+    probed first, so the ranking follows the changes of the endpoints'
+    health.
+    """
+
+    # Weight of a new observation in the latency moving average.
+    __latency_weight = 0.3
+
+    # Weight of a new observation in the error rate moving average.
+    __error_weight = 0.2
+
+    # Latency penalty (in seconds) of the error rate when the endpoints are
+    # ranked.
+    __error_penalty = NETWORK_TIMEOUT
+
+    # Every such request probes the least recently used endpoint.
+    __probe_interval = 20
+
+    # The endpoints.
+    __endpoints = None
+
+    # Number of the requests routed.
+    __requests = 0
+
+    # Guards the endpoints' statistics.
+    __lock = None
+
+
+    def __init__(self, endpoints = None):
+        """endpoints - a list of Endpoint objects (the default endpoint if not specified)."""
+
+        self.__endpoints = list(endpoints) if endpoints else [ Endpoint() ]
+        self.__lock = threading.Lock()
+
+
+    def __len__(self):
+        return len(self.__endpoints)
+
+
+    def call(self, function):
+        """
+        Calls function(endpoint) for the best endpoint falling back to the
+        next ones if it fails and returns its result. The endpoint's response
+        errors (Error exceptions and HTTP client errors) are not considered as
+        the endpoint failures.
+        """
+
+        error = None
+
+        for endpoint in self.get_ranked():
+            start_time = time.time()
+
+            try:
+                result = function(endpoint)
+            except Exception as e:
+                failed = self.is_failure(e)
+                self.report(endpoint, time.time() - start_time, not failed)
+
+                if not failed:
+                    raise
+
+                error = e
+            else:
+                self.report(endpoint, time.time() - start_time, True)
+                return result
+
+        raise error
+
+
+    def get_metrics(self):
+        """Returns a list of the endpoints' health info dictionaries in rank order."""
+
+        with self.__lock:
+            return [ {
+                "endpoint":   str(endpoint),
+                "latency":    endpoint.latency,
+                "error_rate": endpoint.error_rate,
+                "requests":   endpoint.requests,
+                "failures":   endpoint.failures,
+            } for endpoint in self.__rank() ]
+
+
+    def get_ranked(self):
+        """Returns the endpoints in the order they should be tried for a request."""
+
+        with self.__lock:
+            self.__requests += 1
+            ranked = self.__rank()
+
+            if len(ranked) > 1 and self.__requests % self.__probe_interval == 0:
+                probe = min(ranked, key = lambda endpoint: endpoint.last_used)
+                ranked.remove(probe)
+                ranked.insert(0, probe)
+
+            return ranked
+
+
+    def is_failure(self, error):
+        """Returns True if the exception means that the endpoint has failed."""
+
+        if isinstance(error, Error):
+            return False
+
+        if isinstance(error, url_request.HTTPError) and error.code < 500 and error.code != 429:
+            return False
+
+        return True
+
+
+    def report(self, endpoint, latency, succeeded):
+        """Records the outcome of a request sent to the endpoint."""
+
+        with self.__lock:
+            endpoint.requests += 1
+            endpoint.last_used = self.__requests
+
+            if succeeded or endpoint.latency is None:
+                endpoint.latency = latency if endpoint.latency is None else (
+                    endpoint.latency + self.__latency_weight * (latency - endpoint.latency) )
+
+            if not succeeded:
+                endpoint.failures += 1
+
+            endpoint.error_rate += self.__error_weight * ( ( 0.0 if succeeded else 1.0 ) - endpoint.error_rate )
+
+
+    def __rank(self):
+        """Returns the endpoints sorted by their health."""
+
+        return sorted(self.__endpoints, key = lambda endpoint: (
+            endpoint.latency is not None, ( endpoint.latency or 0 ) + endpoint.error_rate * self.__error_penalty ))
+
+
+
+class Concurrency_limiter:
+    """
+    Adaptive limit of the concurrent requests to a host (AIMD).
+
+    While the latency stays flat and the limit is reached, the limit grows:
+    doubles every round trip until the first back off, and then grows by one
+    per round trip. On timeouts, "429" and "503" responses or if the latency
+    rises, the limit is cut, but only once per round trip (by the requests
+    started after the previous cut).
+
+    The latency is considered as rising when its short-window moving average
+    exceeds the long-window one by half (as gradient limiters do), so a
+    single slow response or the latency jitter doesn't count as congestion,
+    and only after enough responses are observed to have a baseline.
+    """
+
+    # Minimum and maximum limit.
+    __min_limit = 1
+    __max_limit = MAX_CONCURRENCY
+
+    # The limit is multiplied by this factor on timeouts and throttling
+    # responses.
+    __overload_backoff = 0.5
+
+    # The limit is multiplied by this factor when the latency rises.
+    __latency_backoff = 0.9
+
+    # The latency is considered as rising when its short-window moving
+    # average exceeds the long-window one multiplied by this factor.
+    __latency_tolerance = 1.5
+
+    # Weight of a new observation in the short-window latency moving average.
+    __latency_weight = 0.1
+
+    # Weight of a new observation in the long-window latency moving average
+    # (the baseline which follows the changes of the route to the host).
+    # Until the moving averages have the window's worth of observations, they
+    # are plain averages.
+    __long_latency_weight = 0.01
+
+    # The observations are limited to the long-window moving average
+    # multiplied by this factor in the short-window one, so a single very
+    # slow response doesn't look as the rising latency.
+    __max_latency_ratio = 3.0
+
+    # Number of the latency observations which are needed to cut the limit
+    # on the rising latency.
+    __min_samples = 10
+
+    # Maximum number of the limit changes kept in the history.
+    __history_size = 100
+
+    # The host.
+    host = None
+
+    # Current limit (fractional: it grows by parts of a request).
+    limit = 2.0
+
+    # Number of the requests in flight.
+    in_flight = 0
+
+    # Short-window moving average of the latency in seconds (None until the
+    # first request).
+    latency = None
+
+    # Long-window moving average of the latency in seconds (None until the
+    # first request).
+    long_latency = None
+
+    # Number of the latency observations.
+    samples = 0
+
+    # Number of the timeouts and throttling responses.
+    overloads = 0
+
+    # Size of the response bodies gotten from the network (compressed) and
+    # of the decoded ones (see iter_url_contents()).
+    wire_bytes = 0
+    decoded_bytes = 0
+
+    # Whether the limit hasn't been cut yet (it doubles every round trip).
+    __slow_start = True
+
+    # Time of the last limit cut.
+    __last_cut = 0
+
+    # (time, limit) tuples of the limit changes.
+    __history = None
+
+    # Guards the state and signals about the freed slots.
+    __condition = None
+
+
+    def __init__(self, host):
+        self.host = host
+        self.__history = collections.deque([ ( time.time(), int(self.limit) ) ], self.__history_size)
+        self.__condition = threading.Condition()
+
+
+    def acquire(self):
+        """
+        Waits until the request to the host may be sent and returns a token to
+        be passed to release().
+        """
+
+        with self.__condition:
+            while self.in_flight >= int(self.limit):
+                self.__condition.wait()
+
+            self.in_flight += 1
+            return ( time.time(), self.in_flight >= int(self.limit) )
+
+
+    def get_metrics(self):
+        """Returns the limiter's info dictionary."""
+
+        with self.__condition:
+            return {
+                "limit":         int(self.limit),
+                "in_flight":     self.in_flight,
+                "latency":       self.latency,
+                "long_latency":  self.long_latency,
+                "samples":       self.samples,
+                "overloads":     self.overloads,
+                "wire_bytes":    self.wire_bytes,
+                "decoded_bytes": self.decoded_bytes,
+                "history":       [ list(change) for change in self.__history ],
+            }
+
+
+    def count_bytes(self, wire_bytes, decoded_bytes):
+        """Adds the sizes of a response body (see iter_url_contents()) to the host's counters."""
+
+        with self.__condition:
+            self.wire_bytes += wire_bytes
+            self.decoded_bytes += decoded_bytes
+
+
+    @staticmethod
+    def is_overload(error):
+        """Returns True if the exception means that the host is overloaded."""
+
+        if isinstance(error, url_request.URLError) and not isinstance(error, url_request.HTTPError):
+            error = error.reason
+
+        if isinstance(error, url_request.HTTPError):
+            return error.code in (429, 503)
+
+        if isinstance(error, xmlrpclib.ProtocolError):
+            return error.errcode in (429, 503)
+
+        return isinstance(error, socket.timeout)
+
+
+    def release(self, token, latency = None, overloaded = False):
+        """
+        Marks the request as finished. latency - the time (in seconds) the
+        host took to respond (None if the request has failed), overloaded -
+        whether the host has responded with a timeout or throttling.
+        """
+
+        start_time, saturated = token
+
+        with self.__condition:
+            self.in_flight -= 1
+
+            if overloaded:
+                self.overloads += 1
+
+                if start_time >= self.__last_cut:
+                    self.__cut(self.__overload_backoff)
+            elif latency is not None:
+                self.samples += 1
+
+                if self.latency is None:
+                    self.latency = self.long_latency = latency
+                else:
+                    self.latency += max(self.__latency_weight, 1.0 / self.samples) * (
+                        min(latency, self.long_latency * self.__max_latency_ratio) - self.latency )
+                    self.long_latency += max(self.__long_latency_weight, 1.0 / self.samples) * (
+                        latency - self.long_latency )
+
+                if self.samples >= self.__min_samples and self.latency > self.long_latency * self.__latency_tolerance:
+                    if start_time >= self.__last_cut:
+                        self.__cut(self.__latency_backoff)
+                elif saturated:
+                    self.__set_limit(self.limit + ( 1 if self.__slow_start else 1 / self.limit ))
+
+            self.__condition.notify_all()
+
+
+    def __cut(self, factor):
+        """Cuts the limit by the factor."""
+
+        self.__slow_start = False
+        self.__last_cut = time.time()
+        self.__set_limit(self.limit * factor)
+
+
+    def __set_limit(self, limit):
+        """Sets the limit recording its changes to the history."""
+
+        limit = min(max(limit, self.__min_limit), self.__max_limit)
+
+        if int(limit) != int(self.limit):
+            self.__history.append(( time.time(), int(limit) ))
+
+        self.limit = limit
+
+
+
+class Concurrency_limiters:
+    """
+    Adaptive concurrency limiters (see Concurrency_limiter) by hosts (and the
+    proxies the requests are sent through).
+    """
+
+    # The limiters by hosts.
+    __limiters = None
+
+    # Guards the limiters dictionary.
+    __lock = None
+
+
+    def __init__(self):
+        self.__limiters = {}
+        self.__lock = threading.Lock()
+
+
+    def get(self, host, proxy = None):
+        """
+        Returns the limiter of the host (or the host of the URL). The requests
+        sent through a proxy (URL or host) have their own limiter.
+        """
+
+        if "/" in host:
+            host = url_parse.urlsplit(host).netloc
+
+        host = host.lower()
+
+        if proxy:
+            host += " via " + ( url_parse.urlsplit(proxy).netloc if "/" in proxy else proxy )
+
+        with self.__lock:
+            limiter = self.__limiters.get(host)
+
+            if limiter is None:
+                limiter = self.__limiters[host] = Concurrency_limiter(host)
+
+            return limiter
+
+
+    def get_metrics(self):
+        """Returns a dictionary of the limiters' info by hosts."""
+
+        with self.__lock:
+            limiters = list(self.__limiters.values())
+
+        return dict( ( limiter.host, limiter.get_metrics() ) for limiter in limiters )
+
+
+
+class Xml_rpc_proxy:
+    """
+    HTTP proxy transport for xmlrpclib (see create()) which also limits the
+    concurrent requests (see Concurrency_limiter).
+
+    xmlrpclib is imported on demand, so the transport class which is derived
+    from xmlrpclib.Transport is defined on the first use.
+    """
+
+    # The transport class.
+    __transport_class = None
+
+
+    @staticmethod
+    def create(proxy = None, use_datetime = 0):
+        """
+        Returns a new transport. proxy - URL of the HTTP proxy to use instead
+        of the one from the environment.
+        """
+
+        if Xml_rpc_proxy.__transport_class is None:
+            Xml_rpc_proxy.__transport_class = Xml_rpc_proxy.__define_transport_class()
+
+        return Xml_rpc_proxy.__transport_class(proxy, use_datetime)
+
 
-            file_size = os.path.getsize(path)
-            file_hash = file_size
+    @staticmethod
+    def __define_transport_class():
+        """Defines the transport class."""
 
-            if file_size < 65536 * 2:
-                raise Error("file too small")
+        class Transport(xmlrpclib.Transport):
+            # Proxy host (if exists).
+            proxy = None
 
-            for pos in (0, file_size - 65536):
-                hashing_file.seek(pos)
 
-                for i in range(65536 / buf_size):
-                    buf = b""
-                    data = b" "
+            def __init__(self, proxy = None, use_datetime = 0):
+                xmlrpclib.Transport.__init__(self, use_datetime)
 
-                    while len(buf) != buf_size:
-                        data = hashing_file.read(buf_size - len(buf))
-                        if data:
-                            buf += data
-                        else:
-                            raise Error("end of file error")
+                if proxy is None:
+                    proxy = urllib.getproxies().get("http", "").strip()
 
-                    file_hash += struct.unpack(b"=q", buf)[0]
-                    file_hash &= 0xFFFFFFFFFFFFFFFF
+                if proxy:
+                    if proxy.startswith("http://") and url_parse.urlparse(proxy).netloc:
+                        self.proxy = url_parse.urlparse(proxy).netloc
+                    else:
+                        raise Fatal_error("invalid HTTP proxy specified ({0})", proxy)
 
-            return (file_size, "{0:016x}".format(file_hash))
-        except IOError as e:
-            raise Error("Unable to hash file '{0}': {1}.", path, e)
-        except Exception as e:
-            raise Fatal_error("Error while hashing file '{0}': {1}.", path, e)
 
+            def make_connection(self, host):
+                if not self.proxy:
+                    return xmlrpclib.Transport.make_connection(self, host)
 
-    def __get_language(self, language):
-        """
-        Converts ISO 639-1 language codes to www.opensubtitles.org language
-        codes.
-        """
+                # Keeping the connection alive as xmlrpclib.Transport does
+                if self._connection and self._connection[0] == host:
+                    return self._connection[1]
 
-        if language == "el":
-            return "ell"
-        else:
-            return LANGUAGES[language]
+                connection = http_client.HTTPConnection(self.proxy, timeout = NETWORK_TIMEOUT)
+                connection.real_host = host
+                self._connection = ( host, connection )
 
+                return connection
 
-class Tvsubtitles_net:
-    """
-    Gives a facility to download subtitles from www.tvsubtitles.net.
-    """
 
-    # www.tvsubtitles.net domain name.
-    __domain_name = "www.tvsubtitles.net"
+            def request(self, host, handler, request_body, verbose = False):
+                # The number of the concurrent requests to the host is limited by its
+                # adaptive concurrency limiter. The XML-RPC replies' "429" and "503"
+                # statuses are considered as throttling as well.
+                limiter = CONCURRENCY_LIMITERS.get(host[0] if isinstance(host, tuple) else host, self.proxy)
+                token = limiter.acquire()
+                start_time = time.time()
 
-    # URL prefix for all www.tvsubtitles.net URLs.
-    __url_prefix = "http://" + __domain_name + "/"
+                try:
+                    reply = xmlrpclib.Transport.request(self, host, handler, request_body, verbose)
+                except xmlrpclib.Fault:
+                    limiter.release(token, time.time() - start_time)
+                    raise
+                except Exception as e:
+                    limiter.release(token, overloaded = limiter.is_overload(e))
+                    raise
 
-    # Regular expression that matches a HTML tag.
-    __tag_re = re.compile("<[^>]+>")
+                try:
+                    status = str(reply[0]["status"]).split(" ")[0]
+                except Exception:
+                    status = None
 
-    # Downloaded data cache.
-    __cache = None
+                if status in ("429", "503"):
+                    limiter.release(token, overloaded = True)
+                else:
+                    limiter.release(token, time.time() - start_time)
 
+                return reply
 
-    def __init__(self):
-        self.__cache = {}
 
+            def send_request(self, *args):
+                # The arguments are (connection, handler, request_body) in Python 2
+                # and (host, handler, request_body, debug) in Python 3. The request
+                # is sent to the proxy with the absolute URL (the Host header is set
+                # from it).
+                if self.proxy:
+                    host = args[0] if PY3 else args[0].real_host
+                    args = ( args[0], "http://{0}{1}".format(host, args[1]) ) + tuple(args[2:])
 
-    def get(self, file_path, show_name, season, episode, language):
-        """Gets a TV show subtitles and returns the subtitles file contents."""
+                return xmlrpclib.Transport.send_request(self, *args)
 
-        subtitles = self.__get_episode_subtitles(show_name, season, episode)
+        return Transport
 
-        if language not in subtitles:
-            raise Not_found()
 
-        try:
-            zipfile_data = get_url_contents( self.__url_prefix + "download-{0}.html".format(subtitles[language]) )
-        except Exception as e:
-            raise Fatal_error("Unable to download the subtitles: {0}.", e)
 
-        try:
-            subtitles_zip = zipfile.ZipFile(BytesIO(zipfile_data))
-            if len(subtitles_zip.namelist()) != 1:
-                raise Error("zip file contains {0} files instead of 1", len(subtitles_zip.namelist()))
+class Event_sink:
+    """
+    A sink of the log messages and the structured events. The base class
+    discards them, so it's also the no-op sink.
+    """
 
-            return subtitles_zip.open(subtitles_zip.namelist()[0]).read()
-        except Exception as e:
-            raise Error("Unable to unzip the subtitles file: {0}.", e)
+    def emit(self, event):
+        """
+        Emits an event - a dictionary with "time" key and either "level"
+        ("info" or "error") and "message" keys for the log messages or "event"
+        key (the event kind) and the event specific keys:
 
+        "subtitles" - an outcome of getting the subtitles for a media file:
+        "path", "language", "outcome" ("downloaded", "not_found" or "failed"),
+        "source" (the subtitles source or None) and "duration" (in seconds).
+        """
 
-    def __get_episodes(self, show_name, season):
-        """Returns a list of episodes for which we have subtitles."""
 
-        shows = self.__get_shows()
+    def close(self):
+        """Writes the pending events."""
 
-        if show_name in shows:
-            show = shows[show_name]
-        else:
-            raise Not_found()
 
-        try:
-            if season not in show["seasons"]:
-                episodes = {}
-
-                episode_list_url = self.__url_prefix + "tvshow-{0}-{1}.html".format(show["id"], season)
-                episode_list_html = get_url_contents(episode_list_url).decode("utf-8", errors = "replace")
-
-                all_episodes_regex = re.compile(r"""
-                    <td(\s[^>]*){0,1}>\s*</td>\s*
-                    <td(\s[^>]*){0,1}>\s*
-                    <a(\s[^>]*){0,1}\s+
-                        href\s*=\s*["']{0,1}
-                            /{0,1}episode-""" + str(show["id"]) + "-" + str(season) + r"""\.html
-                        ["']{0,1}
-                    (\s[^>]*){0,1}>
-                """, re.IGNORECASE | re.VERBOSE)
-
-                if len( [ x for x in all_episodes_regex.finditer(episode_list_html) ] ) != 1:
-                    raise Error("failed to parse a server response")
-
-                episode_regex = re.compile(r"""
-                    <td(\s[^>]*){0,1}>\s*""" +
-                        str(season) + r"""x0*(\d+)\s*
-                    </td>\s*
-                    <td(\s[^>]*){0,1}>\s*
-                    <a(\s[^>]*){0,1}\s+
-                        href\s*=\s*["']{0,1}
-                            /{0,1}episode-(\d+)\.html
-                        ["']{0,1}
-                    (\s[^>]*){0,1}>
-                """, re.IGNORECASE | re.VERBOSE)
-
-                for match in episode_regex.finditer(episode_list_html):
-                    episodes[int(match.group(2))] = { "id": match.group(5) }
-
-                show["seasons"][season] = episodes
-
-            return show["seasons"][season]
-        except Exception as e:
-            raise Fatal_error("Unable to get episode list for the TV show from {1}: {2}.", self.__domain_name, e)
 
+class Buffered_event_sink(Event_sink):
+    """
+    A base class for the event sinks which write the events in batches in
+    background, so the emitting threads don't block on the output. The queue
+    is bounded: when it's full, the emitting threads wait for the writer.
+    """
 
-    def __get_episode_subtitles(self, show_name, season, episode_number):
-        """
-        Returns a list of subtitles which we have for the episode specified by
-        the arguments.
-        """
+    # Maximum number of the queued events.
+    __max_queue_size = 10000
 
-        episodes = self.__get_episodes(show_name, season)
+    # Maximum number of the events which are written at once.
+    __batch_size = 1000
 
-        if episode_number in episodes:
-            episode = episodes[episode_number]
-        else:
-            raise Not_found()
+    # Queued events.
+    __queue = None
 
-        try:
-            if "subtitles" not in episode:
-                subtitles_dict = {}
-                subtitles_list = []
-
-                subtitles_list_url = self.__url_prefix + "episode-{0}.html".format(episode["id"])
-                subtitles_list_html = get_url_contents(subtitles_list_url).decode("utf-8", errors = "replace")
-
-                subtitles_regex = re.compile(r"""
-                    <a(\s[^>]*){0,1}\s+
-                        href\s*=\s*["']{0,1}
-                            /{0,1}subtitle-(\d+)\.html
-                        ["']{0,1}
-                    (\s[^>]*){0,1}>
-                        (.+?)
-                    </a>
-                """, re.IGNORECASE | re.DOTALL | re.VERBOSE)
-
-                subtitles_info_regex = re.compile(r"""
-                    <img(\s[^>]*){0,1}\s+
-                        src\s*=\s*["']{0,1}
-                            [^'"]*flags/([a-z]{2})\.[a-z]+
-                        ["']{0,1}
-                    (\s[^>]*){0,1}>
-                    .*
-                    <p(\s[^>]*){0,1}\s+
-                        (
-                            title\s*=\s*["']{0,1}
-                                downloaded
-                            ["']{0,1}
-                        |
-                            alt\s*=\s*["']{0,1}
-                                downloaded
-                            ["']{0,1}
-                        )
-                    (\s[^>]*){0,1}>
-                        (.*?)
-                    </p>
-                """, re.IGNORECASE | re.DOTALL | re.VERBOSE)
-
-                for match in subtitles_regex.finditer(subtitles_list_html):
-                    subtitles = { "id": match.group(2) }
-                    subtitles_info_html = match.group(4)
-
-                    info_match = subtitles_info_regex.search(subtitles_info_html)
-                    if not info_match:
-                        raise Exception("failed to parse a server response")
-
-                    downloads = self.__tag_re.sub("", info_match.group(7)).replace("&nbsp;", " ").strip()
-                    try:
-                        downloads = int(downloads)
-                    except ValueError:
-                        raise Exception("failed to parse a server response")
+    # Guards the queue.
+    __condition = None
 
-                    subtitles["language"] = self.__get_language(info_match.group(2))
-                    subtitles["downloads"] = downloads
+    # The writer thread (None until the first event is emitted).
+    __writer = None
 
-                    subtitles_list.append(subtitles)
+    # True if the sink has been closed: the events are written synchronously.
+    __closed = False
 
-                # Getting only one subtitle with the most downloads per
-                # language.
-                # -->
-                subtitles_list.sort(
-                    key = lambda subtitle: ( subtitle["language"], subtitle["downloads"] ), reverse = True)
 
-                for subtitles in subtitles_list:
-                    if subtitles["language"] not in subtitles_dict:
-                        subtitles_dict[subtitles["language"]] = subtitles["id"]
-                # <--
+    def __init__(self):
+        self.__queue = collections.deque()
+        self.__condition = threading.Condition()
 
-                episode["subtitles"] = subtitles_dict
 
-            return episode["subtitles"]
-        except Exception as e:
-            raise Fatal_error("Unable to get subtitles list from {0}: {1}.", self.__domain_name, e)
+    def emit(self, event):
+        with self.__condition:
+            if not self.__closed:
+                if self.__writer is None:
+                    self.__writer = threading.Thread(target = self.__write_events)
+                    self.__writer.daemon = True
+                    self.__writer.start()
+                    atexit.register(self.close)
 
+                while len(self.__queue) >= self.__max_queue_size and not self.__closed:
+                    # Waiting with a timeout, so the signals are handled
+                    self.__condition.wait(1)
 
-    def __get_language(self, language):
-        """
-        Converts www.tvsubtitles.net language codes to the ISO 639-1 language
-        code.
-        """
+            if not self.__closed:
+                self.__queue.append(event)
+                self.__condition.notify_all()
+                return
 
-        if language == "gr":
-            return "el"
-        else:
-            return language
+        self.__write([ event ])
 
 
-    def __get_shows(self):
-        """Returns a list of all www.tvsubtitles.net shows."""
+    def close(self):
+        with self.__condition:
+            self.__closed = True
+            self.__condition.notify_all()
+            writer = self.__writer
 
-        try:
-            if not self.__cache:
-                shows = {}
+        if writer is not None:
+            writer.join()
 
-                tv_show_list_html = get_url_contents(self.__url_prefix + "tvshows.html").decode("utf-8", errors = "replace")
 
-                tv_show_regex = re.compile(r"""
-                    <a(\s[^>]*){0,1}\s+
-                        href\s*=\s*["']{0,1}
-                            /{0,1}tvshow-(\d+)-\d+\.html
-                        ["']{0,1}
-                    (\s[^>]*){0,1}>
-                        (.+?)
-                    </a>
-                """, re.IGNORECASE | re.VERBOSE)
+    def write(self, events):
+        """Writes a batch of events (must be implemented in the derived classes)."""
 
-                for match in tv_show_regex.finditer(tv_show_list_html):
-                    show_name = self.__tag_re.sub("", match.group(4)).replace("&nbsp;", " ").strip().lower()
-                    shows[show_name] = { "id": match.group(2), "seasons": {} }
+        raise Exception("Not implemented")
 
-                if not shows:
-                    raise Exception("failed to parse a server response")
 
-                self.__cache = shows
+    def __write(self, events):
+        """Writes a batch of events ignoring the output errors."""
 
-            return self.__cache
-        except Exception as e:
-            raise Fatal_error("Unable to get TV show list from {0}: {1}.", self.__domain_name, e)
+        try:
+            self.write(events)
+        except Exception:
+            # There is no place to report the error to
+            pass
 
 
+    def __write_events(self):
+        """Writes the queued events (in background) until the sink is closed."""
 
-class Xml_rpc_proxy(xmlrpclib.Transport):
-    """HTTP proxy for xmlrpclib."""
+        while True:
+            with self.__condition:
+                while not self.__queue and not self.__closed:
+                    self.__condition.wait()
 
-    # Proxy host (if exists).
-    proxy = None
+                if not self.__queue:
+                    return
 
+                events = [ self.__queue.popleft() for event_id in range(min(len(self.__queue), self.__batch_size)) ]
+                self.__condition.notify_all()
 
-    def __init__(self, use_datetime = 0):
-        xmlrpclib.Transport.__init__(self, use_datetime)
+            self.__write(events)
 
-        proxy = urllib.getproxies().get("http", "").strip()
 
-        if proxy:
-            if proxy.startswith("http://") and urlparse(proxy).netloc:
-                self.proxy = urlparse(proxy).netloc
-            else:
-                raise Fatal_error("invalid HTTP proxy specified ({0})", proxy)
 
+class Console_event_sink(Buffered_event_sink):
+    """
+    A buffered event sink which writes the log messages to the standard
+    output (info messages) and to the standard error (error messages). Other
+    events are discarded.
+    """
+
+    def write(self, events):
+        for is_error, messages in itertools.groupby(
+            ( event for event in events if "message" in event ), lambda event: event["level"] == "error"
+        ):
+            output = sys.stderr if is_error else sys.stdout
+            output.write("".join( event["message"] + "\n" for event in messages ))
+            output.flush()
 
-    def make_connection(self, host):
-        connection = HTTPConnection(self.proxy if self.proxy else host)
 
-        if hasattr(connection, "real_host"):
-            raise Fatal_error("logical error")
 
-        connection.real_host = host
+class Json_event_sink(Buffered_event_sink):
+    """
+    A buffered event sink which writes all events as JSON objects - one per
+    line (JSON Lines).
+    """
 
-        return connection
+    # File object to write the events to (None - the standard output).
+    __output = None
 
 
-    def send_request(self, connection, handler, request_body):
-        connection.putrequest("POST", "http://{0}{1}".format(connection.real_host, handler))
+    def __init__(self, output = None):
+        Buffered_event_sink.__init__(self)
+        self.__output = output
 
 
-    def send_host(self, connection, host):
-        connection.putheader("Host", connection.real_host)
+    def write(self, events):
+        output = sys.stdout if self.__output is None else self.__output
+        output.write("".join( json.dumps(event, sort_keys = True) + "\n" for event in events ))
+        output.flush()
 
 
 
 class Pysd:
     """The pysd script worker."""
 
+    # Event sinks by log formats.
+    __event_sinks = {
+        "console": Console_event_sink,
+        "json":    Json_event_sink,
+        "none":    Event_sink,
+    }
+
 
     def __init__(self):
         try:
@@ -920,10 +5089,59 @@ class Pysd:
 
 
             locale.setlocale(locale.LC_ALL, "")
-            languages, use_opensubtitles, paths, recursive = self.__get_cmd_options()
-            tools = Tv_show_tools(use_opensubtitles)
+            options = self.__get_cmd_options()
+
+            if options.log_format != "console":
+                set_event_sink(self.__event_sinks[options.log_format]())
+
+            if options.connect_path is not None:
+                client = Subtitles_service_client(options.connect_path)
+
+                try:
+                    if options.import_cache_path is not None:
+                        client.import_cache(options.import_cache_path)
+
+                    if options.lookup:
+                        errors = self.__lookup(client.lookup)
+                    elif options.paths:
+                        errors = client.get_subtitles(
+                            options.paths, options.languages, options.recursive, options.time_budget)
+                    else:
+                        errors = 0
+
+                    if options.export_cache_path is not None:
+                        client.export_cache(options.export_cache_path)
+
+                    if options.metrics:
+                        self.__print_json(client.get_metrics())
+                except Error as e:
+                    raise Fatal_error(str(e))
+            else:
+                try:
+                    store = None if options.store_path is None else Subtitles_store(
+                        options.store_path, options.store_max_size, options.store_compress, options.store_place_mode)
+                except Error as e:
+                    raise Fatal_error(str(e))
+
+                leases = None if options.lookup else Work_leases()
 
-            errors = tools.get_subtitles(paths, languages, recursive)
+                if options.serve_path is not None:
+                    try:
+                        service = Subtitles_service(options.serve_path, options.use_opensubtitles, options.hedge_delay,
+                            store, options.direct_io, leases, options.endpoints)
+                        if options.import_cache_path is not None:
+                            service.import_cache(options.import_cache_path)
+
+                        if options.prefetch_interval is not None:
+                            service.schedule_prefetch(
+                                options.paths, options.recursive, options.prefetch_interval, options.prefetch_budget)
+
+                        service.serve()
+                        errors = 0
+                    except Error as e:
+                        raise Fatal_error(str(e))
+                else:
+                    errors = self.__get_subtitles(options, store, leases)
         except (End_work_exception, Fatal_error) as e:
             E(e)
         except BaseException as e:
@@ -936,64 +5154,287 @@ class Pysd:
 
 
     def __get_cmd_options(self):
-        """
-        Parses the command line options and returns a tuple that contains a
-        list of video files and directories with video files, a list of
-        subtitles languages to download and a flag - whether we should download
-        subtitles from www.opensubtitles.org.
-        """
+        """Parses the command line options and returns a Pysd_options object."""
 
         argv = [ "pysd" ]
 
         try:
             argv = sys.argv if PY3 else [ string.decode(locale.getlocale()[1]) for string in sys.argv ]
             cmd_options, cmd_args = getopt.gnu_getopt(
-                argv[1:], "hl:ro", [ "lang=", "recursive", "opensubtitles" ] )
+                argv[1:], "hl:rot:", [ "lang=", "recursive", "opensubtitles", "time-budget=", "hedge-delay=", "resume", "store=",
+                  "store-max-size=", "store-compress", "store-place=", "serve=", "connect=", "lookup", "direct-io", "import-cache=", "export-cache=",
+                  "prefetch-interval=", "prefetch-budget=", "log-format=",
+                  "mirror=", "proxy=", "metrics" ] )
 
-            languages = set()
-            recursive = False
-            use_opensubtitles = False
+            options = Pysd_options()
+            mirrors = {}
+            proxies = {}
 
             for option, value in cmd_options:
                 if option in ("-h", "--help"):
                     print(
                         """{0} [OPTIONS] -l LANGUAGE (DIRECTORY|FILE)...\n\n"""
                          """Options:\n"""
-                         """ -l, --lang          a comma separated list of subtitles languages to download ("en,ru")\n"""
+                         """ -l, --lang          a comma separated list of subtitles languages to download in priority\n"""
+                         """                     order ("en,ru")\n"""
                          """ -r, --recursive     process subdirectories recursively\n"""
                          """ -o, --opensubtitles download subtitles also from www.opensubtitles.org (enhances the result,\n"""
                          """                     but significantly increases the script work time + www.opensubtitles.org\n"""
                          """                     servers are often down)\n"""
+                         """ -t, --time-budget   time budget in seconds: the newest media files are processed first and\n"""
+                         """                     the work which has not been started when it expires is skipped\n"""
+                         """     --hedge-delay   query all subtitles sources concurrently starting each next request\n"""
+                         """                     after the specified delay in seconds (the sources preference order is\n"""
+                         """                     kept)\n"""
+                         """     --resume        record the work done to a run journal and resume the previous run\n"""
+                         """                     with the same arguments skipping the work which has been finished\n"""
+                         """     --store         a directory for a local store of the downloaded subtitles (may be shared\n"""
+                         """                     between runs and machines)\n"""
+                         """     --store-max-size\n"""
+                         """                     maximum total size in bytes of the subtitles in the store (the least\n"""
+                         """                     recently used ones are evicted, default: 256 MiB)\n"""
+                         """     --store-compress\n"""
+                         """                     keep the subtitles in the store gzipped\n"""
+                         """     --store-place   how the subtitles are placed from the store to the media directories:\n"""
+                         """                     "copy", "hardlink" or "reflink" (default, falls back to copying)\n"""
+                         """     --serve         run as a service which serves the requests at the specified UNIX\n"""
+                         """                     socket keeping the subtitles sources caches and sessions warm\n"""
+                         """     --connect       send the request to the service running at the specified UNIX socket\n"""
+                         """     --lookup        look up subtitles for the JSON list of records read from the standard\n"""
+                         """                     input (see Tv_show_tools.lookup()) and print the result as JSON\n"""
+                         """     --direct-io     read media files for www.opensubtitles.org hashing bypassing the page\n"""
+                         """                     cache\n"""
+                         """     --import-cache  merge the subtitles sources caches from the specified cache bundle\n"""
+                         """                     before the work (may be used to warm the caches of a fleet of nodes)\n"""
+                         """     --export-cache  export the subtitles sources caches to the specified cache bundle\n"""
+                         """                     after the work (may be used without video files to convert a cache\n"""
+                         """                     bundle or to export the caches of a service)\n"""
+                         """     --prefetch-interval\n"""
+                         """                     with --serve: prefetch the subtitles info for the upcoming episodes of\n"""
+                         """                     the TV shows in the specified directories every specified number of\n"""
+                         """                     seconds while the service is idle\n"""
+                         """     --prefetch-budget\n"""
+                         """                     maximum network traffic in bytes of a prefetching round (default:\n"""
+                         """                     {1})\n"""
+                         """     --log-format    "console" (default) - log messages, "json" - log messages and\n"""
+                         """                     per-file outcomes as JSON Lines or "none"\n"""
+                         """     --mirror        a mirror of a subtitles source (SOURCE=URL, may be specified several\n"""
+                         """                     times): the requests are sent to the fastest and the most reliable of\n"""
+                         """                     the mirrors and proxies\n"""
+                         """     --proxy         an HTTP proxy for a subtitles source (SOURCE=URL, may be specified\n"""
+                         """                     several times)\n"""
+                         """     --metrics       print the subtitles sources' metrics (endpoints' health and hosts'\n"""
+                         """                     concurrency limits and traffic) as JSON after the work\n"""
                          """ -h, --help          show this help"""
-                                                .format(argv[0])
+                                                .format(argv[0], PREFETCH_BUDGET)
                     )
                     sys.exit(0)
                 elif option in ("-l", "--lang"):
                     for lang in value.split(","):
                         lang = lang.strip()
 
-                        if lang not in LANGUAGES:
+                        if not LANGUAGE_REGISTRY.is_valid(lang):
                             raise Error("invalid language '{0}'", lang)
 
-                        languages.add(lang)
+                        if lang not in options.languages:
+                            options.languages.append(lang)
                 elif option in ("-r", "--recursive"):
-                    recursive = True
+                    options.recursive = True
                 elif option in ("-o", "--opensubtitles"):
-                    use_opensubtitles = True
+                    options.use_opensubtitles = True
+                elif option in ("-t", "--time-budget"):
+                    try:
+                        options.time_budget = float(value)
+                        if options.time_budget <= 0:
+                            raise ValueError()
+                    except ValueError:
+                        raise Error("invalid time budget '{0}'", value)
+                elif option == "--hedge-delay":
+                    try:
+                        options.hedge_delay = float(value)
+                        if options.hedge_delay < 0:
+                            raise ValueError()
+                    except ValueError:
+                        raise Error("invalid hedge delay '{0}'", value)
+                elif option == "--resume":
+                    options.resume = True
+                elif option == "--store":
+                    options.store_path = value
+                elif option == "--store-max-size":
+                    try:
+                        options.store_max_size = int(value)
+                        if options.store_max_size <= 0:
+                            raise ValueError()
+                    except ValueError:
+                        raise Error("invalid subtitles store size '{0}'", value)
+                elif option == "--store-compress":
+                    options.store_compress = True
+                elif option == "--store-place":
+                    if value not in ( Subtitles_store.PLACE_COPY, Subtitles_store.PLACE_HARDLINK, Subtitles_store.PLACE_REFLINK ):
+                        raise Error("invalid subtitles placing mode '{0}'", value)
+                    options.store_place_mode = value
+                elif option == "--serve":
+                    options.serve_path = value
+                elif option == "--connect":
+                    options.connect_path = value
+                elif option == "--lookup":
+                    options.lookup = True
+                elif option == "--direct-io":
+                    options.direct_io = True
+                elif option == "--import-cache":
+                    options.import_cache_path = value
+                elif option == "--export-cache":
+                    options.export_cache_path = value
+                elif option == "--prefetch-interval":
+                    try:
+                        options.prefetch_interval = float(value)
+                        if options.prefetch_interval <= 0:
+                            raise ValueError()
+                    except ValueError:
+                        raise Error("invalid prefetch interval '{0}'", value)
+                elif option == "--prefetch-budget":
+                    try:
+                        options.prefetch_budget = int(value)
+                        if options.prefetch_budget <= 0:
+                            raise ValueError()
+                    except ValueError:
+                        raise Error("invalid prefetch budget '{0}'", value)
+                elif option in ("--mirror", "--proxy"):
+                    source, url = ( value.split("=", 1) + [ "" ] )[:2]
+                    if source not in ( "www.opensubtitles.org", "www.tvsubtitles.net" ):
+                        raise Error("invalid subtitles source '{0}'", source)
+
+                    Endpoint(url)
+                    ( mirrors if option == "--mirror" else proxies ).setdefault(source, []).append(url)
+                elif option == "--metrics":
+                    options.metrics = True
+                elif option == "--log-format":
+                    if value not in self.__event_sinks:
+                        raise Error("invalid log format '{0}'", value)
+                    options.log_format = value
                 else:
                     raise Error("invalid option '{0}'", option)
 
-            if not cmd_args:
-                raise Error("there is no TV show video file or TV show directory specified")
+            if options.serve_path is not None and options.connect_path is not None:
+                raise Error("--serve and --connect options are mutually exclusive")
+
+            if options.store_path is None and (
+                options.store_max_size is not None or options.store_compress or
+                options.store_place_mode != Subtitles_store.PLACE_REFLINK
+            ):
+                raise Error("--store-max-size, --store-compress and --store-place options may be used only with --store")
+
+            options.paths = cmd_args
+            options.endpoints = dict(
+                ( source, [
+                    Endpoint(mirror, proxy) for mirror in mirrors.get(source, [ None ]) for proxy in proxies.get(source, [ None ]) ] )
+                        for source in set(mirrors) | set(proxies) )
+
+            if options.prefetch_interval is not None:
+                if options.serve_path is None:
+                    raise Error("--prefetch-interval option may be used only with --serve")
 
-            if not languages:
-                raise Error("there is no subtitles languages specified")
+                if not cmd_args:
+                    raise Error("there is no TV show directory specified for prefetching")
 
-            return (languages, use_opensubtitles, cmd_args, recursive)
+            if options.serve_path is None and not options.lookup and not (
+                ( options.export_cache_path is not None or options.metrics ) and not cmd_args
+            ):
+                if not cmd_args:
+                    raise Error("there is no TV show video file or TV show directory specified")
+
+                if not options.languages:
+                    raise Error("there is no subtitles languages specified")
+
+            return options
         except Exception as e:
             raise Fatal_error("Command line options parsing error: {0}. See `{1} -h` for more information.", e, argv[0])
 
 
+    def __get_subtitles(self, options, store, leases):
+        """
+        Gets the subtitles for the media files (or looks up the records read
+        from the standard input) importing and exporting the cache bundles
+        according to the Pysd_options object. Returns number of errors.
+        """
+
+        journal = None
+
+        if options.paths and not options.lookup and options.resume:
+            try:
+                journal = Run_journal(self.__get_journal_path(options.paths, options.languages, options.recursive), True)
+            except Error as e:
+                raise Fatal_error(str(e))
+
+        try:
+            tools = Tv_show_tools(options.use_opensubtitles, options.hedge_delay, journal, store,
+                direct_io = options.direct_io, leases = leases, endpoints = options.endpoints)
+
+            try:
+                if options.import_cache_path is not None:
+                    tools.import_cache(options.import_cache_path)
+
+                if options.lookup:
+                    errors = self.__lookup(tools.lookup)
+                elif options.paths:
+                    errors = tools.get_subtitles(options.paths, options.languages, options.recursive, options.time_budget)
+                else:
+                    errors = 0
+
+                if options.export_cache_path is not None:
+                    tools.export_cache(options.export_cache_path)
+
+                if options.metrics:
+                    self.__print_json(tools.get_metrics())
+            except Error as e:
+                raise Fatal_error(str(e))
+
+            return errors
+        finally:
+            if journal is not None:
+                journal.close()
+
+
+    def __get_journal_path(self, paths, languages, recursive):
+        """Returns path to the run journal for the specified arguments."""
+
+        run_id = json.dumps([ sorted( os.path.abspath(path) for path in paths ), languages, recursive ])
+        return os.path.join(CACHE_DIR, "journal-" + hashlib.md5(run_id.encode("utf-8")).hexdigest())
+
+
+    def __lookup(self, lookup):
+        """
+        Looks up the records read from the standard input using the lookup
+        function and prints the results. Returns number of records with errors.
+        """
+
+        try:
+            records = json.loads(sys.stdin.read())
+            if not isinstance(records, list) or not all( isinstance(record, dict) for record in records ):
+                raise ValueError("a list of objects is expected")
+        except ValueError as e:
+            raise Fatal_error("Invalid lookup records: {0}.", e)
+
+        results = lookup(records)
+        self.__print_json(results)
+
+        return sum( 1 for result in results if result["errors"] )
+
+
+    def __print_json(self, data):
+        """
+        Prints the data as JSON to the standard output. The log messages are
+        written to it by the event sink in background, so the sink is closed
+        first: the pending messages are written before the data, and the
+        following ones are written synchronously.
+        """
+
+        EVENT_SINK.close()
+
+        sys.stdout.write(json.dumps(data, indent = 4, sort_keys = True) + "\n")
+        sys.stdout.flush()
+
+
     def __signal_handler(self, signum, frame):
         """Handler for the UNIX signals."""
 
@@ -1001,6 +5442,80 @@ class Pysd:
 
 
 
+class Pysd_options:
+    """Command line options of the pysd script."""
+
+    # Subtitles languages to download (in priority order).
+    languages = None
+
+    # Whether we should download subtitles from www.opensubtitles.org.
+    use_opensubtitles = False
+
+    # Video files and directories with video files.
+    paths = None
+
+    # Whether we should process subdirectories recursively.
+    recursive = False
+
+    # Time budget in seconds (None - unlimited).
+    time_budget = None
+
+    # Delay between the hedged requests (None if the mode is disabled).
+    hedge_delay = None
+
+    # Whether we should resume the previous run.
+    resume = False
+
+    # Path to the subtitles store (if used).
+    store_path = None
+
+    # Maximum total size of the subtitles store objects (None - the default
+    # one), whether to compress them and the subtitles placing mode (see
+    # Subtitles_store).
+    store_max_size = None
+    store_compress = False
+    store_place_mode = Subtitles_store.PLACE_REFLINK
+
+    # Path to the socket to serve the requests at (if the service is run).
+    serve_path = None
+
+    # Path to the socket of the service to send the request to (if used).
+    connect_path = None
+
+    # Whether we should look up the records read from the standard input.
+    lookup = False
+
+    # Whether we should read media files bypassing the page cache.
+    direct_io = False
+
+    # Path to the cache bundle to import (if used).
+    import_cache_path = None
+
+    # Path to the cache bundle to export (if used).
+    export_cache_path = None
+
+    # The upcoming episodes prefetching interval (None if the prefetching is
+    # disabled) and budget.
+    prefetch_interval = None
+    prefetch_budget = PREFETCH_BUDGET
+
+    # The log format.
+    log_format = "console"
+
+    # Lists of endpoints by subtitles source names.
+    endpoints = None
+
+    # Whether we should print the subtitles sources' metrics.
+    metrics = False
+
+
+    def __init__(self):
+        self.languages = []
+        self.paths = []
+        self.endpoints = {}
+
+
+
 class End_work_exception(BaseException):
     """Raised in the UNIX signal handlers."""
 
@@ -1033,44 +5548,238 @@ class Not_found(Error):
 
 
 
-def get_url_contents(url):
-    """Downloads a url and returns the gotten data."""
+def get_url_contents(url, max_data_size = MAX_DATA_SIZE, stats = None, proxy = None, retry = True):
+    """
+    Downloads a url and returns the gotten data. If max_data_size is None,
+    the data size is not limited.
 
-    max_data_size = 1024 * 1024
+    See iter_url_contents() for the stats and proxy arguments.
+    """
 
-    for tries_available in range(2, -1, -1):
+    for tries_available in range(2 if retry else 0, -1, -1):
         try:
-            url_file = urlopen(url, timeout = NETWORK_TIMEOUT)
-            contents = b""
-            data = b"non empy"
-
-            while data and len(contents) < max_data_size + 1:
-                data = url_file.read(max_data_size + 1 - len(contents))
-                contents += data
+            return b"".join(iter_url_contents(url, max_data_size, stats, proxy, retry = False))
+        except Error:
+            raise
         except Exception:
             if tries_available:
                 time.sleep(3)
             else:
                 raise
+
+    raise Error("logical error")
+
+
+def iter_url_contents(url, max_data_size = MAX_DATA_SIZE, stats = None, proxy = None, retry = True):
+    """
+    Downloads a url and yields the gotten data by chunks, so it is never held
+    in memory entirely. If max_data_size is None, the data size is not
+    limited.
+
+    The data is requested compressed (gzip or deflate) and is decompressed
+    incrementally. max_data_size limits the size of the decompressed data.
+
+    If stats dictionary is specified, "wire_bytes" (the size of the data
+    gotten from the network) and "decoded_bytes" (the size of the data
+    yielded) counters are kept in it. The counters are also added to the
+    host's ones (see Concurrency_limiter.get_metrics()).
+
+    proxy - URL of the HTTP proxy to use instead of the one from the
+    environment.
+
+    The request is retried (if retry is True) only if it fails before any
+    data is yielded.
+
+    The number of the concurrent requests to the host is limited by its
+    adaptive concurrency limiter (see Concurrency_limiter). The limiter's
+    slot is held until the response headers are gotten, so reading of big
+    responses doesn't block other requests.
+    """
+
+    limiter = CONCURRENCY_LIMITERS.get(url, proxy)
+
+    for tries_available in range(2 if retry else 0, -1, -1):
+        token = limiter.acquire()
+        start_time = time.time()
+        url_file = None
+
+        try:
+            request = url_request.Request(url, headers = { "Accept-Encoding": "gzip, deflate" })
+
+            if proxy is None:
+                url_file = url_request.urlopen(request, timeout = NETWORK_TIMEOUT)
+            else:
+                url_file = url_request.build_opener(url_request.ProxyHandler({ "http": proxy, "https": proxy })).open(
+                    request, timeout = NETWORK_TIMEOUT)
+
+            limiter.release(token, time.time() - start_time)
+            token = None
+
+            encoding = ( url_file.info().get("Content-Encoding") or "identity" ).strip().lower()
+            if encoding not in ("identity", "gzip", "x-gzip", "deflate"):
+                raise Error("unsupported content encoding '{0}'", encoding)
+
+            data = url_file.read(NETWORK_CHUNK_SIZE)
+        except Exception as e:
+            if token is not None:
+                limiter.release(token, overloaded = limiter.is_overload(e))
+
+            if url_file is not None:
+                url_file.close()
+
+            if isinstance(e, Error) or not tries_available:
+                raise
+
+            time.sleep(3)
         else:
-            if len(data) > max_data_size:
-                raise Error("gotten too big data size (> {0})", max_data_size)
+            break
+
+    if stats is None:
+        stats = {}
+
+    try:
+        decompressor = None
+        data_size = 0
+        stats["wire_bytes"] = stats["decoded_bytes"] = 0
+
+        while True:
+            stats["wire_bytes"] += len(data)
+
+            if encoding == "identity":
+                chunks = [ data ]
             else:
-                return contents
+                if decompressor is None:
+                    if encoding == "deflate":
+                        # Servers send both zlib wrapped and raw deflate data
+                        header = bytearray(data[:2])
+                        is_zlib = len(header) == 2 and header[0] & 0x0F == 8 and ( header[0] << 8 | header[1] ) % 31 == 0
+                        decompressor = zlib.decompressobj(zlib.MAX_WBITS if is_zlib else -zlib.MAX_WBITS)
+                    else:
+                        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
 
-    raise Error("logical error")
+                chunks = decompress_chunks(decompressor, data, not data)
+
+            for chunk in chunks:
+                data_size += len(chunk)
+                if max_data_size is not None and data_size > max_data_size:
+                    raise Error("gotten too big data size (> {0})", max_data_size)
+
+                stats["decoded_bytes"] = data_size
+
+                if chunk:
+                    yield chunk
+
+            if not data:
+                break
+
+            data = url_file.read(NETWORK_CHUNK_SIZE)
+    finally:
+        url_file.close()
+        limiter.count_bytes(stats["wire_bytes"], stats["decoded_bytes"])
+
+
+def decompress_chunks(decompressor, data, final = False):
+    """
+    Decompresses the data with a zlib decompressor object and yields the
+    decompressed data by chunks of NETWORK_CHUNK_SIZE at most, so the size of
+    the decompressed data held in memory doesn't depend on the compression
+    ratio. If final is True, the decompressor is flushed.
+    """
+
+    while data:
+        chunk = decompressor.decompress(data, NETWORK_CHUNK_SIZE)
+        data = decompressor.unconsumed_tail
+        yield chunk
+
+    if final:
+        yield decompressor.flush()
+
+
+def gunzip_chunks(chunks, max_data_size = MAX_DATA_SIZE):
+    """
+    Decompresses gzip data given by chunks incrementally and returns the
+    decompressed data. Raises Error if the decompressed data size exceeds
+    max_data_size (None - unlimited) or the data is truncated.
+    """
+
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    data = []
+    data_size = 0
+
+    for chunk in itertools.chain(chunks, [ None ]):
+        for decompressed in decompress_chunks(decompressor, chunk or b"", chunk is None):
+            data_size += len(decompressed)
+            if max_data_size is not None and data_size > max_data_size:
+                raise Error("gotten too big data size (> {0})", max_data_size)
+
+            data.append(decompressed)
+
+    if not getattr(decompressor, "eof", True):
+        raise Error("unexpected end of gzip data")
+
+    return b"".join(data)
+
+
+def run_concurrently(function, arguments, workers):
+    """
+    Calls the function for each of the arguments tuples using the specified
+    number of threads and waits for all calls to complete. Exceptions are
+    ignored.
+    """
+
+    arguments = list(arguments)
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            with lock:
+                if not arguments:
+                    return
+                args = arguments.pop()
+
+            try:
+                function(*args)
+            except Exception:
+                pass
+
+    threads = [ threading.Thread(target = worker) for thread_id in range(min(workers, len(arguments))) ]
+
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+
+def intern_string(string):
+    """Interns a string (if the Python version supports interning of it)."""
+
+    return sys.intern(string) if PY3 else string
 
 
 def E(message, *args):
-    """Prints an error message."""
+    """Logs an error message to the event sink."""
 
-    print(message.format(*args) if len(args) else message, file = sys.stderr)
+    EVENT_SINK.emit({ "time": time.time(), "level": "error", "message": message.format(*args) if len(args) else str(message) })
 
 
 def I(message, *args):
-    """Prints an info message."""
+    """Logs an info message to the event sink."""
+
+    EVENT_SINK.emit({ "time": time.time(), "level": "info", "message": message.format(*args) if len(args) else str(message) })
+
+
+def set_event_sink(sink):
+    """
+    Sets the sink of the log messages and the structured events (see
+    Event_sink). The previous sink is closed.
+    """
 
-    print(message.format(*args) if len(args) else message)
+    global EVENT_SINK
+
+    previous_sink, EVENT_SINK = EVENT_SINK, sink
+    previous_sink.close()
 
 
 
@@ -1264,5 +5973,23 @@ LANGUAGES = {
 
 
 
+# Site specific language codes.
+SITE_LANGUAGES = {
+    "www.opensubtitles.org": ( 2, { "el": "ell" } ),
+    "www.tvsubtitles.net":   ( 1, { "el": "gr" } ),
+}
+
+# Registry of all known language codes.
+LANGUAGE_REGISTRY = Language_registry(LANGUAGES, SITE_LANGUAGES)
+
+# The sink of the log messages and the structured events (see
+# set_event_sink()).
+EVENT_SINK = Console_event_sink()
+
+# Adaptive concurrency limits of the requests to the hosts.
+CONCURRENCY_LIMITERS = Concurrency_limiters()
+
+
+
 if __name__ == "__main__":
     pysd = Pysd()
@@ -0,0 +1,198 @@
+"""Fixtures of the pysd tests: local stand-in servers of the subtitles sources."""
+
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pysd
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from xmlrpc.server import SimpleXMLRPCRequestHandler, SimpleXMLRPCServer
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from SimpleXMLRPCServer import SimpleXMLRPCRequestHandler, SimpleXMLRPCServer
+
+
+class Stand_in_server(ThreadingMixIn, HTTPServer):
+    """
+    A local HTTP server which serves the preset pages: a dictionary of page
+    data (bytes, a (content encoding, encoded data) tuple or an HTTP error
+    code) by the request paths, or a function
+    which returns it by the request path. Records the requested paths (and
+    the request targets with the Host headers, to check the requests sent
+    to a proxy) and delays every response by the delay function result (in
+    seconds).
+    """
+
+    daemon_threads = True
+
+    def __init__(self, pages = None):
+        HTTPServer.__init__(self, ( "127.0.0.1", 0 ), Stand_in_request_handler)
+
+        self.pages = {} if pages is None else pages
+        self.delay = None
+        self.requests = []
+        self.targets = []
+        self.url = "http://127.0.0.1:{0}".format(self.server_address[1])
+        self.lock = threading.Lock()
+
+
+    def get_page(self, target, hosts):
+        path = get_request_path(target)
+
+        with self.lock:
+            self.requests.append(path)
+            self.targets.append(( target, hosts ))
+
+        if self.delay is not None:
+            time.sleep(self.delay())
+
+        if callable(self.pages):
+            return self.pages(path)
+
+        return self.pages.get(path, 404)
+
+
+    def count(self, path):
+        """Returns the number of the requests of the path."""
+
+        with self.lock:
+            return self.requests.count(path)
+
+
+
+class Stand_in_request_handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        page = self.server.get_page(self.path, get_host_headers(self.headers))
+
+        if isinstance(page, int):
+            self.send_error(page)
+            return
+
+        self.send_response(200)
+
+        if isinstance(page, tuple):
+            encoding, page = page
+            self.send_header("Content-Encoding", encoding)
+
+        self.send_header("Content-Length", str(len(page)))
+        self.end_headers()
+        self.wfile.write(page)
+
+
+    def log_message(self, format, *args):
+        pass
+
+
+
+class Stand_in_xml_rpc_server(ThreadingMixIn, SimpleXMLRPCServer):
+    """
+    A local XML-RPC server of www.opensubtitles.org API which calls the
+    methods of the handler object. Records the called method names (and the
+    request targets with the Host headers, like Stand_in_server) and delays
+    every call by the delay function result (in seconds).
+    """
+
+    daemon_threads = True
+
+    def __init__(self, handler):
+        SimpleXMLRPCServer.__init__(self, ( "127.0.0.1", 0 ), Stand_in_xml_rpc_request_handler,
+            logRequests = False, allow_none = True)
+
+        self.handler = handler
+        self.delay = None
+        self.calls = []
+        self.targets = []
+        self.url = "http://127.0.0.1:{0}".format(self.server_address[1])
+        self.lock = threading.Lock()
+
+
+    def _dispatch(self, method, params):
+        with self.lock:
+            self.calls.append(method)
+
+        if self.delay is not None:
+            time.sleep(self.delay())
+
+        return getattr(self.handler, method)(*params)
+
+
+    def count(self, method):
+        """Returns the number of the calls of the method."""
+
+        with self.lock:
+            return self.calls.count(method)
+
+
+
+class Stand_in_xml_rpc_request_handler(SimpleXMLRPCRequestHandler):
+    def is_rpc_path_valid(self):
+        with self.server.lock:
+            self.server.targets.append(( self.path, get_host_headers(self.headers) ))
+
+        return get_request_path(self.path) == "/xml-rpc"
+
+
+
+def get_request_path(target):
+    """Returns the path of a request target (a proxy gets an absolute URI)."""
+
+    return "/" + ( target.split("/", 3)[3] if "://" in target else target.lstrip("/") )
+
+
+def get_host_headers(headers):
+    """Returns a list of the Host header values of a request."""
+
+    return [ value for name, value in headers.items() if name.lower() == "host" ]
+
+
+def start_server(servers, server):
+    """Serves the requests in a background thread until the test ends."""
+
+    thread = threading.Thread(target = server.serve_forever, args = ( 0.01, ))
+    thread.daemon = True
+    thread.start()
+    servers.append(server)
+    return server
+
+
+@pytest.fixture
+def xml_rpc_server():
+    """Returns a function which starts Stand_in_xml_rpc_server objects."""
+
+    servers = []
+
+    yield lambda handler: start_server(servers, Stand_in_xml_rpc_server(handler))
+
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def stand_in_server():
+    """Returns a function which starts Stand_in_server objects."""
+
+    servers = []
+
+    yield lambda pages = None: start_server(servers, Stand_in_server(pages))
+
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture(autouse = True)
+def isolated_cache(tmp_path, monkeypatch):
+    """Keeps the pysd cache files in a temporary directory."""
+
+    monkeypatch.setattr(pysd, "CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(pysd, "CONCURRENCY_LIMITERS", pysd.Concurrency_limiters())
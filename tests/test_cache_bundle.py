@@ -0,0 +1,82 @@
+"""Cache bundles of the subtitles sources' caches."""
+
+import io
+import os
+import zipfile
+
+import pysd
+
+
+def zip_data(name, contents):
+    data = io.BytesIO()
+
+    with zipfile.ZipFile(data, "w") as zip_file:
+        zip_file.writestr(name, contents)
+
+    return data.getvalue()
+
+
+def create_tools(server, use_opensubtitles = False):
+    tools = pysd.Tv_show_tools(use_opensubtitles, endpoints = { "www.tvsubtitles.net": [ pysd.Endpoint(server.url) ] })
+    tools.log_info = tools.log_error = lambda message, *args: None
+    return tools
+
+
+def create_media_file(directory):
+    os.makedirs(directory)
+
+    with open(os.path.join(directory, "show.s01e01.avi"), "w") as media_file:
+        media_file.write(directory)
+
+
+def test_bundle_round_trip(tmp_path, stand_in_server):
+    subtitles = zip_data("show.s01e01.srt", b"one")
+    server = stand_in_server({
+        "/tvshows.html": b'<a href="/tvshow-7-1.html">Show</a>',
+        "/tvshow-7-1.html": b'<td></td><td><a href="episode-7-1.html">All</a>'
+                            b'<td>1x01</td><td><a href="/episode-101.html">Episode</a>',
+        "/episode-101.html": b'<a href="/subtitle-551.html"><img src="images/flags/en.gif"><p title="downloaded">5</p></a>',
+        "/download-551.html": subtitles,
+    })
+    bundle_path = str(tmp_path / "bundle.gz")
+
+    create_media_file(str(tmp_path / "first" / "show"))
+    tools = create_tools(server)
+    assert tools.get_subtitles([ str(tmp_path / "first" / "show") ], [ "en" ]) == 0
+    tools.export_cache(bundle_path)
+
+    # A warmed instance only downloads the subtitles file
+    other_server = stand_in_server({ "/download-551.html": subtitles })
+    create_media_file(str(tmp_path / "second" / "show"))
+    tools = create_tools(other_server)
+    tools.import_cache(bundle_path)
+
+    assert tools.get_subtitles([ str(tmp_path / "second" / "show") ], [ "en" ]) == 0
+    assert other_server.requests == [ "/download-551.html" ]
+
+
+def test_newer_entries_win_on_merge(tmp_path, stand_in_server):
+    older_path, newer_path, merged_path = [ str(tmp_path / name) for name in ( "older.gz", "newer.gz", "merged.gz" ) ]
+
+    def save(path, updated, episode_id, url):
+        pysd.Cache_bundle.save(path, [
+            [ "www.tvsubtitles.net", "show", updated, "show", 7 ],
+            [ "www.tvsubtitles.net", "season", updated, "show", 7, 1, [ [ 1, episode_id, None ] ] ],
+            [ "www.opensubtitles.org", "subtitles", updated, "0123456789abcdef", "en", url, "1" ],
+        ])
+
+    save(older_path, 100, 101, "http://older/1.gz")
+    save(newer_path, 200, 201, "http://newer/1.gz")
+
+    # The order of the imports doesn't matter
+    for paths in ( [ older_path, newer_path ], [ newer_path, older_path ] ):
+        tools = create_tools(stand_in_server(), use_opensubtitles = True)
+        for path in paths:
+            tools.import_cache(path)
+        tools.export_cache(merged_path)
+
+        records = dict( ( tuple(record[:2]), record[2:] ) for record in pysd.Cache_bundle.load(merged_path) )
+
+        assert records[( "www.tvsubtitles.net", "season" )] == [ 200, "show", 7, 1, [ [ 1, 201, None ] ] ]
+        assert records[( "www.opensubtitles.org", "subtitles" )] == [
+            200, "0123456789abcdef", "en", "http://newer/1.gz", "1" ]
@@ -0,0 +1,108 @@
+"""Adaptive concurrency limiter against local stand-in servers."""
+
+import random
+import threading
+import time
+
+import pysd
+
+
+def release(limiter, latency, saturated = True):
+    start_time, token_saturated = limiter.acquire()
+    limiter.release(( start_time, saturated ), latency)
+
+
+def test_limit_grows_while_latency_is_flat():
+    limiter = pysd.Concurrency_limiter("host")
+
+    for request in range(100):
+        release(limiter, 0.05)
+
+    assert limiter.limit == pysd.MAX_CONCURRENCY
+
+
+def test_few_slow_responses_do_not_cut_the_limit():
+    limiter = pysd.Concurrency_limiter("host")
+
+    # Too few observations to have a baseline
+    release(limiter, 0.01)
+    release(limiter, 0.5)
+    release(limiter, 0.5)
+
+    assert int(limiter.limit) >= 2
+
+    # A single slow response after the baseline is established
+    for request in range(50):
+        release(limiter, 0.01, saturated = False)
+
+    limit = limiter.limit
+    release(limiter, 0.5, saturated = False)
+
+    assert limiter.limit == limit
+
+
+def test_rising_latency_cuts_the_limit():
+    limiter = pysd.Concurrency_limiter("host")
+
+    for request in range(50):
+        release(limiter, 0.01)
+
+    limit = limiter.limit
+    time.sleep(0.01)
+
+    for request in range(20):
+        release(limiter, 0.1)
+
+    assert limiter.limit < limit
+
+
+def test_throttling_cuts_the_limit():
+    limiter = pysd.Concurrency_limiter("host")
+    limiter.release(limiter.acquire(), overloaded = True)
+
+    assert int(limiter.limit) == 1
+    assert limiter.get_metrics()["overloads"] == 1
+
+
+def test_jittered_latency_does_not_collapse_the_limit(stand_in_server):
+    # 50 ms median latency with lognormal jitter and no queueing
+    jitter = random.Random(0)
+    server = stand_in_server(lambda path: b"ok")
+    server.delay = lambda: 0.05 * jitter.lognormvariate(0, 0.5)
+
+    start_time = time.time()
+    pysd.run_concurrently(lambda request: pysd.get_url_contents(server.url + "/", retry = False),
+        [ ( request, ) for request in range(16 * 60) ], 16)
+    elapsed = time.time() - start_time
+
+    metrics = pysd.CONCURRENCY_LIMITERS.get_metrics()[server.url.split("/")[2]]
+    limits = [ limit for change_time, limit in metrics["history"] ]
+
+    # The limit grows and the jitter doesn't cut it much
+    assert len(server.requests) == 16 * 60
+    assert metrics["limit"] >= 12
+    assert min(limits[limits.index(8):]) >= 8
+
+    # About 3.5 s with 16 requests in flight (the collapsed limit takes 30 s)
+    assert elapsed < 10
+
+
+def test_slot_is_released_when_headers_arrive(stand_in_server):
+    server = stand_in_server({ "/catalogue.html": b"x" * 4 * 1024 * 1024, "/page.html": b"page" })
+    limiter = pysd.CONCURRENCY_LIMITERS.get(server.url)
+    limiter.limit = 1.0
+
+    # A big download is being read
+    chunks = pysd.iter_url_contents(server.url + "/catalogue.html", max_data_size = None)
+    next(chunks)
+
+    assert limiter.in_flight == 0
+
+    pages = []
+    request = threading.Thread(target = lambda: pages.append(pysd.get_url_contents(server.url + "/page.html")))
+    request.daemon = True
+    request.start()
+    request.join(5)
+
+    assert pages == [ b"page" ]
+    assert sum( len(chunk) for chunk in chunks ) + pysd.NETWORK_CHUNK_SIZE == 4 * 1024 * 1024
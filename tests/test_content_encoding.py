@@ -0,0 +1,67 @@
+"""Compressed responses against a local stand-in server."""
+
+import gzip
+import io
+import os
+import zlib
+
+import pytest
+
+import pysd
+
+# Incompressible page data bigger than a network chunk.
+DATA = os.urandom(3 * pysd.NETWORK_CHUNK_SIZE // 2)
+
+
+def gzip_data(data):
+    gzip_file = io.BytesIO()
+
+    with gzip.GzipFile(fileobj = gzip_file, mode = "wb") as gzip_writer:
+        gzip_writer.write(data)
+
+    return gzip_file.getvalue()
+
+
+def deflate_data(data):
+    compressor = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+@pytest.mark.parametrize("page", [
+    ( "gzip", gzip_data(DATA) ),
+    ( "deflate", zlib.compress(DATA) ),
+    ( "deflate", deflate_data(DATA) ),
+    DATA,
+], ids = [ "gzip", "zlib", "raw deflate", "identity" ])
+def test_encoded_page_is_decoded(stand_in_server, page):
+    server = stand_in_server({ "/page.html": page })
+    stats = {}
+
+    assert b"".join(pysd.iter_url_contents(server.url + "/page.html", stats = stats)) == DATA
+
+    wire_bytes = len(page[1] if isinstance(page, tuple) else page)
+    assert stats == { "wire_bytes": wire_bytes, "decoded_bytes": len(DATA) }
+
+    # The traffic is counted in the host's metrics
+    metrics = pysd.CONCURRENCY_LIMITERS.get_metrics()[server.url.split("/")[2]]
+    assert ( metrics["wire_bytes"], metrics["decoded_bytes"] ) == ( wire_bytes, len(DATA) )
+
+
+@pytest.mark.parametrize("page", [
+    ( "gzip", gzip_data(b"\0" * 64 * 1024 * 1024) ),
+    ( "deflate", zlib.compress(b"\0" * 64 * 1024 * 1024) ),
+    ( "deflate", deflate_data(b"\0" * 64 * 1024 * 1024) ),
+], ids = [ "gzip", "zlib", "raw deflate" ])
+def test_bomb_stops_at_max_data_size(stand_in_server, page):
+    server = stand_in_server({ "/bomb.html": page })
+    decoded = []
+
+    with pytest.raises(pysd.Error) as error:
+        for chunk in pysd.iter_url_contents(server.url + "/bomb.html", max_data_size = 1024 * 1024):
+            decoded.append(len(chunk))
+
+    assert "too big" in str(error.value)
+
+    # The data is decompressed by chunks which are not held in memory
+    assert sum(decoded) <= 1024 * 1024
+    assert max(decoded) <= pysd.NETWORK_CHUNK_SIZE
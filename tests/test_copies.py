@@ -0,0 +1,49 @@
+"""Copies of the same media files (hardlinks) are served once."""
+
+import io
+import os
+import zipfile
+
+import pysd
+
+
+def zip_data(name, contents):
+    data = io.BytesIO()
+
+    with zipfile.ZipFile(data, "w") as zip_file:
+        zip_file.writestr(name, contents)
+
+    return data.getvalue()
+
+
+def test_hardlinked_copy_is_downloaded_once(tmp_path, stand_in_server, monkeypatch):
+    # Not the downloads cache but the scheduling by inode saves the download
+    monkeypatch.setattr(pysd, "DOWNLOADS_CACHE_SIZE", 0)
+
+    server = stand_in_server({
+        "/tvshows.html": b'<a href="/tvshow-7-1.html">Show</a>',
+        "/tvshow-7-1.html": b'<td></td><td><a href="episode-7-1.html">All</a>'
+                            b'<td>1x01</td><td><a href="/episode-101.html">Episode</a>',
+        "/episode-101.html": b'<a href="/subtitle-551.html"><img src="images/flags/en.gif"><p title="downloaded">5</p></a>',
+        "/download-551.html": zip_data("show.s01e01.srt", b"one"),
+    })
+
+    original_dir, copy_dir = str(tmp_path / "show"), str(tmp_path / "copy" / "show")
+    os.makedirs(original_dir)
+    os.makedirs(copy_dir)
+
+    with open(os.path.join(original_dir, "show.s01e01.avi"), "w") as media_file:
+        media_file.write("media")
+    os.link(os.path.join(original_dir, "show.s01e01.avi"), os.path.join(copy_dir, "show.s01e01.avi"))
+
+    tools = pysd.Tv_show_tools(endpoints = { "www.tvsubtitles.net": [ pysd.Endpoint(server.url) ] })
+    tools.log_info = tools.log_error = lambda message, *args: None
+
+    assert tools.get_subtitles([ original_dir, copy_dir ], [ "en" ]) == 0
+
+    for directory in ( original_dir, copy_dir ):
+        with open(os.path.join(directory, "show.s01e01.en.srt"), "rb") as subtitles_file:
+            assert subtitles_file.read() == b"one"
+
+    assert server.count("/episode-101.html") == 1
+    assert server.count("/download-551.html") == 1
@@ -0,0 +1,122 @@
+"""Mirror and proxy endpoints against local stand-in servers."""
+
+import pytest
+
+import pysd
+
+# URL of a proxy which refuses the connections.
+DEAD_PROXY = "http://127.0.0.1:1"
+
+
+class Api:
+    """A stand-in of www.opensubtitles.org XML-RPC API which sessions are named by the server."""
+
+    def __init__(self, name):
+        self.name = name
+        self.searches = []
+
+    def LogIn(self, user, password, language, user_agent):
+        return { "status": "200 OK", "token": "token-" + self.name }
+
+    def LogOut(self, token):
+        return { "status": "200 OK" }
+
+    def SearchSubtitles(self, token, movies):
+        self.searches.append(token)
+        return { "status": "200 OK", "data": [] }
+
+
+def get_page(pool, url):
+    return pool.call(lambda endpoint: pysd.get_url_contents(
+        endpoint.get_url(url), proxy = endpoint.proxy, retry = False ))
+
+
+def lookup(downloader):
+    subtitles, errors = downloader.lookup([ { "hash": "0123456789abcdef", "size": 1000, "languages": [ "en" ] } ])[0]
+    assert errors == []
+
+
+def test_pool_ranks_endpoints_by_latency(stand_in_server):
+    slow, fast = stand_in_server(lambda path: b"slow"), stand_in_server(lambda path: b"fast")
+    slow.delay = lambda: 0.05
+
+    pool = pysd.Endpoint_pool([ pysd.Endpoint(proxy = slow.url), pysd.Endpoint(proxy = fast.url) ])
+    pages = [ get_page(pool, "http://www.tvsubtitles.net/page.html") for request in range(40) ]
+
+    # Both endpoints are tried first, and then only the least recently used
+    # one is probed every 20 requests
+    assert pages.count(b"fast") >= 37
+    assert len(slow.requests) == 40 - pages.count(b"fast")
+    assert [ metrics["endpoint"] for metrics in pool.get_metrics() ] == [
+        "default via " + fast.url, "default via " + slow.url ]
+    assert sum( metrics["requests"] for metrics in pool.get_metrics() ) == 40
+
+
+def test_pool_falls_back_on_failure(stand_in_server):
+    proxy = stand_in_server({ "/page.html": b"page" })
+    pool = pysd.Endpoint_pool([ pysd.Endpoint(proxy = DEAD_PROXY), pysd.Endpoint(proxy = proxy.url) ])
+
+    assert [ get_page(pool, "http://www.tvsubtitles.net/page.html") for request in range(3) ] == [ b"page" ] * 3
+
+    # The dead endpoint has been tried once
+    metrics = pool.get_metrics()
+    assert [ ( item["endpoint"], item["requests"], item["failures"] ) for item in metrics ] == [
+        ( "default via " + proxy.url, 3, 0 ), ( "default via " + DEAD_PROXY, 1, 1 ) ]
+    assert metrics[1]["error_rate"] > 0
+
+    # The proxy gets the absolute URI with a single Host header
+    assert proxy.targets[0] == ( "http://www.tvsubtitles.net/page.html", [ "www.tvsubtitles.net" ] )
+
+
+def test_pool_does_not_fall_back_on_response_errors(stand_in_server):
+    first, second = stand_in_server(), stand_in_server()
+    pool = pysd.Endpoint_pool([ pysd.Endpoint(first.url), pysd.Endpoint(second.url) ])
+
+    with pytest.raises(pysd.url_request.HTTPError):
+        get_page(pool, "http://www.tvsubtitles.net/missing.html")
+
+    assert ( first.requests, second.requests ) == ( [ "/missing.html" ], [] )
+    assert pool.get_metrics()[0]["failures"] == 0
+
+
+def test_mirror_rewrites_urls(stand_in_server):
+    mirror = stand_in_server({ "/tvshow-7-1.html": b"page" })
+    pool = pysd.Endpoint_pool([ pysd.Endpoint(mirror.url) ])
+
+    assert get_page(pool, "http://www.tvsubtitles.net/tvshow-7-1.html") == b"page"
+    assert mirror.targets == [ ( "/tvshow-7-1.html", [ mirror.url.split("/")[2] ] ) ]
+
+
+def test_xml_rpc_via_proxy(xml_rpc_server):
+    proxy = xml_rpc_server(Api("proxy"))
+    downloader = pysd.Opensubtitles_org(endpoints = [ pysd.Endpoint(proxy = DEAD_PROXY), pysd.Endpoint(proxy = proxy.url) ])
+
+    lookup(downloader)
+
+    assert proxy.calls == [ "LogIn", "SearchSubtitles" ]
+    assert proxy.targets == [ ( "http://api.opensubtitles.org/xml-rpc", [ "api.opensubtitles.org" ] ) ] * 2
+
+    metrics = downloader.get_metrics()["endpoints"]
+    assert [ ( item["endpoint"], item["requests"], item["failures"] ) for item in metrics ] == [
+        ( "default via " + proxy.url, 2, 0 ), ( "default via " + DEAD_PROXY, 1, 1 ) ]
+
+
+def test_xml_rpc_call_is_retried_on_next_endpoint(xml_rpc_server):
+    first_api, second_api = Api("first"), Api("second")
+    first, second = xml_rpc_server(first_api), xml_rpc_server(second_api)
+    downloader = pysd.Opensubtitles_org(endpoints = [ pysd.Endpoint(first.url), pysd.Endpoint(second.url) ])
+
+    lookup(downloader)
+
+    first.shutdown()
+    first.server_close()
+
+    # A new session is opened via the second endpoint for the failed call
+    downloader.lookup([ { "hash": "fedcba9876543210", "size": 1000, "languages": [ "en" ] } ])
+
+    assert ( first_api.searches, second_api.searches ) == ( [ "token-first" ], [ "token-second" ] )
+    assert second.calls == [ "LogIn", "SearchSubtitles" ]
+
+    metrics = dict( ( item["endpoint"], item ) for item in downloader.get_metrics()["endpoints"] )
+    assert metrics[first.url]["failures"] == 1
+    assert metrics[second.url]["failures"] == 0
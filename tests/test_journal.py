@@ -0,0 +1,116 @@
+"""Resumable runs (the run journal)."""
+
+import io
+import json
+import os
+import subprocess
+import sys
+import zipfile
+
+import pytest
+
+import pysd
+
+PYSD_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "pysd.py")
+
+
+def zip_data(name, contents):
+    data = io.BytesIO()
+
+    with zipfile.ZipFile(data, "w") as zip_file:
+        zip_file.writestr(name, contents)
+
+    return data.getvalue()
+
+
+def create_files(directory, names):
+    os.makedirs(directory, exist_ok = True)
+
+    for name in names:
+        with open(os.path.join(directory, name), "w") as media_file:
+            media_file.write(name)
+
+
+def run_pysd(cache_dir, *args):
+    env = dict(os.environ, XDG_CACHE_HOME = cache_dir, LC_ALL = "C.UTF-8")
+    subprocess.check_call([ sys.executable, PYSD_PATH ] + list(args), env = env,
+        stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL)
+
+
+def read_journal(cache_dir):
+    journals = [ name for name in os.listdir(os.path.join(cache_dir, "pysd")) if name.startswith("journal-") ]
+    assert len(journals) == 1
+
+    with open(os.path.join(cache_dir, "pysd", journals[0])) as journal:
+        return [ json.loads(line) for line in journal ]
+
+
+def test_resumed_run_skips_finished_directory(tmp_path):
+    cache_dir, show_dir = str(tmp_path / "cache"), str(tmp_path / "show")
+    create_files(show_dir, [ "show.s01e01.avi", "show.s01e01.en.srt" ])
+
+    run_pysd(cache_dir, "--resume", "-l", "en", show_dir)
+    records = read_journal(cache_dir)
+
+    # The directory is recorded with its own modification time
+    assert records == [ [ "directory", show_dir, os.stat(show_dir).st_mtime ] ]
+
+    run_pysd(cache_dir, "--resume", "-l", "en", show_dir)
+    assert read_journal(cache_dir) == records
+
+    # A new file makes the directory to be scanned again
+    create_files(show_dir, [ "show.s01e02.avi", "show.s01e02.en.srt" ])
+
+    run_pysd(cache_dir, "--resume", "-l", "en", show_dir)
+    assert read_journal(cache_dir) == records + [ [ "directory", show_dir, os.stat(show_dir).st_mtime ] ]
+
+
+def test_resumed_run_retries_only_failed_items(tmp_path, stand_in_server):
+    episode_list = '<td></td><td><a href="episode-7-1.html">All</a>' + "".join(
+        '<td>1x{0:02d}</td><td><a href="/episode-{1}.html">Episode</a>'.format(episode, 100 + episode)
+        for episode in range(1, 7))
+    pages = {
+        "/tvshows.html": b'<a href="/tvshow-7-1.html">Show</a>',
+        "/tvshow-7-1.html": episode_list.encode(),
+        "/download-551.html": zip_data("e1.srt", b"one"),
+        "/download-552.html": b"not a zip file",
+    }
+    for episode in ( 1, 2 ):
+        pages["/episode-10{0}.html".format(episode)] = (
+            '<a href="/subtitle-55{0}.html"><img src="images/flags/en.gif"><p title="downloaded">5</p></a>'
+        ).format(episode).encode()
+
+    server = stand_in_server(pages)
+    show_dir = str(tmp_path / "show")
+    journal_path = str(tmp_path / "journal")
+    create_files(show_dir, [ "show.s01e01.avi", "show.s01e02.avi" ])
+
+    # The newest episodes are processed first: e01 is downloaded before e02
+    # fails and aborts the run
+    os.utime(os.path.join(show_dir, "show.s01e02.avi"), ( 1000000000, 1000000000 ))
+
+    def run():
+        journal = pysd.Run_journal(journal_path, True)
+        tools = pysd.Tv_show_tools(journal = journal,
+            endpoints = { "www.tvsubtitles.net": [ pysd.Endpoint(server.url) ] })
+        tools.log_info = tools.log_error = lambda message, *args: None
+
+        try:
+            return tools.get_subtitles([ show_dir ], [ "en" ])
+        finally:
+            journal.close()
+
+    with pytest.raises(pysd.Error):
+        run()
+
+    assert sorted(os.listdir(show_dir)) == [ "show.s01e01.avi", "show.s01e01.en.srt", "show.s01e02.avi" ]
+
+    # The finished item is not downloaded again even if its subtitles are
+    # removed, and the failed one is retried
+    os.unlink(os.path.join(show_dir, "show.s01e01.en.srt"))
+    pages["/download-552.html"] = zip_data("e2.srt", b"two")
+
+    assert run() == 0
+    assert sorted(os.listdir(show_dir)) == [ "show.s01e01.avi", "show.s01e02.avi", "show.s01e02.en.srt" ]
+    assert server.count("/download-551.html") == 1
+    assert server.count("/download-552.html") == 2
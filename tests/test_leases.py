@@ -0,0 +1,41 @@
+"""Work leases shared between concurrent runs."""
+
+import os
+import subprocess
+import sys
+
+import pysd
+
+PACKAGE_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Tries to acquire a lease in another process and exits without releasing it.
+ACQUIRE = """
+import sys
+sys.path.insert(0, sys.argv[1])
+import pysd
+sys.stdout.write(str(pysd.Work_leases(sys.argv[2]).acquire(( "/media/show.s01e01.avi", "en" ))))
+"""
+
+
+def acquire_in_other_process(leases_path):
+    return subprocess.check_output([ sys.executable, "-c", ACQUIRE, PACKAGE_PATH, leases_path ]).decode()
+
+
+def test_held_lease_is_not_granted_to_other_process(tmp_path):
+    leases_path = str(tmp_path / "leases")
+    leases = pysd.Work_leases(leases_path)
+    key = ( "/media/show.s01e01.avi", "en" )
+
+    assert leases.acquire(key)
+    assert not leases.acquire(key)
+    assert acquire_in_other_process(leases_path) == "False"
+
+    leases.release(key)
+    assert acquire_in_other_process(leases_path) == "True"
+
+    # The lease of the exited process has been released by the kernel
+    assert leases.acquire(key)
+    assert os.listdir(leases_path) != []
+
+    leases.release(key)
+    assert os.listdir(leases_path) == []
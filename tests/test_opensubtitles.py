@@ -0,0 +1,142 @@
+"""www.opensubtitles.org downloader against a local XML-RPC stand-in server."""
+
+import base64
+import gzip
+import io
+import os
+
+import pytest
+
+import pysd
+
+
+def gzip_data(data):
+    gzip_file = io.BytesIO()
+
+    with gzip.GzipFile(fileobj = gzip_file, mode = "wb") as gzip_writer:
+        gzip_writer.write(data)
+
+    return gzip_file.getvalue()
+
+
+class Api:
+    """A stand-in of www.opensubtitles.org XML-RPC API."""
+
+    def __init__(self, download_url, subtitles = None):
+        # Subtitles file data (gzipped) by the subtitles file IDs
+        self.subtitles = {} if subtitles is None else subtitles
+        self.download_url = download_url
+        self.downloaded = []
+
+    def LogIn(self, user, password, language, user_agent):
+        return { "status": "200 OK", "token": "token" }
+
+    def LogOut(self, token):
+        return { "status": "200 OK" }
+
+    def SearchSubtitles(self, token, movies):
+        return { "status": "200 OK", "data": [ {
+            "MovieHash": movie["moviehash"],
+            "ISO639": "en",
+            "SubDownloadsCnt": "1",
+            "IDSubtitleFile": str(movie_id),
+            "SubDownloadLink": "{0}/{1}.gz".format(self.download_url, movie_id),
+        } for movie_id, movie in enumerate(movies) ] }
+
+    def DownloadSubtitles(self, token, ids):
+        self.downloaded.append(ids)
+
+        return { "status": "200 OK", "data": [
+            { "idsubtitlefile": subtitles_id, "data": self.subtitles[subtitles_id] }
+            for subtitles_id in ids if subtitles_id in self.subtitles ] }
+
+
+@pytest.fixture
+def media_files(tmp_path):
+    paths = []
+
+    for episode in range(1, 4):
+        path = str(tmp_path / "show.s01e{0:02d}.avi".format(episode))
+        with open(path, "wb") as media_file:
+            media_file.write(os.urandom(256 * 1024))
+        paths.append(path)
+
+    return paths
+
+
+def find_and_download(downloader, paths):
+    downloader.will_be_requested(paths, [ "en" ])
+    return [ downloader.download(downloader.find(path, "show", 1, episode, "en"))
+        for episode, path in enumerate(paths, 1) ]
+
+
+def test_subtitles_are_downloaded_in_one_call(xml_rpc_server, stand_in_server, media_files):
+    http_server = stand_in_server()
+    api = Api(http_server.url, dict(
+        ( str(movie_id), base64.b64encode(gzip_data("subtitles {0}".format(movie_id).encode())).decode() )
+        for movie_id in range(3) ))
+    server = xml_rpc_server(api)
+    downloader = pysd.Opensubtitles_org(endpoints = [ pysd.Endpoint(server.url) ])
+
+    subtitles = find_and_download(downloader, media_files)
+
+    assert sorted(subtitles) == [ b"subtitles 0", b"subtitles 1", b"subtitles 2" ]
+    assert server.count("SearchSubtitles") == 1
+    assert [ sorted(ids) for ids in api.downloaded ] == [ [ "0", "1", "2" ] ]
+    assert http_server.requests == []
+
+
+def test_multiline_base64_data(xml_rpc_server, stand_in_server, media_files):
+    encoded = base64.encodestring if not hasattr(base64, "encodebytes") else base64.encodebytes
+    data = os.urandom(200 * 1024)
+
+    api = Api(stand_in_server().url, dict(
+        ( str(movie_id), encoded(gzip_data(data)).decode() ) for movie_id in range(3) ))
+    downloader = pysd.Opensubtitles_org(endpoints = [ pysd.Endpoint(xml_rpc_server(api).url) ])
+
+    assert find_and_download(downloader, media_files) == [ data ] * 3
+
+
+def test_oversized_data_falls_back_to_download_link(xml_rpc_server, stand_in_server, media_files):
+    # A gzip bomb: 1 KiB of the compressed data is decompressed to 64 MiB
+    bomb = gzip_data(b"\0" * 64 * 1024 * 1024)
+
+    http_server = stand_in_server(dict(
+        ( "/{0}.gz".format(movie_id), gzip_data("subtitles {0}".format(movie_id).encode()) ) for movie_id in range(3) ))
+    api = Api(http_server.url, dict(
+        ( str(movie_id), base64.b64encode(bomb).decode() ) for movie_id in range(3) ))
+    downloader = pysd.Opensubtitles_org(endpoints = [ pysd.Endpoint(xml_rpc_server(api).url) ])
+
+    subtitles = find_and_download(downloader, media_files)
+
+    assert sorted(subtitles) == [ b"subtitles 0", b"subtitles 1", b"subtitles 2" ]
+    assert sorted(http_server.requests) == [ "/0.gz", "/1.gz", "/2.gz" ]
+
+
+def test_oversized_download_link_data(xml_rpc_server, stand_in_server, media_files):
+    bomb = gzip_data(b"\0" * 64 * 1024 * 1024)
+
+    http_server = stand_in_server(dict( ( "/{0}.gz".format(movie_id), bomb ) for movie_id in range(3) ))
+    downloader = pysd.Opensubtitles_org(endpoints = [ pysd.Endpoint(xml_rpc_server(Api(http_server.url)).url) ])
+
+    downloader.will_be_requested(media_files, [ "en" ])
+    subtitles_id = downloader.find(media_files[0], "show", 1, 1, "en")
+
+    with pytest.raises(pysd.Error) as error:
+        downloader.download(subtitles_id)
+
+    assert "too big" in str(error.value)
+
+
+def test_gunzip_chunks():
+    data = os.urandom(300 * 1024)
+    compressed = gzip_data(data)
+    chunks = [ compressed[offset : offset + 1000] for offset in range(0, len(compressed), 1000) ]
+
+    assert pysd.gunzip_chunks(chunks) == data
+
+    with pytest.raises(pysd.Error):
+        pysd.gunzip_chunks(chunks, max_data_size = len(data) - 1)
+
+    with pytest.raises(pysd.Error):
+        pysd.gunzip_chunks(chunks[:-1])
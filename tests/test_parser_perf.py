@@ -0,0 +1,116 @@
+"""
+Performance regression tests of the www.tvsubtitles.net page parsers: the
+regular expressions are applied to untrusted HTML, so adversarial and
+oversized pages must be parsed in linear time.
+"""
+
+import time
+
+import pytest
+
+import pysd
+
+# Page size of the adversarial pages (the parsers finish such pages in about
+# 0.05-0.4 seconds, and catastrophic backtracking takes minutes).
+PAGE_SIZE = 500 * 1024
+
+# Maximum time to parse a page in seconds.
+TIME_LIMIT = 1.0
+
+
+def repeat(fragment, size = PAGE_SIZE):
+    return fragment * (size // len(fragment))
+
+
+# Fragments which make a naive pattern backtrack: unterminated links and tags,
+# long attribute runs and records which fail to match at the very end.
+ADVERSARIAL_FRAGMENTS = {
+    "unterminated links": '<a href="/tvshow-1-1.html">Show <a href="/subtitle-1.html">x ',
+    "unterminated tags": '<a href="/tvshow-1-1.html" <td <img src="flags/en.gif" <p title="downloaded" ',
+    "attribute runs": "<a " + "x=y " * 256,
+    "long link text": '<a href="/subtitle-1.html">' + "text " * 2048,
+    "cells": "<td>1x1</td><td><td></td><td>",
+    "flags": '<img src="' + "flags/" * 64,
+    "downloads": '<p title="downloaded">' + "1 " * 1024,
+    "whitespace": " \t\n" * 1024 + "<",
+}
+
+
+def create_downloader(server):
+    return pysd.Tvsubtitles_net(use_catalogue_snapshot = False, endpoints = [ pysd.Endpoint(server.url) ])
+
+
+def time_call(function, *args):
+    start_time = time.time()
+    result = function(*args)
+    return result, time.time() - start_time
+
+
+@pytest.mark.parametrize("fragment", sorted(ADVERSARIAL_FRAGMENTS))
+def test_show_list(stand_in_server, fragment):
+    page = repeat(ADVERSARIAL_FRAGMENTS[fragment]) + '<a href="/tvshow-7-1.html">Show</a>'
+    downloader = create_downloader(stand_in_server({ "/tvshows.html": page.encode() }))
+
+    shows, elapsed = time_call(downloader._Tvsubtitles_net__fetch_shows)
+
+    assert shows["show"].id == 7
+    assert elapsed < TIME_LIMIT
+
+
+@pytest.mark.parametrize("fragment", sorted(ADVERSARIAL_FRAGMENTS))
+def test_episode_list(stand_in_server, fragment):
+    page = repeat(ADVERSARIAL_FRAGMENTS[fragment]) + (
+        '<td></td><td><a href="episode-7-1.html">All</a>'
+        '<td>1x02</td><td><a href="/episode-102.html">Episode</a>' )
+    downloader = create_downloader(stand_in_server({ "/tvshow-7-1.html": page.encode() }))
+
+    episodes, elapsed = time_call(downloader._Tvsubtitles_net__fetch_episodes, 7, 1)
+
+    assert episodes.get_id(2) == 102
+    assert elapsed < TIME_LIMIT
+
+
+@pytest.mark.parametrize("fragment", sorted(ADVERSARIAL_FRAGMENTS))
+def test_subtitles_list(stand_in_server, fragment):
+    if fragment in ( "unterminated links", "long link text" ):
+        # A subtitles link without a flag is a parse error
+        page = repeat(ADVERSARIAL_FRAGMENTS[fragment].replace("subtitle-", "sub-"))
+    else:
+        page = repeat(ADVERSARIAL_FRAGMENTS[fragment])
+
+    page += '<a href="/subtitle-555.html"><img src="images/flags/en.gif"><p title="downloaded">5</p></a>'
+    downloader = create_downloader(stand_in_server({ "/episode-101.html": page.encode() }))
+
+    subtitles, elapsed = time_call(downloader._Tvsubtitles_net__fetch_episode_subtitles, 101)
+
+    assert subtitles == { "en": 555 }
+    assert elapsed < TIME_LIMIT
+
+
+def test_oversized_pages(stand_in_server):
+    show_list = "".join(
+        '<tr><td><a href="/tvshow-{0}-1.html">Show {0}</a></td></tr>\n'.format(show_id) for show_id in range(1, 20000) )
+    episode_list = '<td></td><td><a href="episode-7-1.html">All</a>' + "".join(
+        '<tr><td>1x{0}</td><td><a href="/episode-{0}.html">Episode {0}</a></td></tr>\n'.format(episode)
+        for episode in range(1, 8000) )
+    subtitles_list = "".join(
+        '<a href="/subtitle-{0}.html"><div><img src="images/flags/en.gif"> Release {0}'
+        '<p title="downloaded">{0}</p></div></a>\n'.format(subtitles_id) for subtitles_id in range(1, 5000) )
+
+    downloader = create_downloader(stand_in_server({
+        "/tvshows.html": show_list.encode(),
+        "/tvshow-7-1.html": episode_list.encode(),
+        "/episode-101.html": subtitles_list.encode(),
+    }))
+
+    shows, elapsed = time_call(downloader._Tvsubtitles_net__fetch_shows)
+    assert len(shows) == 19999
+    assert elapsed < TIME_LIMIT
+
+    episodes, elapsed = time_call(downloader._Tvsubtitles_net__fetch_episodes, 7, 1)
+    assert episodes.get_id(7999) == 7999
+    assert elapsed < TIME_LIMIT
+
+    subtitles, elapsed = time_call(downloader._Tvsubtitles_net__fetch_episode_subtitles, 101)
+    assert subtitles == { "en": 4999 }
+    assert elapsed < TIME_LIMIT
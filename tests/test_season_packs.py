@@ -0,0 +1,99 @@
+"""Season subtitles pack mode of www.tvsubtitles.net against a stand-in server."""
+
+import io
+import zipfile
+
+import pysd
+
+
+def zip_data(members):
+    data = io.BytesIO()
+
+    with zipfile.ZipFile(data, "w") as zip_file:
+        for name, contents in members:
+            zip_file.writestr(name, contents)
+
+    return data.getvalue()
+
+
+def season_pages():
+    episode_list = '<td></td><td><a href="episode-7-1.html">All</a>' + "".join(
+        '<td>1x{0:02d}</td><td><a href="/episode-{1}.html">Episode</a>'.format(episode, 100 + episode)
+        for episode in range(1, 7))
+
+    return {
+        "/tvshows.html": b'<a href="/tvshow-7-1.html">Show</a>',
+        "/tvshow-7-1.html": episode_list.encode(),
+        "/download-7-1-en.html": zip_data([
+            ( "Show - 1x01 - Pilot.en.srt", b"one" ),
+            ( "show.S01E02.srt", b"two" ),
+            ( "show.s01e03.en.srt", b"three" ),
+            ( "show.s01e03.other-release.srt", b"other three" ),
+            ( "notes.txt", b"not subtitles" ),
+            ( "show.s02e04.srt", b"other season" ),
+        ]),
+        "/episode-104.html": b'<a href="/subtitle-555.html"><img src="images/flags/en.gif"><p title="downloaded">5</p></a>',
+        "/download-555.html": zip_data([ ( "show.s01e04.srt", b"four" ) ]),
+    }
+
+
+def create_downloader(server):
+    downloader = pysd.Tvsubtitles_net(use_catalogue_snapshot = False, endpoints = [ pysd.Endpoint(server.url) ])
+    downloader.will_be_requested_for_season("show", 1, [ 1, 2, 3, 4 ], "en")
+    return downloader
+
+
+def test_season_pack_is_downloaded_once(stand_in_server):
+    server = stand_in_server(season_pages())
+    downloader = create_downloader(server)
+
+    subtitles = [ downloader.get(None, "show", 1, episode, "en") for episode in range(1, 5) ]
+
+    assert subtitles == [ b"one", b"two", b"three", b"four" ]
+    assert server.count("/download-7-1-en.html") == 1
+
+    # The episode which is missing in the pack falls back to its own download
+    assert server.count("/episode-104.html") == 1
+    assert server.count("/download-555.html") == 1
+    assert not any( path.startswith("/episode-10") for path in server.requests if path != "/episode-104.html" )
+
+
+def test_season_pack_outlives_the_downloads_cache(stand_in_server, monkeypatch):
+    monkeypatch.setattr(pysd, "DOWNLOADS_CACHE_SIZE", 1)
+
+    server = stand_in_server(season_pages())
+    downloader = create_downloader(server)
+
+    subtitles_ids = [ downloader.find(None, "show", 1, episode, "en") for episode in range(1, 4) ]
+
+    # Other downloads don't evict the pack members
+    for subtitles_id in subtitles_ids + [ downloader.find(None, "show", 1, 4, "en") ] + subtitles_ids:
+        downloader.download(subtitles_id)
+
+    assert server.count("/download-7-1-en.html") == 1
+
+
+def test_evicted_season_pack_is_downloaded_again(stand_in_server, monkeypatch):
+    monkeypatch.setattr(pysd, "SEASON_PACKS_CACHE_SIZE", 0)
+
+    server = stand_in_server(season_pages())
+    downloader = create_downloader(server)
+
+    assert downloader.get(None, "show", 1, 2, "en") == b"two"
+    assert server.count("/download-7-1-en.html") == 2
+
+
+def test_season_pack_failure_falls_back_to_episodes(stand_in_server, monkeypatch):
+    # Don't wait between the retries
+    monkeypatch.setattr(pysd.time, "sleep", lambda seconds: None)
+
+    pages = season_pages()
+    pages["/download-7-1-en.html"] = 404
+    pages["/episode-101.html"] = b'<a href="/subtitle-551.html"><img src="images/flags/en.gif"><p title="downloaded">5</p></a>'
+    pages["/download-551.html"] = zip_data([ ( "show.s01e01.srt", b"episode one" ) ])
+
+    server = stand_in_server(pages)
+    downloader = create_downloader(server)
+
+    assert downloader.get(None, "show", 1, 1, "en") == b"episode one"
+    assert server.count("/download-551.html") == 1
@@ -0,0 +1,28 @@
+"""Local subtitles service."""
+
+import os
+import stat
+import threading
+import time
+
+import pysd
+
+
+def test_socket_is_accessible_only_by_the_user(tmp_path):
+    socket_path = str(tmp_path / "pysd.sock")
+    service = pysd.Subtitles_service(socket_path)
+    service.log_info = lambda message, *args: None
+
+    server = threading.Thread(target = service.serve)
+    server.daemon = True
+    server.start()
+
+    for attempt in range(100):
+        if os.path.exists(socket_path):
+            break
+        time.sleep(0.01)
+
+    assert stat.S_IMODE(os.stat(socket_path).st_mode) == 0o600
+
+    client = pysd.Subtitles_service_client(socket_path)
+    assert sorted(client.get_metrics()) == [ "hosts", "sources" ]
@@ -0,0 +1,42 @@
+"""Local subtitles store."""
+
+import os
+import time
+
+import pysd
+
+
+def test_least_recently_used_object_is_evicted(tmp_path):
+    store = pysd.Subtitles_store(str(tmp_path / "store"), max_size = 3000)
+    objects_path = str(tmp_path / "store" / "objects")
+
+    for subtitles_id in ( "a", "b", "c" ):
+        store.put(subtitles_id, subtitles_id.encode() * 1000)
+
+    # The objects have been stored a while ago and then "a" is used
+    for name in os.listdir(objects_path):
+        object_path = os.path.join(objects_path, name)
+        os.utime(object_path, ( time.time() - 60, os.stat(object_path).st_mtime ))
+
+    assert store.get("a") == b"a" * 1000
+
+    # The size cap is hit
+    store.put("d", b"d" * 1000)
+
+    assert [ store.get(subtitles_id) for subtitles_id in ( "a", "b", "c", "d" ) ] == [
+        b"a" * 1000, None, None, b"d" * 1000 ]
+    assert len(os.listdir(objects_path)) == 2
+
+
+def test_hardlinked_subtitles_keep_their_mtime(tmp_path):
+    store = pysd.Subtitles_store(str(tmp_path / "store"), place_mode = pysd.Subtitles_store.PLACE_HARDLINK)
+    store.put("a", b"subtitles")
+
+    subtitles_path = str(tmp_path / "show.s01e01.en.srt")
+    store.place("a", subtitles_path)
+    mtime = os.stat(subtitles_path).st_mtime - 60
+    os.utime(subtitles_path, ( mtime, mtime ))
+
+    # Using the object doesn't touch the hardlinked file's mtime
+    assert store.get("a") == b"subtitles"
+    assert os.stat(subtitles_path).st_mtime == mtime